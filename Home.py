@@ -2,6 +2,7 @@ import streamlit as st
 import streamlit.components.v1 as components
 
 from utils.hold_data import place_logos, config_page
+from utils.tracing_utils import trace_page
 from utils.config import AppConfig
 
 config = AppConfig()
@@ -29,4 +30,5 @@ def main():
     render_home()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with trace_page('Home'):
+        main()
\ No newline at end of file
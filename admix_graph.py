@@ -1,177 +1,153 @@
 import os
-import sys
-import subprocess
+import re
+import argparse
 import numpy as np
 import pandas as pd
-import streamlit as st
-import plotly.express as px
 import plotly.graph_objects as go
-import plotly.io as pio
-import seaborn as sns
-from PIL import Image
-import datetime
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-from geneview.palette._palettes import generate_colors_palette
-from geneview.popgene._admixture import _draw_admixtureplot
-from geneview.algorithm._cluster import hierarchical_cluster
-from itertools import cycle
-from matplotlib.colors import to_rgba
-from matplotlib.cm import ScalarMappable
-from hold_data import blob_as_csv, get_gcloud_bucket
-
-st.set_page_config(page_title = "Hidden Page", layout = 'wide')
-
-'''Will update depending on changes needed for Admix Graph. This script does not display to any pages,
-only used to create and save Admix Plot in order to avoid loading times. Utilizes functions from Geneview
-package by Shujia Huang (https://github.com/ShujiaHuang/geneview)'''
-
-# def generate_colors_palette(cmap="viridis", n_colors=10, alpha=1.0):
-#     """Generate colors from matplotlib colormap; pass list to use exact colors"""
-#     if isinstance(cmap, list):
-#         colors = [list(to_rgba(color, alpha=alpha)) for color in cmap]
-#     else:
-#         scalar_mappable = ScalarMappable(cmap=cmap)
-#         colors = scalar_mappable.to_rgba(range(n_colors), alpha=alpha).tolist()
-#     return colors
-
-# def _draw_admixtureplot(
-#         data=None,
-#         group_order=None,
-#         linewidth=1.0,
-#         palette="tab10",
-#         xticklabels=None,
-#         xticklabel_kws=None,
-#         ylabel=None,
-#         ylabel_kws=None,
-#         hierarchical_kws=None,
-#         ax=None
-# ):
-#     """Plot admixture.
-#     Parameters
-#     ----------
-#     data : dict.
-#         Input data structure. The key of `data` is the name of sub population and the
-#         value of `data` is a pandas.DataFrame which contain the admixture output (.Q)
-#         of the specify population. e.g:
-#         data = {"sub-pop1": pandas.DataFrame("admixture result(.Q) for 'sub-pop1'"),
-#                 "sub-pop2": pandas.DataFrame("admixture result(.Q) for 'sub-pop2'")}
-#     group_order : vector of strings, optional
-#         Specify the order of processing and plotting for the estimating sub populations.
-#     """
-#     if ax is None:
-#         _, ax = plt.subplots(1, 1, figsize=(14, 2), facecolor="w", constrained_layout=True)
-
-#     if hierarchical_kws is None:
-#         hierarchical_kws = {"method": "average", "metric": "euclidean"}
-#     if "axis" not in hierarchical_kws:
-#         hierarchical_kws["axis"] = 0  # row axis (by sample) to use to calculate cluster.
-
-#     if group_order is None:
-#         group_order = list(set(data.keys()))
-
-#     n = 0
-#     for g in group_order:
-#         n += len(data[g])
-#         # hc = hierarchical_cluster(data=data[g], **hierarchical_kws)
-#         # data[g] = hc.data.iloc[hc.reordered_index]  # re-order the data.
-
-#     x = np.arange(n)
-#     base_y = np.zeros(len(x))
-
-#     column_names = data[group_order[0]].columns
-
-#     # st.write(data)
-#     # st.write(column_names)
-
-#     colors = generate_colors_palette(cmap=palette, n_colors=len(column_names))
-#     palette = cycle(colors)
-
-#     for k in column_names:
-#         c = next(palette)  # one color for one 'k'
-#         print(c, k)
-#         start_g_pos = 0
-#         add_y = []
-#         for g in group_order:  # keep group order
-#             try:
-#                 y = data[g][k]
-#                 end_g_pos = start_g_pos + len(y)
-#                 ax.bar(x[start_g_pos:end_g_pos], y, bottom=base_y[start_g_pos:end_g_pos],
-#                        color=c, width=1.0, linewidth=0)
-
-#                 start_g_pos = end_g_pos
-#                 add_y.append(y)
-#             except KeyError:
-#                 raise KeyError("KeyError: '%s'. Missing in 'group_order'." % g)
-
-#         base_y += np.array(pd.concat(add_y, axis=0))
-
-#     g_pos = 0
-#     xticks_pos = []
-#     for g in group_order:  # make group order
-#         g_size = len(data[g])
-#         xticks_pos.append(g_pos + 0.5 * g_size)
-
-#         g_pos += g_size
-#         ax.axvline(x=g_pos, color="k", lw=linewidth)
-
-#     ax.spines["left"].set_linewidth(linewidth)
-#     ax.spines["top"].set_linewidth(linewidth)
-#     ax.spines["right"].set_linewidth(linewidth)
-#     ax.spines["bottom"].set_linewidth(linewidth)
-
-#     ax.set_xlim([x[0], x[-1]])
-#     ax.set_ylim([0, 1.0])
-#     ax.tick_params(bottom=False, top=False, left=False, right=False)
-
-#     if xticklabel_kws is None:
-#         xticklabel_kws = {}
-
-#     if xticklabels and (len(group_order) != len(xticklabels)):
-#         raise ValueError("The size of 'xticklabels'(%d) is not the same with "
-#                          "'group_order'(%d)." % (len(xticklabels), len(group_order)))
-
-#     ax.set_xticks(xticks_pos)
-#     ax.set_xticklabels(group_order if xticklabels is None else xticklabels,
-#                        **xticklabel_kws)
-
-#     if ylabel_kws is None:
-#         ylabel_kws = {}
-
-#     ax.set_ylabel(ylabel, **ylabel_kws)
-#     ax.set_yticks([])
-
-#     # ax.legend(column_names)
-
-#     return ax
-
-ref_admix = pd.read_csv('data/ref_panel_admixture_9.txt', sep='\s+')
-# ref_panel_bucket_name = 'ref_panel'
-# ref_panel_bucket = get_gcloud_bucket(ref_panel_bucket_name)
-# ref_admix = blob_as_csv(ref_panel_bucket, 'ref_panel_admixture.txt')
-
-st.dataframe(ref_admix.head())
-
-
-admix_pop_info = ref_admix['ancestry']
-st.dataframe(admix_pop_info.head())
-# admixture_output = ref_admix[['pop1', 'pop2', 'pop3', 'pop4', 'pop5', 'pop6', 'pop7', 'pop8', 'pop9', 'pop10']]
-admixture_output = ref_admix[['pop1', 'pop2', 'pop3', 'pop4', 'pop5', 'pop6', 'pop7', 'pop8', 'pop9']]
-st.dataframe(admixture_output)
-
-df = admixture_output
-sample_info = ref_admix
-popset = set(ref_admix['ancestry'])
-
-data = {}
-for g in popset:
-    g_data = df[sample_info['ancestry'] == g].copy()
-    # g_size = len(g_data)
-    data[g] = g_data
-
-
-f, ax = plt.subplots(1, 1, figsize=(14, 2), facecolor="w", constrained_layout=True, dpi=300)
-ax = _draw_admixtureplot(data=data, ax=ax)
-
-st.pyplot(f)
-
-f.savefig('data/refpanel_admix_9.png')
\ No newline at end of file
+from concurrent.futures import ProcessPoolExecutor
+from scipy.cluster.hierarchy import linkage, leaves_list
+
+'''Builds the reference panel admixture figures shown on the Ancestry page's Admixture Populations tab
+from ADMIXTURE output tables (one sample per row with an ancestry column and pop1..popK columns),
+for every K given. Each table produces refpanel_admix_{K}.png, a static stacked bar plot, and
+refpanel_admix_{K}.json, a downsampled interactive Plotly version for render_tab_admix. Upload both to
+gs://genotools-server/cohort_browser/frontend/ afterwards.'''
+
+ADMIX_PALETTE = [
+    "#88CCEE", "#CC6677", "#DDCC77", "#117733", "#332288", "#D55E00", "#999933", "#882255",
+    "#661100", "#F0E442", "#40B0A6", "#AA4499", "#44AA99", "#6699CC", "#888888"
+]
+
+
+def admix_palette(k):
+    """
+    Colors of K admixture components: ADMIX_PALETTE, extended with evenly spaced hues past its length.
+    """
+    extra = [matplotlib.colors.to_hex(matplotlib.colors.hsv_to_rgb((hue, 0.6, 0.75)))
+             for hue in np.linspace(0, 1, max(k - len(ADMIX_PALETTE), 0), endpoint=False)]
+    return (ADMIX_PALETTE + extra)[:k]
+
+
+def read_admixture(path):
+    admix = pd.read_csv(path, sep=r'\s+')
+    pop_cols = sorted([col for col in admix.columns if re.fullmatch(r'pop\d+', col)], key=lambda col: int(col[3:]))
+    return admix, pop_cols
+
+
+def cluster_order(q_values, method='average', metric='euclidean'):
+    """
+    Hierarchical clustering leaf order of one group's samples (rows of `q_values`).
+    """
+    if len(q_values) < 3:
+        return np.arange(len(q_values))
+    return leaves_list(linkage(q_values, method=method, metric=metric))
+
+
+def order_samples(admix, pop_cols, group_col='ancestry', workers=None):
+    """
+    Order samples by group, then by hierarchical clustering within each group. Groups are
+    clustered in parallel on a process pool.
+
+    Returns:
+        tuple: (Q matrix in plotting order, group names, group boundaries as row offsets)
+    """
+    groups = sorted(admix[group_col].unique())
+    group_q = [admix.loc[admix[group_col] == group, pop_cols].to_numpy(dtype=np.float64) for group in groups]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        orders = list(pool.map(cluster_order, group_q))
+
+    q_ordered = np.concatenate([q[order] for q, order in zip(group_q, orders)])
+    bounds = np.concatenate([[0], np.cumsum([len(q) for q in group_q])])
+    return q_ordered, groups, bounds
+
+
+def admixture_image(q_ordered, colors, height=200):
+    """
+    Rasterize stacked admixture bars into one RGB image (height x n_samples), so the whole
+    plot is drawn with a single imshow call instead of one bar call per component and group.
+    """
+    cum = np.cumsum(q_ordered, axis=1)
+    totals = cum[:, -1:]
+    # rows of all-zero proportions are left white rather than dividing by zero
+    cum = np.divide(cum, totals, out=np.ones_like(cum), where=totals > 0)
+    levels = (np.arange(height) + 0.5) / height
+    component = (levels[:, None, None] > cum[None, :, :]).sum(axis=2)
+    component = np.minimum(component, len(colors) - 1)
+    image = colors[component[::-1]]
+    image[:, totals[:, 0] <= 0] = 1.0
+    return image
+
+
+def plot_admixture(q_ordered, groups, bounds, out_path, dpi=300):
+    colors = np.array([matplotlib.colors.to_rgb(c) for c in admix_palette(q_ordered.shape[1])])
+    fig, ax = plt.subplots(1, 1, figsize=(14, 2), facecolor="w", constrained_layout=True, dpi=dpi)
+    ax.imshow(admixture_image(q_ordered, colors), aspect='auto', interpolation='nearest',
+              extent=[0, len(q_ordered), 0, 1])
+    ax.vlines(bounds[1:-1], 0, 1, color='k', lw=1.0)
+    ax.set_xlim([0, len(q_ordered)])
+    ax.set_ylim([0, 1.0])
+    ax.set_xticks((bounds[:-1] + bounds[1:]) / 2)
+    ax.set_xticklabels(groups)
+    ax.set_yticks([])
+    ax.tick_params(bottom=False, top=False, left=False, right=False)
+    fig.savefig(out_path)
+    plt.close(fig)
+
+
+def interactive_admixture(q_ordered, groups, bounds, pop_cols, max_per_group=200):
+    """
+    Downsampled Plotly stacked bar version of the admixture plot: at most `max_per_group`
+    evenly spaced samples (in clustered order) are kept per group.
+    """
+    keep = np.concatenate([
+        np.unique(np.linspace(start, stop - 1, min(stop - start, max_per_group)).astype(int))
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ])
+    q_keep = q_ordered[keep]
+    x = np.arange(len(keep))
+    kept_bounds = np.searchsorted(keep, bounds)
+
+    palette = admix_palette(len(pop_cols))
+    fig = go.Figure([
+        go.Bar(x=x, y=q_keep[:, i], name=pop, marker=dict(color=palette[i], line=dict(width=0)))
+        for i, pop in enumerate(pop_cols)
+    ])
+    for bound in kept_bounds[1:-1]:
+        fig.add_vline(x=bound - 0.5, line_color='black', line_width=1)
+    fig.update_layout(
+        barmode='stack',
+        bargap=0,
+        height=300,
+        margin=dict(l=0, r=0, t=10, b=40),
+        xaxis=dict(tickvals=(kept_bounds[:-1] + kept_bounds[1:] - 1) / 2, ticktext=groups, range=[-0.5, len(keep) - 0.5]),
+        yaxis=dict(range=[0, 1], showticklabels=False)
+    )
+    return fig
+
+
+def build_admixture_plots(admix_path, out_dir, workers=None, max_per_group=200):
+    admix, pop_cols = read_admixture(admix_path)
+    q_ordered, groups, bounds = order_samples(admix, pop_cols, workers=workers)
+    k = len(pop_cols)
+
+    os.makedirs(out_dir, exist_ok=True)
+    png_path = os.path.join(out_dir, f'refpanel_admix_{k}.png')
+    plot_admixture(q_ordered, groups, bounds, png_path)
+    json_path = os.path.join(out_dir, f'refpanel_admix_{k}.json')
+    interactive_admixture(q_ordered, groups, bounds, pop_cols, max_per_group=max_per_group).write_json(json_path)
+    return png_path, json_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build reference panel admixture plots for every K.')
+    parser.add_argument('admix_paths', nargs='+', help='ADMIXTURE tables, e.g. data/ref_panel_admixture_*.txt')
+    parser.add_argument('--out_dir', default='data', help='Output directory.')
+    parser.add_argument('--workers', type=int, default=None, help='Processes used to cluster groups.')
+    parser.add_argument('--max_per_group', type=int, default=200, help='Samples kept per group in the interactive plot.')
+    args = parser.parse_args()
+
+    for admix_path in args.admix_paths:
+        print(*build_admixture_plots(admix_path, args.out_dir, workers=args.workers, max_per_group=args.max_per_group))
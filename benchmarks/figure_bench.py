@@ -0,0 +1,155 @@
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.io as pio
+from benchmarks.synthetic_release import synthetic_master_key, synthetic_metrics, pca_table
+from utils.ancestry_utils import plot_3d
+from utils.metadata_utils import age_distribution_figure
+from utils.snp_metrics_utils import plot_clusters
+from utils.config import AppConfig
+
+config = AppConfig()
+
+'''Micro-benchmark of the graph_objects figure builders (see utils/figure_utils.py) against the
+plotly.express calls they replace, on synthetic tables of each --samples size:
+
+    plot_3d                projected samples PCA colored by predicted ancestry (GP2 Release page)
+    plot_clusters          one SNP's Theta/R cluster plot over every sample (SNP Metrics page)
+    age_distribution_*     age histograms unstratified, by sex and by phenotype (GP2 Release page)
+
+Reports the median build time of each over --repeats runs, and checks that both draw the same
+figure (equal Plotly JSON); exits with status 1 if any differs.
+
+Run from the repository root:
+
+    python -m benchmarks.figure_bench --samples 1000 10000 100000'''
+
+
+def px_plot_3d(labeled_df, color, symbol=None, x='PC1', y='PC2', z='PC3', title=None, x_range=None, y_range=None, z_range=None):
+    fig = px.scatter_3d(
+        labeled_df,
+        x=x,
+        y=y,
+        z=z,
+        color=color,
+        opacity=0.6,
+        symbol=symbol,
+        title=title,
+        color_discrete_map=config.ANCESTRY_COLOR_MAP,
+        color_discrete_sequence=px.colors.qualitative.Bold,
+        range_x=x_range,
+        range_y=y_range,
+        range_z=z_range,
+        hover_name="IID",
+        height=700
+    )
+    fig.update_traces(marker={'size': 4})
+    return fig
+
+
+def px_plot_clusters(df, x_col='theta', y_col='r', gtype_col='gt', title='SNP Plot'):
+    d3 = px.colors.qualitative.D3
+    cmap = {'AA': d3[0], 'AB': d3[1], 'BB': d3[2], 'NC': d3[3]}
+    smap = {'Control': 'circle', 'PD': 'diamond-open-dot'}
+    fig = px.scatter(
+        df,
+        x=x_col,
+        y=y_col,
+        color=gtype_col,
+        color_discrete_map=cmap,
+        symbol='phenotype',
+        symbol_map=smap,
+        title=title,
+        width=650,
+        height=497,
+        labels={'r': 'R', 'theta': 'Theta'}
+    )
+    fig.update_layout(margin=dict(r=76, t=63, b=75), legend_title_text='Genotype')
+    return fig
+
+
+def px_age_distribution(master_key_age, stratify):
+    if stratify == 'None':
+        fig = px.histogram(master_key_age, x='age', nbins=25, color_discrete_sequence=["#332288"])
+        fig.update_layout(title_text=f'<b>Age Distribution<b>')
+    elif stratify == 'Sex':
+        fig = px.histogram(master_key_age, x='age', color='sex', nbins=25,
+                           color_discrete_map={'Male': "#332288", 'Female': "#CC6677"})
+        fig.update_layout(title_text=f'<b>Age Distribution by Sex<b>')
+    elif stratify == 'Phenotype':
+        fig = px.histogram(master_key_age, x='age', color='pheno', nbins=25,
+                           color_discrete_map={'Control': "#332288", 'PD': "#CC6677", 'Other': "#117733", 'Not Reported': "#D55E00"})
+        fig.update_layout(title_text=f'<b>Age Distribution by Phenotype<b>')
+    return fig
+
+
+def make_cases(n_samples, seed=0):
+    """
+    Case name: (arguments, plotly.express builder, graph_objects builder) for tables of `n_samples` rows.
+    """
+    rng = np.random.default_rng(seed)
+    master_key = synthetic_master_key(n_samples, config.RELEASE_OPTIONS[0], rng)
+    master_key['sex'] = master_key['sex'].replace(config.SEX_MAP)
+    master_key_age = master_key[master_key['age'].notnull()]
+
+    ancestries = master_key['label'].unique()
+    codes = pd.Series(np.arange(len(ancestries)), index=ancestries)
+    centres = rng.normal(0, 4, (len(ancestries), 3))
+    proj_pca = pca_table(codes[master_key['label']].to_numpy(), centres, rng)
+    proj_pca.insert(0, 'IID', master_key['IID'].to_numpy())
+    proj_pca['Predicted Ancestry'] = master_key['label'].to_numpy()
+
+    snp_df, _, _ = synthetic_metrics(master_key, 'EUR', 1, np.array(['chr1_rs0000001']), np.array([1000]), None, rng)
+
+    return {
+        'plot_3d': ((proj_pca, 'Predicted Ancestry'), px_plot_3d, plot_3d),
+        'plot_clusters': ((snp_df, 'Theta', 'R', 'GT', 'chr1_rs0000001'), px_plot_clusters, plot_clusters),
+        **{
+            f'age_distribution_{stratify.lower()}': ((master_key_age, stratify), px_age_distribution, age_distribution_figure)
+            for stratify in ['None', 'Sex', 'Phenotype']
+        },
+    }
+
+
+def median_ms(build, args, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        build(*args)
+        times.append(1000 * (time.perf_counter() - start))
+    return float(np.median(times))
+
+
+def same_figure(a, b):
+    return json.loads(pio.to_json(a, validate=False)) == json.loads(pio.to_json(b, validate=False))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the graph_objects figure builders against plotly.express.')
+    parser.add_argument('--samples', nargs='+', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = []
+    for n_samples in args.samples:
+        for case, (case_args, px_build, go_build) in make_cases(n_samples, args.seed).items():
+            row = {
+                'samples': n_samples,
+                'case': case,
+                'rows': len(case_args[0]),
+                'px_ms': median_ms(px_build, case_args, args.repeats),
+                'go_ms': median_ms(go_build, case_args, args.repeats),
+                'identical': same_figure(px_build(*case_args), go_build(*case_args)),
+            }
+            row['speedup'] = row['px_ms'] / row['go_ms']
+            rows.append(row)
+            print(f"{n_samples:>8} {case:<26} px {row['px_ms']:8.1f} ms  go {row['go_ms']:8.1f} ms  "
+                  f"x{row['speedup']:5.1f}  {'identical' if row['identical'] else 'DIFFERENT'}", flush=True)
+
+    results = pd.DataFrame(rows)
+    sys.exit(0 if results['identical'].all() else 1)
@@ -0,0 +1,352 @@
+import os
+import sys
+import glob
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+import urllib.request
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from tornado.httpclient import AsyncHTTPClient
+from tornado.websocket import websocket_connect
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from utils.memory_utils import process_rss
+
+'''Load test: starts the app with `streamlit run` against a local directory bucket (e.g. one
+written by synthetic_release.py) and drives concurrent simulated user sessions through its pages
+over the same websocket protocol the browser speaks, so every session is a real session of one
+server process, as on an app instance. Every session follows a random click path:
+
+    GP2 Release     open, change cohort, change ancestry
+    SNP Metrics     open, pick chromosome and ancestry, pick a SNP
+    Rare Variants   open, filter by gene and method
+    Ancestry        open
+
+A rerun is timed from sending it until the server reports the script run finished. Any failure
+of a click, including a widget missing from the page, is an error row of that rerun; a session
+that cannot go on (its connection failed or a rerun timed out) ends there and is counted as
+failed, along with the reruns its click paths did not get to.
+
+For each number of concurrent sessions it reports p50/p95/p99 rerun latency, reruns per second,
+errors, failed sessions, and the server's RSS: peak, and growth per session over the level.
+Choose the instance class and max concurrency from the latency and RSS at the session count you
+need to serve.
+
+Run from the repository root:
+
+    python -m benchmarks.load_test /tmp/gp2_bench/medium/bucket --sessions 1 4 8 16 --paths 3'''
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# reruns of one click path: open + 2 selects, open + 3 selects, open + 2 filters, open
+PATH_RERUNS = 11
+PATH_RERUNS_WITHOUT_SNP_METRICS = 7
+
+
+@contextmanager
+def app_server(bucket_dir, port, startup_timeout=60.0):
+    """
+    Run the app with `streamlit run` on `port`, serving `bucket_dir`, until the block ends.
+
+    Yields:
+        subprocess.Popen: The server process.
+    """
+    command = [sys.executable, '-m', 'streamlit', 'run', os.path.join(REPO_ROOT, 'Home.py'),
+               '--server.headless', 'true', '--server.address', '127.0.0.1', '--server.port', str(port),
+               '--browser.gatherUsageStats', 'false']
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env={**os.environ, 'LOCAL_BUCKET_DIR': bucket_dir},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/_stcore/health', timeout=1):
+                    break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f'the app server did not start on port {port}')
+                time.sleep(0.2)
+        yield process
+    finally:
+        process.terminate()
+        process.wait()
+
+
+class SessionFailed(Exception):
+    """
+    The session cannot go on, e.g. its connection closed or a rerun timed out mid-run.
+    """
+
+
+class Session:
+    """
+    One simulated user: a websocket session of the app server and the latency of every rerun it
+    triggered.
+
+    Parameters:
+        url (str): Base URL of the app server.
+        bucket_dir (str): Local directory bucket the app reads.
+        seed (int): Seed of the session's click choices.
+        timeout (float): Seconds before a rerun is abandoned.
+        think_time (float): Mean seconds between a rerun and the next click.
+    """
+    def __init__(self, url, bucket_dir, seed, timeout=120.0, think_time=0.0):
+        self.url = url
+        self.random = random.Random(seed)
+        self.timeout = timeout
+        self.think_time = think_time
+        self.snp_metrics = sorted(
+            (int(os.path.basename(path)[3:-len('_summary.csv')]), os.path.basename(os.path.dirname(path)))
+            for path in glob.glob(os.path.join(bucket_dir, 'cohort_browser', 'nba', 'snp_metrics', '*', 'chr*_summary.csv'))
+        )
+        self.ws = None
+        self.pages = {}
+        self.page = None
+        # widgets shown by the last run, by key: (widget id, type, options)
+        self.widgets = {}
+        # messages the server may later send by reference only, as the browser caches them
+        self.messages = {}
+        self.reruns = []
+        self.failed = None
+
+    async def connect(self):
+        self.ws = await websocket_connect(self.url.replace('http', 'ws', 1) + '/_stcore/stream', subprotocols=['streamlit'])
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+
+    async def _resolve(self, msg):
+        if not msg.ref_hash:
+            if msg.hash and msg.metadata.cacheable:
+                self.messages[msg.hash] = msg
+            return msg
+        if msg.ref_hash not in self.messages:
+            response = await AsyncHTTPClient().fetch(f'{self.url}/_stcore/message?hash={msg.ref_hash}')
+            cached = ForwardMsg()
+            cached.ParseFromString(response.body)
+            self.messages[msg.ref_hash] = cached
+        return self.messages[msg.ref_hash]
+
+    async def _run_script(self, page_script_hash, widget_states):
+        """
+        Rerun the script on a page with the given widget states and read the run's messages.
+
+        Returns:
+            list: Messages of the exceptions the run showed.
+        """
+        msg = BackMsg()
+        msg.rerun_script.query_string = ''
+        msg.rerun_script.page_script_hash = page_script_hash
+        msg.rerun_script.widget_states.widgets.extend(widget_states)
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+
+        widgets, exceptions = {}, []
+        while True:
+            data = await self.ws.read_message()
+            if data is None:
+                raise SessionFailed('the server closed the connection')
+            forward = ForwardMsg()
+            forward.ParseFromString(data)
+            forward = await self._resolve(forward)
+            kind = forward.WhichOneof('type')
+            if kind == 'new_session':
+                self.pages = {page.page_name: page.page_script_hash for page in forward.new_session.app_pages}
+                self.page = forward.new_session.page_script_hash
+            elif kind == 'page_not_found':
+                exceptions.append(f'page {forward.page_not_found.page_name!r} not found')
+            elif kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                element = forward.delta.new_element
+                element_type = element.WhichOneof('type')
+                if element_type == 'exception':
+                    exceptions.append(f'{element.exception.type}: {element.exception.message}')
+                elif element_type in ('selectbox', 'multiselect'):
+                    widget = getattr(element, element_type)
+                    # ids of keyed widgets end in their key
+                    widgets[widget.id.rsplit('-', 1)[-1]] = (widget.id, element_type, list(widget.options))
+            elif kind == 'script_finished':
+                self.widgets = widgets
+                return exceptions
+
+    def widget(self, key):
+        if key not in self.widgets:
+            raise KeyError(f'no widget {key!r} on the page')
+        return self.widgets[key]
+
+    async def rerun(self, page, action, change=None):
+        """
+        Time one rerun of `page`: opening it, or the widget change made by `change()`, which
+        returns the changed WidgetState and runs within the timed, recorded block.
+        """
+        if self.think_time:
+            await asyncio.sleep(self.random.expovariate(1 / self.think_time))
+        start = time.perf_counter()
+        error = None
+        try:
+            if change is None:
+                # the first run, before the server has listed its pages, is of the main page
+                page_script_hash, widget_states = self.pages[page] if self.pages else '', []
+            else:
+                page_script_hash, widget_states = self.page, [change()]
+            exceptions = await asyncio.wait_for(self._run_script(page_script_hash, widget_states), self.timeout)
+            self.page = page_script_hash
+            error = '; '.join(exceptions) or None
+        except asyncio.TimeoutError:
+            # the run's messages would still arrive in reply to the next click
+            error = f'timed out after {self.timeout:.0f} s'
+            raise SessionFailed(error)
+        except SessionFailed as e:
+            error = str(e)
+            raise
+        except Exception as e:
+            error = repr(e)
+        finally:
+            self.reruns.append({'page': page, 'action': action, 'ms': 1000 * (time.perf_counter() - start), 'error': error})
+
+    async def open(self, page):
+        await self.rerun(page, 'open')
+
+    async def select(self, page, action, key, choices=None):
+        """
+        Pick one option of a selectbox: one of `choices` (option labels, or a callable returning
+        them from the widget's options), by default any option.
+        """
+        def change():
+            widget_id, _, options = self.widget(key)
+            candidates = choices(options) if callable(choices) else options if choices is None else [str(c) for c in choices]
+            if not candidates:
+                raise ValueError(f'no options to pick in {key!r}')
+            return WidgetState(id=widget_id, int_value=options.index(self.random.choice(candidates)))
+        await self.rerun(page, action, change)
+
+    async def multiselect(self, page, action, key):
+        def change():
+            widget_id, _, options = self.widget(key)
+            values = self.random.sample(range(len(options)), min(len(options), self.random.randint(1, 2)))
+            state = WidgetState(id=widget_id)
+            state.int_array_value.data.extend(values)
+            return state
+        await self.rerun(page, action, change)
+
+    async def click_path(self):
+        await self.open('GP2 Release')
+        await self.select('GP2 Release', 'cohort', 'new_cohort_choice')
+        await self.select('GP2 Release', 'ancestry', 'new_meta_ancestry_choice')
+
+        if self.snp_metrics:
+            chr_choice, ancestry_choice = self.random.choice(self.snp_metrics)
+            await self.open('SNP Metrics')
+            await self.select('SNP Metrics', 'chromosome', 'new_chr_choice', [chr_choice])
+            await self.select('SNP Metrics', 'ancestry', 'new_ancestry_choice', [ancestry_choice])
+            await self.select('SNP Metrics', 'snp', 'snp_choice', lambda options: options[1:])
+
+        await self.open('Rare Variants')
+        await self.multiselect('Rare Variants', 'gene', 'new_rv_gene_choice')
+        await self.multiselect('Rare Variants', 'method', 'new_method_choice')
+
+        await self.open('Ancestry')
+
+
+async def run_level(url, server_pid, bucket_dir, n_sessions, n_paths, think_time, timeout, seed, sample_interval=0.05):
+    """
+    Run `n_sessions` sessions at once, each following `n_paths` click paths.
+
+    Returns:
+        tuple: (summary dict, DataFrame of every rerun)
+    """
+    sessions = [Session(url, bucket_dir, seed=seed * 10000 + i, timeout=timeout, think_time=think_time) for i in range(n_sessions)]
+    rss_start = process_rss(server_pid)
+    rss_peak = rss_start
+    done = asyncio.Event()
+
+    async def sample_rss():
+        nonlocal rss_peak
+        while not done.is_set():
+            rss_peak = max(rss_peak, process_rss(server_pid))
+            await asyncio.sleep(sample_interval)
+
+    async def run_session(session):
+        try:
+            await session.connect()
+            # each session starts on the home page, as a new visitor does
+            await session.rerun('Home', 'open')
+            for _ in range(n_paths):
+                await session.click_path()
+        except Exception as e:
+            session.failed = str(e) or repr(e)
+        finally:
+            session.close()
+
+    sampler = asyncio.create_task(sample_rss())
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(session) for session in sessions))
+    wall = time.perf_counter() - start
+    done.set()
+    await sampler
+    rss_end = process_rss(server_pid)
+
+    reruns = pd.DataFrame([{'sessions': n_sessions, 'session': i, **rerun} for i, session in enumerate(sessions) for rerun in session.reruns],
+                          columns=['sessions', 'session', 'page', 'action', 'ms', 'error'])
+    path_reruns = PATH_RERUNS if sessions[0].snp_metrics else PATH_RERUNS_WITHOUT_SNP_METRICS
+    p50, p95, p99 = np.percentile(reruns['ms'], [50, 95, 99]) if len(reruns) else (np.nan,) * 3
+    summary = {
+        'sessions': n_sessions,
+        'reruns': len(reruns),
+        'not_run': n_sessions * (1 + n_paths * path_reruns) - len(reruns),
+        'errors': int(reruns['error'].notnull().sum()),
+        'failed_sessions': sum(session.failed is not None for session in sessions),
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'max_ms': reruns['ms'].max(),
+        'reruns_per_s': len(reruns) / wall,
+        'rss_peak_mb': rss_peak / 2**20,
+        'rss_mb_per_session': (rss_end - rss_start) / 2**20 / n_sessions,
+    }
+    return summary, reruns
+
+
+async def run_levels(args, url, server_pid):
+    # load imports and the process-wide caches first, so the first level is not charged for them
+    await run_level(url, server_pid, args.bucket_dir, 1, 1, 0.0, args.timeout, args.seed)
+    summaries, all_reruns = [], []
+    for n_sessions in args.sessions:
+        summary, reruns = await run_level(url, server_pid, args.bucket_dir, n_sessions, args.paths, args.think_time,
+                                          args.timeout, args.seed)
+        summaries.append(summary)
+        all_reruns.append(reruns)
+        print(f"{n_sessions} sessions: p95 {summary['p95_ms']:.0f} ms, {summary['reruns_per_s']:.1f} reruns/s, "
+              f"{summary['errors']} errors, {summary['failed_sessions']} failed sessions", flush=True)
+    return summaries, all_reruns
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the app with concurrent websocket sessions.')
+    parser.add_argument('bucket_dir', help='Local directory laid out like gs://genotools-server.')
+    parser.add_argument('--sessions', nargs='+', type=int, default=[1, 2, 4, 8, 16], help='Concurrent session counts to run.')
+    parser.add_argument('--paths', type=int, default=2, help='Click paths each session follows.')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Mean seconds between clicks (0 for back-to-back clicks).')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Seconds before a rerun is abandoned.')
+    parser.add_argument('--port', type=int, default=8599, help='Port to run the app server on.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Also write every rerun to this CSV file.')
+    args = parser.parse_args()
+
+    with app_server(os.path.abspath(args.bucket_dir), args.port) as server:
+        summaries, all_reruns = asyncio.run(run_levels(args, f'http://127.0.0.1:{args.port}', server.pid))
+
+    print(pd.DataFrame(summaries).to_string(index=False, float_format='%.1f'))
+    reruns = pd.concat(all_reruns, ignore_index=True)
+    print('\nrerun latency (ms) by page and action, all levels:')
+    print(reruns.groupby(['page', 'action'])['ms'].describe(percentiles=[0.5, 0.95, 0.99])[['count', '50%', '95%', '99%', 'max']]
+          .to_string(float_format='%.1f'))
+    errors = reruns[reruns['error'].notnull()]
+    if not errors.empty:
+        print(f'\n{len(errors)} reruns failed, e.g. {errors.iloc[0]["page"]} {errors.iloc[0]["action"]}: {errors.iloc[0]["error"]}')
+    if args.output:
+        reruns.to_csv(args.output, index=False)
@@ -0,0 +1,361 @@
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+from io import StringIO
+import tracemalloc
+import numpy as np
+import pandas as pd
+import streamlit as st
+import plotly.graph_objects as go
+from benchmarks.synthetic_release import generate_release
+from utils import gcs_utils, hold_data, shared_store_utils, figure_cache_utils
+from utils.hold_data import (
+    get_gcloud_bucket,
+    get_master_key,
+    filter_by_cohort,
+    filter_by_ancestry,
+    update_sex_labels,
+    sync_release_manifest,
+    master_key_version
+)
+from utils.metadata_utils import (
+    display_ancestry,
+    ancestry_pca,
+    plot_age_distribution,
+    display_phenotype_counts,
+    display_pruned_samples,
+    display_related_samples
+)
+from utils.snp_metrics_utils import (
+    load_metrics_data,
+    load_snp_summary,
+    load_genotype_table,
+    load_snp_rows,
+    load_maf_data,
+    display_snp_metrics
+)
+from utils.ancestry_utils import render_tab_pca
+from utils.figure_pool_utils import page_figures
+from utils.config import AppConfig
+
+config = AppConfig()
+
+'''Times and memory-profiles the load path of every page against synthetic releases (see
+synthetic_release.py) served from a local directory bucket, so no GCS access is needed. Functions run in
+Streamlit's bare mode: widgets return their defaults, elements are built and serialized but not
+sent anywhere, and st.session_state behaves as in a single session. As on the pages, figures are
+built on the figure pool (see figure_pool_utils; FIGURE_WORKERS=0 times them built one by one).
+
+Each case is measured in three modes:
+
+    cold      fresh process state: empty session state, storage and figure caches and shared store
+    session   a new session in a warm process (empty session state only)
+    rerun     a rerun of the same session
+
+reporting the median wall time over --repeats runs, and the tracemalloc peak and retained memory
+of a cold run. Each case runs once untimed first, so one-off costs of the process (lazy imports,
+Plotly's validators) are not timed.
+
+Results are checked against benchmarks/thresholds.json; the script exits with status 1 when a
+case is slower or uses more memory than its threshold. Time thresholds are recorded together
+with the time of a fixed calibration workload (CSV parsing, pandas filtering and grouping, Plotly
+serialization) on the recording machine, and are scaled by how much slower or faster that
+workload runs on the machine checking them. After an intended performance change, rewrite the
+thresholds from a run with --update-thresholds.
+
+Run from the repository root:
+
+    python -m benchmarks.page_bench /tmp/gp2_bench --scales small medium'''
+
+SCALES = {
+    'small': {'n_samples': 2000, 'n_snps': 200, 'n_metrics_samples': 500, 'n_ref': 1000},
+    'medium': {'n_samples': 20000, 'n_snps': 1000, 'n_metrics_samples': 2000, 'n_ref': 4000},
+    'large': {'n_samples': 100000, 'n_snps': 2000, 'n_metrics_samples': 10000, 'n_ref': 4000},
+}
+
+MODES = ['cold', 'session', 'rerun']
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(__file__), 'thresholds.json')
+
+ANCESTRY = 'EUR'
+CHROMOSOME = 1
+
+
+def release_folder():
+    return f"cohort_browser/nba/release{st.session_state['release_choice']}"
+
+
+def start_session():
+    st.session_state['release_choice'] = config.RELEASE_OPTIONS[0]
+
+
+def setup_master_key(bucket):
+    start_session()
+    sync_release_manifest(bucket)
+    return (bucket,)
+
+
+def setup_cohort(bucket):
+    setup_master_key(bucket)
+    return (get_master_key(bucket),)
+
+
+def setup_metadata(bucket):
+    master_key_cohort, = setup_cohort(bucket)
+    master_key_cohort = filter_by_cohort(master_key_cohort)
+    pruned_key = st.session_state['master_key']
+    st.session_state['master_key'] = master_key_cohort
+    master_key = update_sex_labels(filter_by_ancestry(master_key_cohort))
+    return bucket, master_key_cohort, master_key, pruned_key
+
+
+def setup_snp(bucket):
+    setup_master_key(bucket)
+    summary = load_snp_summary(bucket, ANCESTRY, CHROMOSOME)
+    gt_table = load_genotype_table(summary, ANCESTRY, CHROMOSOME)
+    snp_summary = summary.iloc[len(summary) // 2]
+    snp_df = load_snp_rows(bucket, ANCESTRY, CHROMOSOME, snp_summary)
+    maf, full_maf = load_maf_data(bucket, ANCESTRY)
+    return snp_df, maf, full_maf, gt_table, ANCESTRY, snp_summary['snp_label']
+
+
+def run_metadata_ancestry(bucket, master_key_cohort, master_key, pruned_key):
+    version = master_key_version(bucket)
+    display_ancestry(master_key_cohort, version)
+    ancestry_pca(master_key, bucket, version)
+
+
+def run_metadata_age(bucket, master_key_cohort, master_key, pruned_key):
+    version = master_key_version(bucket)
+    plot1, plot2 = st.columns([1, 1.75])
+    for stratify in ['None', 'Sex', 'Phenotype']:
+        plot_age_distribution(master_key, stratify, plot2, version)
+    display_phenotype_counts(master_key.copy(), plot1)
+
+
+def run_metadata_qc(bucket, master_key_cohort, master_key, pruned_key):
+    version = master_key_version(bucket)
+    pruned1, pruned2 = st.columns([1, 1.75])
+    pruned_key = pruned_key.assign(prune_reason=pruned_key['prune_reason'].map(config.PRUNE_MAP))
+    display_pruned_samples(pruned_key, pruned1)
+    display_related_samples(pruned_key, pruned2, version)
+
+
+# case name: (setup returning the arguments of the timed call, timed call)
+CASES = {
+    'get_master_key': (setup_master_key, get_master_key),
+    'filter_by_cohort': (setup_cohort, filter_by_cohort),
+    'load_metrics_data': (setup_master_key, lambda bucket: load_metrics_data(bucket, ANCESTRY, CHROMOSOME)),
+    'display_snp_metrics': (setup_snp, display_snp_metrics),
+    'render_tab_pca': (setup_master_key, lambda bucket: render_tab_pca(release_folder(), bucket)),
+    'metadata_ancestry': (setup_metadata, run_metadata_ancestry),
+    'metadata_age': (setup_metadata, run_metadata_age),
+    'metadata_qc': (setup_metadata, run_metadata_qc),
+}
+
+
+def ensure_release(data_dir, scale, workers=None):
+    """
+    Path of the scale's synthetic bucket, generating it on first use.
+    """
+    out_dir = os.path.join(data_dir, scale)
+    bucket_dir = os.path.join(out_dir, 'bucket')
+    manifest_path = os.path.join(bucket_dir, 'cohort_browser', 'nba', f'release{config.RELEASE_OPTIONS[0]}', 'manifest.json')
+    if not os.path.exists(manifest_path):
+        print(f'generating the {scale} release in {out_dir}')
+        generate_release(out_dir, **SCALES[scale], chromosomes=[CHROMOSOME], workers=workers)
+    return bucket_dir
+
+
+def calibrate(repeats=5):
+    """
+    Median wall time (ms) of a fixed workload resembling a page load, as a measure of the speed
+    of this machine.
+    """
+    rng = np.random.default_rng(0)
+    n_rows = 50000
+    csv = pd.DataFrame({
+        'IID': [f'SAMPLE_{i:06d}' for i in range(n_rows)],
+        'label': rng.choice(config.ANCESTRY_OPTIONS, n_rows),
+        'age': rng.integers(18, 90, n_rows),
+        'PC1': rng.normal(size=n_rows),
+        'PC2': rng.normal(size=n_rows),
+    }).to_csv(index=False)
+
+    def workload():
+        table = pd.read_csv(StringIO(csv))
+        table = table[table['age'] > 40]
+        table.groupby('label')[['PC1', 'PC2']].describe()
+        go.Figure(go.Scattergl(x=table['PC1'], y=table['PC2'], mode='markers')).to_json()
+
+    workload()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        workload()
+        times.append(1000 * (time.perf_counter() - start))
+    return float(np.median(times))
+
+
+def reset_session():
+    st.session_state.clear()
+
+
+def reset_process(store_dir):
+    """
+    Drop every cache a fresh app process would start without.
+    """
+    reset_session()
+    gcs_utils._swr_cache.clear()
+    figure_cache_utils.shrink_figure_cache(float('inf'))
+    shutil.rmtree(store_dir, ignore_errors=True)
+    shared_store_utils._store = None
+    for entry_dir in list(shared_store_utils._decoded):
+        shared_store_utils.forget_decoded(entry_dir)
+    gc.collect()
+
+
+def time_case(bucket, case, mode, repeats, store_dir):
+    setup, run = CASES[case]
+    reset_process(store_dir)
+    run(*setup(bucket))
+
+    times = []
+    for _ in range(repeats):
+        if mode == 'cold':
+            reset_process(store_dir)
+        elif mode == 'session':
+            reset_session()
+        args = setup(bucket)
+        start = time.perf_counter()
+        with page_figures():
+            run(*args)
+        times.append(1000 * (time.perf_counter() - start))
+    return float(np.median(times))
+
+
+def profile_case(bucket, case, store_dir):
+    """
+    tracemalloc peak and retained memory (MB) of one cold run.
+    """
+    setup, run = CASES[case]
+    reset_process(store_dir)
+    args = setup(bucket)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        with page_figures():
+            run(*args)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (peak - before) / 2**20, (current - before) / 2**20
+
+
+def run_benchmarks(data_dir, scales, cases, repeats, workers=None):
+    store_dir = tempfile.mkdtemp(prefix='gp2_bench_store_')
+    shared_store_utils.config.SHARED_STORE_DIR = store_dir
+    rows = []
+    try:
+        for scale in scales:
+            # pages also open the bucket themselves (e.g. for the sidebar logos)
+            hold_data.config.LOCAL_BUCKET_DIR = ensure_release(data_dir, scale, workers)
+            bucket = get_gcloud_bucket(config.FRONTEND_BUCKET_NAME)
+            for case in cases:
+                row = {'scale': scale, 'case': case}
+                for mode in MODES:
+                    row[f'{mode}_ms'] = time_case(bucket, case, mode, repeats, store_dir)
+                row['peak_mb'], row['retained_mb'] = profile_case(bucket, case, store_dir)
+                rows.append(row)
+                print(f"{scale:>8} {case:<20} cold {row['cold_ms']:9.1f} ms  session {row['session_ms']:9.1f} ms  "
+                      f"rerun {row['rerun_ms']:9.1f} ms  peak {row['peak_mb']:8.1f} MB", flush=True)
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+    return pd.DataFrame(rows)
+
+
+def check_thresholds(results, thresholds, calibration_ms):
+    """
+    Rows of `results` above their threshold, as (scale, case, metric, value, threshold). Time
+    thresholds are scaled by calibration_ms over the calibration time they were recorded with.
+    """
+    speed = calibration_ms / thresholds.get('calibration_ms', calibration_ms)
+    regressions = []
+    for row in results.itertuples(index=False):
+        limits = thresholds.get(row.scale, {}).get(row.case, {})
+        for metric, limit in limits.items():
+            value = getattr(row, metric)
+            if metric.endswith('_ms'):
+                limit *= speed
+            if value > limit:
+                regressions.append((row.scale, row.case, metric, value, limit))
+    return regressions
+
+
+def thresholds_from(results, headroom, min_ms, min_mb):
+    """
+    Thresholds at `headroom` times the measured values, with floors so that very fast or small
+    cases are not flagged for noise.
+    """
+    thresholds = {}
+    for row in results.itertuples(index=False):
+        thresholds.setdefault(row.scale, {})[row.case] = {
+            **{f'{mode}_ms': round(max(headroom * getattr(row, f'{mode}_ms'), min_ms), 1) for mode in MODES},
+            'peak_mb': round(max(headroom * row.peak_mb, min_mb), 1),
+        }
+    return thresholds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark page load paths against synthetic releases.')
+    parser.add_argument('data_dir', help='Directory of the synthetic releases, generated on first use.')
+    parser.add_argument('--scales', nargs='+', default=['small', 'medium'], choices=list(SCALES))
+    parser.add_argument('--cases', nargs='+', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None, help='Process pool size when generating releases.')
+    parser.add_argument('--thresholds', default=THRESHOLDS_PATH)
+    parser.add_argument('--update-thresholds', action='store_true', help='Write thresholds from this run instead of checking.')
+    parser.add_argument('--headroom', type=float, default=2.0, help='Thresholds as a multiple of the measured values.')
+    parser.add_argument('--output', default=None, help='Also write the results to this CSV file.')
+    args = parser.parse_args()
+
+    # bare mode warns on every Streamlit call made outside `streamlit run`
+    logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').disabled = True
+
+    calibration_ms = calibrate()
+    print(f'calibration {calibration_ms:.1f} ms', flush=True)
+    results = run_benchmarks(args.data_dir, args.scales, args.cases, args.repeats, workers=args.workers)
+    if args.output:
+        results.to_csv(args.output, index=False)
+
+    if args.update_thresholds:
+        thresholds = {}
+        if os.path.exists(args.thresholds):
+            with open(args.thresholds) as f:
+                thresholds = json.load(f)
+        # time thresholds kept from another run are rescaled to this run's calibration
+        speed = calibration_ms / thresholds.get('calibration_ms', calibration_ms)
+        for limits in (limits for scale in SCALES for limits in thresholds.get(scale, {}).values()):
+            limits.update({metric: round(limit * speed, 1) for metric, limit in limits.items() if metric.endswith('_ms')})
+        thresholds['calibration_ms'] = round(calibration_ms, 1)
+        for scale, cases in thresholds_from(results, args.headroom, min_ms=50.0, min_mb=5.0).items():
+            thresholds.setdefault(scale, {}).update(cases)
+        with open(args.thresholds, 'w') as f:
+            json.dump(thresholds, f, indent=2, sort_keys=True)
+        print(f'wrote {args.thresholds}')
+        sys.exit(0)
+
+    with open(args.thresholds) as f:
+        regressions = check_thresholds(results, json.load(f), calibration_ms)
+    for scale, case, metric, value, limit in regressions:
+        print(f'REGRESSION {scale} {case} {metric}: {value:.1f} > {limit:.1f}')
+    sys.exit(1 if regressions else 0)
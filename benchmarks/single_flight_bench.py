@@ -0,0 +1,87 @@
+import time
+import argparse
+import threading
+import pandas as pd
+from utils import gcs_utils, single_flight_utils
+from utils.hold_data import blob_as_csv
+from utils.local_bucket_utils import LocalBucket, LocalBlob
+
+'''Simulates a burst of sessions opening the browser at once: every session thread loads the
+release master key and a chromosome's metrics CSV through blob_as_csv at the same moment, against
+a LocalBucket with injected request latency. Reports wall time, CPU time, storage requests and
+bytes downloaded with single-flight request coalescing on and off.
+
+Run from the repository root:
+
+    python -m benchmarks.single_flight_bench /path/to/bucket_dir --sessions 32'''
+
+
+class CountingBlob(LocalBlob):
+    def download_as_bytes(self, *args, **kwargs):
+        data = super().download_as_bytes(*args, **kwargs)
+        with self.bucket.lock:
+            self.bucket.requests += 1
+            self.bucket.bytes += len(data)
+        return data
+
+
+class CountingBucket(LocalBucket):
+    """
+    LocalBucket counting the downloads and bytes served.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+
+    def blob(self, name):
+        return CountingBlob(self, name)
+
+
+def run_burst(data_dir, paths, sessions, latency, coalesce):
+    single_flight_utils.config.SINGLE_FLIGHT = coalesce
+    gcs_utils._swr_cache.clear()
+    bucket = CountingBucket(data_dir, faults={'latency': latency})
+    barrier = threading.Barrier(sessions)
+
+    def session():
+        barrier.wait()
+        for path in paths:
+            blob_as_csv(bucket, path, sep=',')
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    wall, cpu = time.perf_counter(), time.process_time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'single_flight': coalesce,
+        'sessions': sessions,
+        'wall_s': time.perf_counter() - wall,
+        'cpu_s': time.process_time() - cpu,
+        'requests': bucket.requests,
+        'MB_downloaded': bucket.bytes / 2**20,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark concurrent artifact loads with and without single-flight.')
+    parser.add_argument('data_dir', help='Local directory laid out like gs://genotools-server.')
+    parser.add_argument('--release', type=int, default=10)
+    parser.add_argument('--chromosome', type=int, default=1)
+    parser.add_argument('--ancestry', default='AAC')
+    parser.add_argument('--sessions', type=int, default=32, help='Simulated sessions loading at once.')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every storage request.')
+    args = parser.parse_args()
+
+    paths = [
+        f'cohort_browser/nba/release{args.release}/nba_app_key.csv',
+        f'cohort_browser/nba/snp_metrics/{args.ancestry}/chr{args.chromosome}_metrics.csv',
+    ]
+    results = pd.DataFrame([
+        run_burst(args.data_dir, paths, args.sessions, args.latency, coalesce)
+        for coalesce in [False, True]
+    ])
+    print(results.to_string(index=False, float_format='%.3f'))
@@ -0,0 +1,285 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from PIL import Image
+from build_release import build_release
+from utils.config import AppConfig
+
+config = AppConfig()
+
+'''Generates a synthetic GP2 release at a chosen scale, with the schemas of the real GenoTools
+outputs, and builds it with build_release into a directory laid out like gs://genotools-server:
+
+    {out_dir}/raw/      GenoTools-style inputs (see build_release.py)
+    {out_dir}/bucket/   the bucket, served with LOCAL_BUCKET_DIR={out_dir}/bucket or a LocalBucket
+
+The release has a master key of N samples, reference and projected PCA tables, ancestry
+prediction tables, per-ancestry and full allele frequencies, metrics of M SNPs x S samples per
+chromosome for each chosen ancestry, the reference panel admixture table and the rare variant
+table. Values are random but shaped like the real data (genotype clusters, Hardy-Weinberg
+genotype frequencies, a dominant EUR label, a few percent pruned/related samples), and the same
+seed always gives the same release.
+
+Run from the repository root:
+
+    python -m benchmarks.synthetic_release /tmp/gp2_synthetic --samples 20000 --snps 1000 --metrics-samples 2000'''
+
+STUDIES = ['BCM', 'COURAGE', 'PPMI', 'LCC', 'GEoPD', 'PDGSC', 'MDGAP', 'OPDC', 'BLAAC', 'SYNAPS']
+
+# rough share of each predicted ancestry in a GP2 release
+ANCESTRY_WEIGHTS = {
+    'EUR': 0.55, 'AJ': 0.05, 'AFR': 0.04, 'AAC': 0.04, 'AMR': 0.08, 'EAS': 0.1,
+    'SAS': 0.05, 'CAS': 0.02, 'MDE': 0.03, 'FIN': 0.02, 'CAH': 0.02
+}
+
+PHENOTYPE_WEIGHTS = {'PD': 0.55, 'Control': 0.35, 'Other': 0.07, 'Not Reported': 0.03}
+
+# genotype cluster centres on the Theta axis
+THETA_CENTRES = {'AA': 0.05, 'AB': 0.5, 'BB': 0.95}
+
+RARE_VARIANT_GENES = ['GBA1', 'LRRK2', 'PRKN', 'PINK1', 'PARK7', 'SNCA', 'VPS35']
+
+
+def synthetic_master_key(n_samples, release, rng):
+    labels = rng.choice(list(ANCESTRY_WEIGHTS), n_samples, p=list(ANCESTRY_WEIGHTS.values()))
+    study = rng.choice(STUDIES, n_samples)
+    prune_reason = np.where(rng.random(n_samples) < 0.04, rng.choice(list(config.PRUNE_MAP), n_samples), None)
+    age = rng.normal(65, 11, n_samples).round().clip(18, 100)
+    return pd.DataFrame({
+        'IID': [f'{s}_{i:06d}_s1' for i, s in enumerate(study)],
+        'release': release,
+        'study': study,
+        'prune_reason': prune_reason,
+        'label': labels,
+        'sex': rng.choice([1, 2, 0], n_samples, p=[0.58, 0.41, 0.01]),
+        'age': np.where(rng.random(n_samples) < 0.15, np.nan, age),
+        'pheno': rng.choice(list(PHENOTYPE_WEIGHTS), n_samples, p=list(PHENOTYPE_WEIGHTS.values())),
+        'related': (rng.random(n_samples) < 0.05).astype(int),
+        'dup': (rng.random(n_samples) < 0.01).astype(int),
+    })
+
+
+def pca_table(labels, centres, rng, spread=0.6):
+    coords = centres[labels] + rng.normal(0, spread, (len(labels), 3))
+    return pd.DataFrame(coords, columns=['PC1', 'PC2', 'PC3'])
+
+
+def write_ancestry_tables(release_dir, master_key, n_ref, rng):
+    ancestries = list(ANCESTRY_WEIGHTS)
+    centres = pd.DataFrame(rng.normal(0, 4, (len(ancestries), 3)), index=ancestries).to_numpy()
+    codes = {anc: i for i, anc in enumerate(ancestries)}
+
+    ref_labels = rng.choice([anc for anc in ancestries if anc != 'CAH'], n_ref)
+    ref_pca = pca_table(np.array([codes[anc] for anc in ref_labels]), centres, rng)
+    ref_pca.insert(0, 'IID', [f'REF{i:05d}' for i in range(n_ref)])
+    ref_pca['label'] = ref_labels
+    ref_pca.to_csv(os.path.join(release_dir, 'ref_pca_plot.csv'), index=False)
+
+    kept = master_key[master_key['prune_reason'].isnull()]
+    proj_pca = pca_table(kept['label'].map(codes).to_numpy(), centres, rng)
+    proj_pca.insert(0, 'IID', kept['IID'].to_numpy())
+    proj_pca['label'] = 'Predicted'
+    proj_pca['Predicted Ancestry'] = kept['label'].to_numpy()
+    proj_pca.to_csv(os.path.join(release_dir, 'proj_pca_plot.csv'), index=False)
+
+    pred_counts = kept['label'].value_counts().reindex(ancestries, fill_value=0)
+    ref_counts = pd.Series(ref_labels).value_counts().reindex(ancestries, fill_value=0)
+    pd.DataFrame({'Predicted Ancestry': ancestries, 'Counts': pred_counts.to_numpy()}).to_csv(
+        os.path.join(release_dir, 'anc_summary.csv'), index=False)
+    pd.DataFrame({
+        'Ancestry Category': ancestries,
+        'Ref Panel Proportion': (ref_counts / ref_counts.sum()).to_numpy(),
+        'Predicted Proportion': (pred_counts / pred_counts.sum()).to_numpy(),
+        'Ref Panel Counts': ref_counts.to_numpy(),
+        'Predicted Counts': pred_counts.to_numpy(),
+    }).to_csv(os.path.join(release_dir, 'pie_table.csv'), index=False)
+
+    ref_only = [anc for anc in ancestries if anc != 'CAH']
+    test_counts = (ref_counts[ref_only].to_numpy() * 0.2).round().astype(int)
+    confusion = np.diag(test_counts) + rng.poisson(0.3, (len(ref_only), len(ref_only)))
+    pd.DataFrame(confusion, columns=ref_only).to_csv(os.path.join(release_dir, 'confusion_matrix.csv'), index=False)
+    pd.DataFrame({'Balanced Accuracy': [0.96], 'SD': [0.01], 'Precision': [0.95], 'Recall': [0.96]}).to_csv(
+        os.path.join(release_dir, 'model_metrics.csv'), index=False)
+
+    related = kept.groupby('label')[['related', 'dup']].sum().reset_index()
+    related.columns = ['Ancestry Category', 'Related', 'Duplicated']
+    related.to_csv(os.path.join(release_dir, 'related_plot.csv'), index=False)
+    return ref_pca
+
+
+def write_qc_plots(release_dir):
+    for name in ['funnel_plot.html', 'variant_plot.html']:
+        with open(os.path.join(release_dir, name), 'w') as f:
+            f.write(f'<html><body><div>{name}</div></body></html>')
+
+
+def afreq_table(snp_ids, alt_freqs, chromosomes, n_obs):
+    return pd.DataFrame({
+        '#CHROM': chromosomes,
+        'ID': snp_ids,
+        'REF': 'A',
+        'ALT': 'G',
+        'ALT_FREQS': alt_freqs,
+        'OBS_CT': n_obs,
+    })
+
+
+def synthetic_metrics(master_key, ancestry, chr_choice, snp_ids, positions, n_metrics_samples, rng):
+    """
+    Sample-level metrics of one ancestry and chromosome: every SNP for every chosen sample, with
+    Hardy-Weinberg genotypes around a per-SNP allele frequency and Theta/R clustered by genotype.
+    """
+    candidates = master_key[(master_key['label'] == ancestry) & master_key['pheno'].isin(config.SNP_PHENOTYPES)]
+    samples = candidates.iloc[:n_metrics_samples] if n_metrics_samples else candidates
+    n_snps, n = len(snp_ids), len(samples)
+
+    alt_freq = rng.beta(0.6, 0.9, n_snps)
+    genotypes = np.array(['AA', 'AB', 'BB', 'NC'])
+    u = rng.random((n_snps, n))
+    p_aa = (1 - alt_freq) ** 2
+    p_ab = 2 * alt_freq * (1 - alt_freq)
+    gt_codes = np.where(u < p_aa[:, None], 0, np.where(u < (p_aa + p_ab)[:, None], 1, 2))
+    no_call_rate = rng.beta(1, 60, n_snps)
+    gt_codes[rng.random((n_snps, n)) < no_call_rate[:, None]] = 3
+
+    theta = np.array([THETA_CENTRES['AA'], THETA_CENTRES['AB'], THETA_CENTRES['BB'], 0.5])[gt_codes]
+    theta = (theta + rng.normal(0, 0.04, gt_codes.shape) + np.where(gt_codes == 3, rng.normal(0, 0.2, gt_codes.shape), 0)).clip(0, 1)
+    r = rng.normal(1.0, 0.15, gt_codes.shape).clip(0.05)
+
+    metrics = pd.DataFrame({
+        'snpID': np.repeat(snp_ids, n),
+        'Sample_ID': np.tile(samples['IID'].to_numpy(), n_snps),
+        'chromosome': chr_choice,
+        'position': np.repeat(positions, n),
+        'Theta': theta.ravel(),
+        'R': r.ravel(),
+        'GenTrain_Score': np.repeat(rng.beta(8, 2, n_snps), n),
+        'phenotype': np.tile(samples['pheno'].to_numpy(), n_snps),
+        'GT': genotypes[gt_codes.ravel()],
+    })
+    called = gt_codes != 3
+    observed_alt = (np.where(called, gt_codes, 0)).sum(axis=1) / np.maximum(2 * called.sum(axis=1), 1)
+    return metrics, observed_alt, 2 * called.sum(axis=1)
+
+
+def write_snp_metrics(snp_dir, master_key, ancestries, chromosomes, n_snps, n_metrics_samples, rng):
+    full_ids, full_chrom, full_alt, full_obs = [], [], [], []
+    for chr_choice in chromosomes:
+        snp_ids = np.array([f'chr{chr_choice}_rs{i:07d}' for i in range(n_snps)])
+        positions = np.sort(rng.choice(np.arange(1, 240_000_000), n_snps, replace=False))
+        alt_sum, obs_sum = np.zeros(n_snps), np.zeros(n_snps)
+        for ancestry in ancestries:
+            metrics, alt_freq, n_obs = synthetic_metrics(master_key, ancestry, chr_choice, snp_ids, positions, n_metrics_samples, rng)
+            anc_dir = os.path.join(snp_dir, ancestry)
+            os.makedirs(anc_dir, exist_ok=True)
+            metrics.to_csv(os.path.join(anc_dir, f'chr{chr_choice}_metrics.csv'), index=False)
+            alt_sum += alt_freq * n_obs
+            obs_sum += n_obs
+            maf_path = os.path.join(anc_dir, f'{ancestry}_maf.afreq')
+            afreq_table(snp_ids, alt_freq, chr_choice, n_obs).to_csv(
+                maf_path, sep='\t', index=False, mode='a', header=not os.path.exists(maf_path))
+        full_ids.append(snp_ids)
+        full_chrom.append(np.full(n_snps, chr_choice))
+        full_alt.append(alt_sum / np.maximum(obs_sum, 1))
+        full_obs.append(obs_sum.astype(int))
+    afreq_table(np.concatenate(full_ids), np.concatenate(full_alt), np.concatenate(full_chrom), np.concatenate(full_obs)).to_csv(
+        os.path.join(snp_dir, 'full_maf.afreq'), sep='\t', index=False)
+
+
+def write_admixture(admixture_dir, ref_pca, rng):
+    k = config.ADMIXTURE_K
+    admixture = pd.DataFrame(rng.dirichlet(np.full(k, 0.3), len(ref_pca)), columns=[f'pop{i}' for i in range(1, k + 1)])
+    admixture.insert(0, 'ancestry', ref_pca['label'].to_numpy())
+    admixture.insert(0, 'IID', ref_pca['IID'].to_numpy())
+    admixture.to_csv(os.path.join(admixture_dir, f'ref_panel_admixture_{k}.txt'), sep=' ', index=False)
+
+
+def write_rare_variants(rare_variant_dir, n_variants, rng):
+    os.makedirs(rare_variant_dir, exist_ok=True)
+    pd.DataFrame({
+        'Study code': rng.choice(STUDIES, n_variants),
+        'Methods': rng.choice(['WGS', 'NBA', 'Sanger', 'WES'], n_variants),
+        'Gene': rng.choice(RARE_VARIANT_GENES, n_variants),
+        'Variant': [f'p.{aa}{pos}{alt}' for aa, pos, alt in zip(
+            rng.choice(list('ACDEGKLNRS'), n_variants), rng.integers(1, 2500, n_variants), rng.choice(list('ACDEGKLNRS'), n_variants))],
+    }).to_csv(os.path.join(rare_variant_dir, 'gp2_RV_browser_input.csv'), index=False)
+
+
+def write_frontend_images(frontend_dir):
+    os.makedirs(frontend_dir, exist_ok=True)
+    for name in ['gp2_2.jpg', 'card-removebg.png', 'gp2_2-removebg.png']:
+        Image.new('RGB', (64, 64), (51, 34, 136)).save(os.path.join(frontend_dir, name), format='PNG')
+
+
+def generate_release(out_dir, n_samples, n_snps, n_metrics_samples=None, ancestries=('EUR', 'AAC'), chromosomes=(1,),
+                     n_ref=4000, n_rare_variants=2000, release=None, seed=0, workers=None):
+    """
+    Write a synthetic release's GenoTools outputs to {out_dir}/raw and build its bucket in {out_dir}/bucket.
+
+    Parameters:
+        out_dir (str): Output directory.
+        n_samples (int): Samples in the master key.
+        n_snps (int): SNPs per chromosome.
+        n_metrics_samples (int, optional): Samples per ancestry in the metrics files. Defaults to
+                                           every unpruned Control/PD sample of the ancestry.
+        ancestries (sequence of str): Ancestries with SNP metrics.
+        chromosomes (sequence of int): Chromosomes with SNP metrics.
+        n_ref (int): Reference panel samples.
+        n_rare_variants (int): Rows of the rare variant table.
+        release (int, optional): Release number. Defaults to the latest release.
+        seed (int): Random seed.
+        workers (int, optional): Process pool size of the build.
+
+    Returns:
+        str: The bucket directory.
+    """
+    release = release if release is not None else config.RELEASE_OPTIONS[0]
+    rng = np.random.default_rng(seed)
+    raw_dir = os.path.join(out_dir, 'raw')
+    bucket_dir = os.path.join(out_dir, 'bucket')
+    release_dir = os.path.join(raw_dir, f'release{release}')
+    snp_dir = os.path.join(raw_dir, 'snp_metrics')
+    admixture_dir = os.path.join(raw_dir, 'admixture')
+    for path in [release_dir, snp_dir, admixture_dir]:
+        os.makedirs(path, exist_ok=True)
+    # afreq files are appended to per chromosome
+    for ancestry in ancestries:
+        maf_path = os.path.join(snp_dir, ancestry, f'{ancestry}_maf.afreq')
+        if os.path.exists(maf_path):
+            os.remove(maf_path)
+
+    master_key = synthetic_master_key(n_samples, release, rng)
+    master_key.to_csv(os.path.join(release_dir, 'nba_app_key.csv'), index=False)
+    ref_pca = write_ancestry_tables(release_dir, master_key, n_ref, rng)
+    write_qc_plots(release_dir)
+    kept = master_key[master_key['prune_reason'].isnull()]
+    write_snp_metrics(snp_dir, kept, ancestries, chromosomes, n_snps, n_metrics_samples, rng)
+    write_admixture(admixture_dir, ref_pca, rng)
+
+    build_release(raw_dir, bucket_dir, release, workers=workers)
+    write_rare_variants(os.path.join(bucket_dir, 'cohort_browser', 'nba', 'rare_variants'), n_rare_variants, rng)
+    write_frontend_images(os.path.join(bucket_dir, 'cohort_browser', 'frontend'))
+    return bucket_dir
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate and build a synthetic GP2 release.')
+    parser.add_argument('out_dir', help='Output directory; the bucket is written to {out_dir}/bucket.')
+    parser.add_argument('--samples', type=int, default=20000, help='Samples in the master key (N).')
+    parser.add_argument('--snps', type=int, default=1000, help='SNPs per chromosome (M).')
+    parser.add_argument('--metrics-samples', type=int, default=None, help='Samples per ancestry in the metrics files (S).')
+    parser.add_argument('--ancestries', nargs='+', default=['EUR', 'AAC'], choices=list(ANCESTRY_WEIGHTS))
+    parser.add_argument('--chromosomes', nargs='+', type=int, default=[1])
+    parser.add_argument('--ref-samples', type=int, default=4000)
+    parser.add_argument('--rare-variants', type=int, default=2000)
+    parser.add_argument('--release', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='Size of the build process pool.')
+    args = parser.parse_args()
+
+    print(generate_release(
+        args.out_dir, args.samples, args.snps, n_metrics_samples=args.metrics_samples, ancestries=args.ancestries,
+        chromosomes=args.chromosomes, n_ref=args.ref_samples, n_rare_variants=args.rare_variants,
+        release=args.release, seed=args.seed, workers=args.workers
+    ))
@@ -0,0 +1,278 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+import inspect
+import argparse
+import datetime
+import functools
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from snp_summary_precompute import (
+    build_snp_summary,
+    build_variant_major,
+    build_compact_metrics
+)
+from admix_graph import build_admixture_plots
+from utils.config import AppConfig
+
+config = AppConfig()
+
+'''Builds every artifact the browser reads for one release from GenoTools outputs, laid out as in
+gs://genotools-server so the output directory can be synced to the bucket as is:
+
+    {raw_dir}/release{N}/          nba_app_key.csv, PCA/ancestry tables and QC plots from GenoTools
+    {raw_dir}/snp_metrics/         {ancestry}/chr{N}_metrics.csv, {ancestry}/{ancestry}_maf.afreq, full_maf.afreq
+    {raw_dir}/admixture/           ref_panel_admixture_{K}.txt
+
+Steps run in parallel on a process pool, one dependency level at a time. The content hashes of
+every step's inputs and outputs are recorded in cohort_browser/nba/release{N}/manifest.json, and a
+rebuild skips steps whose inputs, parameters and code are unchanged and whose outputs are intact.'''
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RELEASE_FILES = [
+    'nba_app_key.csv', 'proj_pca_plot.csv', 'ref_pca_plot.csv', 'anc_summary.csv', 'pie_table.csv',
+    'confusion_matrix.csv', 'model_metrics.csv', 'related_plot.csv', 'funnel_plot.html', 'variant_plot.html'
+]
+
+
+def file_sha256(path, chunk_size=2**20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def called_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= called_names(const)
+    return names
+
+
+@functools.lru_cache(maxsize=None)
+def code_files(func):
+    """
+    Source files of the repo modules defining the functions `func` calls, and the functions those
+    call in turn, so a step reruns when the builder code behind it changes and not only its wrapper.
+    """
+    files = set()
+    seen = {func}
+    pending = [func]
+    while pending:
+        called = pending.pop()
+        if called is not func:
+            files.add(inspect.getsourcefile(called))
+        for name in called_names(called.__code__):
+            target = called.__globals__.get(name)
+            while inspect.isfunction(target):
+                # decorated functions (e.g. @traced) also call into the function they wrap
+                if target not in seen and os.path.abspath(inspect.getsourcefile(target)).startswith(REPO_DIR + os.sep):
+                    seen.add(target)
+                    pending.append(target)
+                target = getattr(target, '__wrapped__', None)
+    return sorted(files)
+
+
+def copy_artifact(inputs, outputs):
+    os.makedirs(os.path.dirname(outputs[0]), exist_ok=True)
+    shutil.copyfile(inputs[0], outputs[0])
+
+
+def sample_dictionary_step(inputs, outputs):
+    master_key = pd.read_csv(inputs[0], sep=',')
+    os.makedirs(os.path.dirname(outputs[0]), exist_ok=True)
+    master_key[['IID']].drop_duplicates().to_csv(outputs[0], index=False)
+
+
+def snp_summary_step(inputs, outputs):
+    build_snp_summary(inputs[0], os.path.dirname(outputs[0]))
+
+
+def compact_metrics_step(inputs, outputs):
+    build_compact_metrics(inputs[0], os.path.dirname(outputs[0]))
+
+
+def variant_major_step(inputs, outputs, metrics_dir, chr_choice):
+    build_variant_major(metrics_dir, chr_choice, os.path.dirname(outputs[0]))
+
+
+def admixture_step(inputs, outputs):
+    build_admixture_plots(inputs[0], os.path.dirname(outputs[0]))
+    if len(outputs) > 2:
+        shutil.copyfile(inputs[0], outputs[2])
+
+
+class Step:
+    """
+    One unit of the build: `func(inputs, outputs, **params)` must write every path in `outputs`.
+    """
+    def __init__(self, name, func, inputs, outputs, params=None):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+
+    def input_hash(self, file_hashes):
+        sha = hashlib.sha256()
+        sha.update(inspect.getsource(self.func).encode('utf-8'))
+        for path in code_files(self.func):
+            sha.update(os.path.relpath(path, REPO_DIR).encode('utf-8'))
+            sha.update(file_sha256(path).encode('utf-8'))
+        sha.update(json.dumps(self.params, sort_keys=True, default=str).encode('utf-8'))
+        for path in self.inputs:
+            sha.update(path.encode('utf-8'))
+            sha.update(file_hashes[path].encode('utf-8'))
+        return sha.hexdigest()
+
+
+def run_step(step):
+    step.func(step.inputs, step.outputs, **step.params)
+    return step.name
+
+
+def plan_steps(raw_dir, out_dir, release):
+    release_dir = os.path.join(out_dir, 'cohort_browser', 'nba', f'release{release}')
+    snp_dir = os.path.join(out_dir, 'cohort_browser', 'nba', 'snp_metrics')
+    frontend_dir = os.path.join(out_dir, 'cohort_browser', 'frontend')
+    steps = []
+
+    for name in RELEASE_FILES:
+        raw_path = os.path.join(raw_dir, f'release{release}', name)
+        if os.path.exists(raw_path):
+            steps.append(Step(f'copy:{name}', copy_artifact, [raw_path], [os.path.join(release_dir, name)]))
+
+    master_key_path = os.path.join(raw_dir, f'release{release}', 'nba_app_key.csv')
+    if os.path.exists(master_key_path):
+        steps.append(Step('sample_dictionary', sample_dictionary_step, [master_key_path],
+                          [os.path.join(release_dir, 'sample_dictionary.csv')]))
+
+    raw_snp_dir = os.path.join(raw_dir, 'snp_metrics')
+    for maf_path in glob.glob(os.path.join(raw_snp_dir, '*.afreq')) + glob.glob(os.path.join(raw_snp_dir, '*', '*.afreq')):
+        rel_path = os.path.relpath(maf_path, raw_snp_dir)
+        steps.append(Step(f'copy:snp_metrics/{rel_path}', copy_artifact, [maf_path], [os.path.join(snp_dir, rel_path)]))
+
+    chromosomes = set()
+    for metrics_path in sorted(glob.glob(os.path.join(raw_snp_dir, '*', 'chr*_metrics.csv'))):
+        ancestry = os.path.basename(os.path.dirname(metrics_path))
+        name = os.path.basename(metrics_path)
+        chromosomes.add(int(name[3:-len('_metrics.csv')]))
+        anc_dir = os.path.join(snp_dir, ancestry)
+        steps.append(Step(f'summary:{ancestry}/{name}', snp_summary_step, [metrics_path],
+                          [os.path.join(anc_dir, name.replace('_metrics.csv', '_summary.csv')), os.path.join(anc_dir, name)]))
+        steps.append(Step(f'compact:{ancestry}/{name}', compact_metrics_step, [metrics_path],
+                          [os.path.join(anc_dir, name.replace('.csv', '.npz'))]))
+
+    for chr_choice in sorted(chromosomes):
+        chr_inputs = sorted(glob.glob(os.path.join(raw_snp_dir, '*', f'chr{chr_choice}_metrics.csv')))
+        out_chr_dir = os.path.join(snp_dir, 'all_ancestries')
+        steps.append(Step(f'variant_major:chr{chr_choice}', variant_major_step, chr_inputs,
+                          [os.path.join(out_chr_dir, f'chr{chr_choice}_index.csv'), os.path.join(out_chr_dir, f'chr{chr_choice}_metrics.csv')],
+                          params={'metrics_dir': raw_snp_dir, 'chr_choice': chr_choice}))
+
+    for admix_path in sorted(glob.glob(os.path.join(raw_dir, 'admixture', 'ref_panel_admixture_*.txt'))):
+        k = int(os.path.basename(admix_path)[len('ref_panel_admixture_'):-len('.txt')])
+        outputs = [os.path.join(frontend_dir, f'refpanel_admix_{k}.png'), os.path.join(frontend_dir, f'refpanel_admix_{k}.json')]
+        if k == config.ADMIXTURE_K:
+            outputs.append(os.path.join(frontend_dir, 'ref_panel_admixture.txt'))
+        steps.append(Step(f'admixture:K{k}', admixture_step, [admix_path], outputs))
+
+    return steps
+
+
+def dependency_levels(steps):
+    """
+    Group steps into levels so each step runs after every step producing one of its inputs.
+    """
+    producer = {path: step.name for step in steps for path in step.outputs}
+    level = {}
+
+    def step_level(step):
+        if step.name not in level:
+            deps = [by_name[producer[path]] for path in step.inputs if path in producer]
+            level[step.name] = 1 + max([step_level(dep) for dep in deps], default=-1)
+        return level[step.name]
+
+    by_name = {step.name: step for step in steps}
+    levels = {}
+    for step in steps:
+        levels.setdefault(step_level(step), []).append(step)
+    return [levels[i] for i in sorted(levels)]
+
+
+def load_manifest(manifest_path):
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {'steps': {}, 'artifacts': {}}
+
+
+def build_release(raw_dir, out_dir, release, workers=None, force=False):
+    manifest_path = os.path.join(out_dir, 'cohort_browser', 'nba', f'release{release}', 'manifest.json')
+    old_manifest = load_manifest(manifest_path)
+    steps = plan_steps(raw_dir, out_dir, release)
+    file_hashes = {}
+    new_manifest = {'release': release, 'steps': {}, 'artifacts': {}}
+
+    for level_steps in dependency_levels(steps):
+        for step in level_steps:
+            for path in step.inputs:
+                if path not in file_hashes:
+                    file_hashes[path] = file_sha256(path)
+
+        to_run = []
+        for step in level_steps:
+            old = old_manifest['steps'].get(step.name)
+            intact = old is not None and all(
+                os.path.exists(path) and old_manifest['artifacts'].get(os.path.relpath(path, out_dir), {}).get('sha256') == file_sha256(path)
+                for path in step.outputs
+            )
+            if force or not intact or old['input_hash'] != step.input_hash(file_hashes):
+                to_run.append(step)
+
+        if to_run:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for name in pool.map(run_step, to_run):
+                    print(f'built {name}')
+        print(f'{len(level_steps) - len(to_run)} of {len(level_steps)} steps up to date')
+
+        for step in level_steps:
+            for path in step.outputs:
+                file_hashes[path] = file_sha256(path)
+                new_manifest['artifacts'][os.path.relpath(path, out_dir)] = {
+                    'sha256': file_hashes[path],
+                    'size': os.path.getsize(path),
+                    'step': step.name
+                }
+            new_manifest['steps'][step.name] = {
+                'input_hash': step.input_hash(file_hashes),
+                'outputs': [os.path.relpath(path, out_dir) for path in step.outputs]
+            }
+
+    release_hash = hashlib.sha256()
+    for path in sorted(new_manifest['artifacts']):
+        release_hash.update(f"{path}:{new_manifest['artifacts'][path]['sha256']}".encode('utf-8'))
+    new_manifest['release_hash'] = release_hash.hexdigest()
+    new_manifest['built_at'] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path, 'w') as f:
+        json.dump(new_manifest, f, indent=2)
+    return manifest_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build all browser artifacts for a release from GenoTools outputs.')
+    parser.add_argument('raw_dir', help='Directory of GenoTools outputs (see module docstring for layout).')
+    parser.add_argument('out_dir', help='Output directory, mirroring the genotools-server bucket.')
+    parser.add_argument('--release', type=int, default=config.RELEASE_OPTIONS[0])
+    parser.add_argument('--workers', type=int, default=None, help='Size of the process pool.')
+    parser.add_argument('--force', action='store_true', help='Rebuild every step.')
+    args = parser.parse_args()
+
+    print(build_release(args.raw_dir, args.out_dir, args.release, workers=args.workers, force=args.force))
@@ -9,7 +9,9 @@ from utils.hold_data import (
     get_master_key,
     filter_by_cohort,
     filter_by_ancestry,
-    update_sex_labels
+    update_sex_labels,
+    sync_release_manifest,
+    master_key_version
 )
 from utils.metadata_utils import (
     display_ancestry, 
@@ -19,6 +21,8 @@ from utils.metadata_utils import (
     display_pruned_samples, 
     display_related_samples
 )
+from utils.figure_pool_utils import page_figures
+from utils.tracing_utils import trace_page
 from utils.config import AppConfig
 
 config = AppConfig()
@@ -28,6 +32,7 @@ def main():
     release_select()
 
     gp2_data_bucket = get_gcloud_bucket('genotools-server')
+    sync_release_manifest(gp2_data_bucket)
     master_key = get_master_key(gp2_data_bucket)
     master_key_cohort = filter_by_cohort(master_key)
     
@@ -37,6 +42,8 @@ def main():
 
     master_key = filter_by_ancestry(master_key_cohort)
     master_key = update_sex_labels(master_key)
+    # figures built from the filtered master key are shared by sessions with the same version
+    version = master_key_version(gp2_data_bucket)
 
     tab_ancestry, tab_age, tab_qc = st.tabs([
         "Ancestry",
@@ -45,15 +52,12 @@ def main():
     ])
 
     with tab_ancestry:
-        display_ancestry(master_key_cohort)
+        display_ancestry(master_key_cohort, version)
         st.markdown('----') 
         
         plot_title = f'{st.session_state["cohort_choice"]} PCA for {st.session_state["meta_ancestry_choice"]} Samples'
-        if plot_title not in st.session_state:
-            ancestry_pca(master_key, plot_title, gp2_data_bucket)
-        
         st.markdown(f'#### {plot_title}')
-        st.plotly_chart(st.session_state[plot_title])
+        ancestry_pca(master_key, gp2_data_bucket, version)
 
     with tab_age:
         st.markdown('#### Stratify Age by:')
@@ -61,14 +65,15 @@ def main():
 
         plot1, plot2 = st.columns([1, 1.75], vertical_alignment = 'center')
 
-        plot_age_distribution(master_key, stratify, plot2)
+        plot_age_distribution(master_key, stratify, plot2, version)
         display_phenotype_counts(master_key, plot1)
 
     with tab_qc:
         pruned1, pruned2 = st.columns([1, 1.75])
         pruned_key['prune_reason'] = pruned_key['prune_reason'].map(config.PRUNE_MAP)
         display_pruned_samples(pruned_key, pruned1)
-        display_related_samples(pruned_key, pruned2)
+        display_related_samples(pruned_key, pruned2, version)
 
 if __name__ == "__main__":
-    main()
+    with trace_page('GP2 Release'), page_figures():
+        main()
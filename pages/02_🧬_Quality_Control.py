@@ -5,6 +5,7 @@ from utils.hold_data import (
     config_page
 )
 from utils.quality_control_utils import load_qc_data
+from utils.tracing_utils import trace_page
 from utils.config import AppConfig
 
 config = AppConfig()
@@ -41,4 +42,5 @@ def main():
     components.html(variant_plot, height=600)
 
 if __name__ == "__main__":
-    main()
+    with trace_page('Quality Control'):
+        main()
@@ -5,7 +5,8 @@ import streamlit as st
 from utils.hold_data import (
     get_gcloud_bucket,
     release_select,
-    config_page
+    config_page,
+    sync_release_manifest
 )
 
 from utils.ancestry_utils import (
@@ -15,6 +16,8 @@ from utils.ancestry_utils import (
     render_tab_pie,
     render_tab_pred_stats
 )
+from utils.figure_pool_utils import page_figures
+from utils.tracing_utils import trace_page
 from utils.config import AppConfig
 
 config = AppConfig()
@@ -27,6 +30,7 @@ def main():
     release_select()
 
     gp2_data_bucket = get_gcloud_bucket('genotools-server') # used to be gp2tier2
+    sync_release_manifest(gp2_data_bucket)
     plot_folder = f"cohort_browser/nba/release{st.session_state['release_choice']}"
 
     tab_pca, tab_pred_stats, tab_pie, tab_admix, tab_methods = st.tabs([
@@ -55,4 +59,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with trace_page('Ancestry'), page_figures():
+        main()
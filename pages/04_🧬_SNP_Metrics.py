@@ -2,12 +2,23 @@ import streamlit as st
 from utils.hold_data import (
     get_gcloud_bucket, 
     chr_ancestry_select, 
-    config_page
+    config_page,
+    sync_release_manifest
 )
 from utils.snp_metrics_utils import (
-    load_metrics_data,
-    display_snp_metrics
+    load_maf_data,
+    load_snp_summary,
+    load_snp_rows,
+    load_snp_all_ancestries,
+    load_genotype_table,
+    load_association_scan,
+    filter_snp_summary,
+    decimate_manhattan,
+    plot_manhattan,
+    display_snp_metrics,
+    display_cross_ancestry
 )
+from utils.tracing_utils import trace_page
 from utils.config import AppConfig
 
 config = AppConfig()
@@ -20,26 +31,54 @@ def main():
         st.markdown(config.DESCRIPTIONS['snp_metrics'])
 
     snp_metrics_bucket = get_gcloud_bucket("genotools-server")
+    sync_release_manifest(snp_metrics_bucket)
     chr_ancestry_select()
     chr_choice = st.session_state['chr_choice']
     ancestry_choice = st.session_state['ancestry_choice']
 
-    metrics, maf, full_maf = load_metrics_data(snp_metrics_bucket, ancestry_choice, chr_choice)
+    summary = load_snp_summary(snp_metrics_bucket, ancestry_choice, chr_choice)
 
-    num_snps = metrics['snpID'].nunique()
-    num_samples = metrics['Sample_ID'].nunique()
+    num_snps = len(summary)
+    num_samples = int(summary['n_samples'].max()) if num_snps > 0 else 0
     metric1, metric2 = st.columns([1, 1])
     metric1.metric(f"Number of SNPs on Chromosome {chr_choice} for {ancestry_choice}", f"{num_snps}")
     metric2.metric(f"Number of {ancestry_choice} samples with SNP metrics available", f"{num_samples}")
 
     if num_samples > 0:
-        metrics['snp_label'] = metrics['snpID'] + ' (' + metrics['chromosome'].astype(str) + ':' + metrics['position'].astype(str) + ')'
-        snp_options = ['Select SNP!'] + metrics['snp_label'].unique().tolist()
+        gt_table = load_genotype_table(summary, ancestry_choice, chr_choice)
+        with st.expander("Per-SNP Genotype Summary"):
+            st.dataframe(gt_table, use_container_width=True)
+
+        release_choice = st.session_state.get('release_choice', config.RELEASE_OPTIONS[0])
+        with st.expander("Case-Control Association Overview"):
+            assoc = load_association_scan(summary, gt_table, release_choice, ancestry_choice, chr_choice)
+            manhattan_plot = plot_manhattan(
+                decimate_manhattan(assoc),
+                title=f'Chromosome {chr_choice} {ancestry_choice} Trend Test (PD vs. Control)'
+            )
+            st.plotly_chart(manhattan_plot, use_container_width=True)
+
+        filter1, filter2 = st.columns([1, 1])
+        gentrain_range = filter1.slider("GenTrain Score range", 0.0, 1.0, (0.0, 1.0), step=0.01, key="gentrain_range")
+        sort_choice = filter2.selectbox("Order SNPs by", list(config.SNP_SORT_OPTIONS), key="snp_sort_choice")
+        snp_view = filter_snp_summary(summary, gentrain_range, sort_choice)
+        snp_options = ['Select SNP!'] + snp_view['snp_label'].tolist()
 
         snp_choice = st.selectbox("Select SNP", snp_options, key="snp_choice")
 
         if snp_choice != 'Select SNP!':
-            display_snp_metrics(metrics, maf, full_maf, ancestry_choice, snp_choice)
+            snp_summary = snp_view[snp_view['snp_label'] == snp_choice].iloc[0]
+            snp_df = load_snp_rows(snp_metrics_bucket, ancestry_choice, chr_choice, snp_summary)
+            maf, full_maf = load_maf_data(snp_metrics_bucket, ancestry_choice)
+            display_snp_metrics(snp_df, maf, full_maf, gt_table, ancestry_choice, snp_choice)
+
+            if st.toggle("Compare across ancestries", key="cross_ancestry_toggle"):
+                snp_all_df = load_snp_all_ancestries(snp_metrics_bucket, chr_choice, snp_summary['snpID'])
+                if snp_all_df is None:
+                    st.info(f"Cross-ancestry metrics are not available for chromosome {chr_choice}.")
+                else:
+                    display_cross_ancestry(snp_all_df, snp_choice)
 
 if __name__ == "__main__":
-    main()
+    with trace_page("SNP Metrics"):
+        main()
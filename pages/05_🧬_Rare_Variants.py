@@ -8,6 +8,7 @@ from utils.rare_variants_utils import (
     load_rare_variant_data,
     filter_rare_variant_data
 )
+from utils.tracing_utils import trace_page
 
 def main():
     """Main function for the GP2 Rare Variant Browser."""
@@ -29,4 +30,5 @@ def main():
     st.dataframe(rv_data_filtered, hide_index=True, use_container_width=True)
 
 if __name__ == "__main__":
-    main()
+    with trace_page("GP2 Rare Variant Browser"):
+        main()
@@ -0,0 +1,56 @@
+import streamlit as st
+from utils.hold_data import (
+    get_gcloud_bucket,
+    release_select,
+    config_page,
+    place_logos,
+    sync_release_manifest
+)
+from utils.sample_lookup_utils import (
+    load_sample_index,
+    lookup_sample,
+    display_sample_profile,
+    display_sample_pca,
+    display_sample_genotypes
+)
+from utils.tracing_utils import trace_page
+from utils.config import AppConfig
+
+config = AppConfig()
+
+def main():
+    config_page("Sample Lookup")
+    release_select()
+    place_logos()
+    st.title("GP2 Sample Lookup")
+
+    with st.expander("Description"):
+        st.markdown(config.DESCRIPTIONS['sample_lookup'])
+
+    gp2_data_bucket = get_gcloud_bucket("genotools-server")
+    sync_release_manifest(gp2_data_bucket)
+    sample_index = load_sample_index(gp2_data_bucket)
+
+    sample_id = st.text_input("GP2ID", key="lookup_sample_id").strip()
+    if not sample_id:
+        return
+
+    profile = lookup_sample(sample_index, sample_id)
+    if profile is None:
+        st.error(f"{sample_id} is not a sample in GP2 Release {st.session_state['release_choice']}.")
+        return
+
+    display_sample_profile(profile, sample_id)
+
+    tab_pca, tab_genotypes = st.tabs(["Ancestry PCA", "Genotype Calls"])
+
+    with tab_pca:
+        display_sample_pca(sample_index, profile, sample_id)
+
+    with tab_genotypes:
+        chr_choice = st.selectbox("Chromosome", list(range(1, 23)), key="lookup_chr_choice")
+        display_sample_genotypes(gp2_data_bucket, profile, sample_id, chr_choice)
+
+if __name__ == "__main__":
+    with trace_page("Sample Lookup"):
+        main()
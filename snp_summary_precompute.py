@@ -0,0 +1,153 @@
+import os
+import base64
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from io import BytesIO
+from utils.snp_metrics_utils import compute_snp_summary
+from utils.snp_storage_utils import write_compact_metrics
+from utils.config import AppConfig
+
+config = AppConfig()
+
+'''Builds the per-variant chr{N}_summary.csv read by the SNP Metrics page from a chromosome's
+chr{N}_metrics.csv. Rows of each SNP are made contiguous in the metrics file (rewriting it if
+needed) and the summary records the byte range of every SNP's rows, so the page only downloads
+the rows of the SNP that is opened. The summary also records the metrics file's MD5 as GCS
+reports it, and the page only uses the byte ranges while the uploaded metrics match. Upload both
+files to
+gs://genotools-server/cohort_browser/nba/snp_metrics/{ancestry}/ afterwards.
+
+The variant_major command merges one chromosome's metrics across every ancestry into a single
+file grouped by SNP (chr{N}_metrics.csv with an added ancestry column) plus chr{N}_index.csv of
+per-SNP byte ranges and the merged file's MD5, for upload to gs://genotools-server/cohort_browser/nba/snp_metrics/all_ancestries/.
+
+The compact command writes chr{N}_metrics.npz next to each chr{N}_metrics.csv: Theta/R quantized
+to 16 bits, GT/phenotype as int8 codes and variant metadata in a separate per-variant table. The
+page prefers it over the CSV when it is present.'''
+
+
+def snp_byte_ranges(metrics_bytes, snp_codes, n_snps):
+    """
+    Byte offset and length of each SNP's block of rows in a metrics CSV whose rows are
+    grouped by SNP. Assumes one record per line with no embedded newlines.
+    """
+    newlines = np.flatnonzero(np.frombuffer(metrics_bytes, dtype=np.uint8) == ord('\n'))
+    line_starts = np.concatenate([[0], newlines + 1])
+    row_starts = line_starts[1:len(snp_codes) + 1]
+    row_ends = np.append(row_starts[1:], len(metrics_bytes))
+
+    block_start = np.flatnonzero(np.diff(snp_codes, prepend=-1) != 0)
+    block_end = np.append(block_start[1:], len(snp_codes)) - 1
+    offsets = np.zeros(n_snps, dtype=np.int64)
+    lengths = np.zeros(n_snps, dtype=np.int64)
+    offsets[snp_codes[block_start]] = row_starts[block_start]
+    lengths[snp_codes[block_start]] = row_ends[block_end] - row_starts[block_start]
+    return int(line_starts[1]), offsets, lengths
+
+
+def gcs_md5(data):
+    """
+    MD5 of `data` in the form GCS reports for a blob (Blob.md5_hash): base64 of the digest.
+    """
+    return base64.b64encode(hashlib.md5(data).digest()).decode('ascii')
+
+
+def build_snp_summary(metrics_path, out_dir):
+    with open(metrics_path, 'rb') as f:
+        metrics_bytes = f.read()
+    metrics = pd.read_csv(BytesIO(metrics_bytes), sep=',')
+
+    snp_codes, snp_ids = pd.factorize(metrics['snpID'])
+    regrouped = (np.diff(snp_codes) != 0).sum() != len(snp_ids) - 1
+    if regrouped:
+        # group each SNP's rows together, keeping SNPs in order of first appearance
+        metrics = metrics.iloc[np.argsort(snp_codes, kind='stable')].reset_index(drop=True)
+        metrics_bytes = metrics.to_csv(index=False).encode('utf-8')
+        snp_codes = np.sort(snp_codes, kind='stable')
+
+    summary = compute_snp_summary(metrics)
+    header_length, summary['byte_offset'], summary['byte_length'] = snp_byte_ranges(metrics_bytes, snp_codes, len(snp_ids))
+    summary['header_length'] = header_length
+    summary['metrics_md5'] = gcs_md5(metrics_bytes)
+
+    os.makedirs(out_dir, exist_ok=True)
+    metrics_name = os.path.basename(metrics_path)
+    out_metrics_path = os.path.join(out_dir, metrics_name)
+    if regrouped or os.path.abspath(out_metrics_path) != os.path.abspath(metrics_path):
+        with open(out_metrics_path, 'wb') as f:
+            f.write(metrics_bytes)
+    summary_path = os.path.join(out_dir, metrics_name.replace('_metrics.csv', '_summary.csv'))
+    summary.to_csv(summary_path, index=False)
+    return summary_path
+
+
+def build_variant_major(metrics_dir, chr_choice, out_dir):
+    ancestry_metrics = []
+    for ancestry in config.ANCESTRY_OPTIONS:
+        metrics_path = os.path.join(metrics_dir, ancestry, f'chr{chr_choice}_metrics.csv')
+        if os.path.exists(metrics_path):
+            metrics = pd.read_csv(metrics_path, sep=',')
+            metrics.insert(0, 'ancestry', ancestry)
+            ancestry_metrics.append(metrics)
+    if not ancestry_metrics:
+        return None
+    metrics = pd.concat(ancestry_metrics, ignore_index=True)
+
+    # SNPs in order of first appearance, ancestries in config order within each SNP
+    snp_codes, snp_ids = pd.factorize(metrics['snpID'])
+    metrics = metrics.iloc[np.argsort(snp_codes, kind='stable')].reset_index(drop=True)
+    snp_codes = np.sort(snp_codes, kind='stable')
+    metrics_bytes = metrics.to_csv(index=False).encode('utf-8')
+
+    index = pd.DataFrame({'snpID': snp_ids})
+    header_length, index['byte_offset'], index['byte_length'] = snp_byte_ranges(metrics_bytes, snp_codes, len(snp_ids))
+    index['header_length'] = header_length
+    index['metrics_md5'] = gcs_md5(metrics_bytes)
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, f'chr{chr_choice}_metrics.csv'), 'wb') as f:
+        f.write(metrics_bytes)
+    index_path = os.path.join(out_dir, f'chr{chr_choice}_index.csv')
+    index.to_csv(index_path, index=False)
+    return index_path
+
+
+def build_compact_metrics(metrics_path, out_dir):
+    metrics = pd.read_csv(metrics_path, sep=',')
+    os.makedirs(out_dir, exist_ok=True)
+    compact_path = os.path.join(out_dir, os.path.basename(metrics_path).replace('.csv', '.npz'))
+    write_compact_metrics(metrics, compact_path)
+    return compact_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build per-variant SNP summaries and the variant-major cross-ancestry layout.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    summary_parser = subparsers.add_parser('summary', help='Build chr{N}_summary.csv from chr{N}_metrics.csv files.')
+    summary_parser.add_argument('metrics_paths', nargs='+', help='Paths to chr{N}_metrics.csv files.')
+    summary_parser.add_argument('--out_dir', default=None, help='Output directory. Defaults to the directory of each metrics file.')
+
+    variant_parser = subparsers.add_parser('variant_major', help='Merge per-ancestry metrics into one variant-major file per chromosome.')
+    variant_parser.add_argument('metrics_dir', help='Directory containing one {ancestry}/chr{N}_metrics.csv folder per ancestry.')
+    variant_parser.add_argument('--chromosomes', nargs='+', type=int, default=list(range(1, 23)))
+    variant_parser.add_argument('--out_dir', required=True, help='Output directory.')
+
+    compact_parser = subparsers.add_parser('compact', help='Write quantized chr{N}_metrics.npz files from chr{N}_metrics.csv files.')
+    compact_parser.add_argument('metrics_paths', nargs='+', help='Paths to chr{N}_metrics.csv files.')
+    compact_parser.add_argument('--out_dir', default=None, help='Output directory. Defaults to the directory of each metrics file.')
+    args = parser.parse_args()
+
+    if args.command == 'summary':
+        for metrics_path in args.metrics_paths:
+            out_dir = args.out_dir if args.out_dir else os.path.dirname(os.path.abspath(metrics_path))
+            print(build_snp_summary(metrics_path, out_dir))
+    elif args.command == 'variant_major':
+        for chr_choice in args.chromosomes:
+            print(build_variant_major(args.metrics_dir, chr_choice, args.out_dir))
+    else:
+        for metrics_path in args.metrics_paths:
+            out_dir = args.out_dir if args.out_dir else os.path.dirname(os.path.abspath(metrics_path))
+            print(build_compact_metrics(metrics_path, out_dir))
@@ -1,19 +1,34 @@
+import hashlib
 import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 import streamlit as st
 from utils.hold_data import (
+    artifact_version,
     blob_as_csv,
+    versioned_csv,
     get_gcloud_bucket,
-    admix_ancestry_select
+    admix_ancestry_select,
+    get_sample_dictionary,
+    intern_sample_ids,
+    isin_samples,
+    has_artifact,
+    load_shared_table
 )
+from utils.gcs_utils import download_optional_blob
+from utils.session_cache_utils import session_cache
+from utils.figure_pool_utils import pooled_chart
+from utils import figure_utils
+from utils.tracing_utils import traced
 from utils.config import AppConfig
 
 config = AppConfig()
 
 
-def plot_3d(labeled_df, color, symbol=None, x='PC1', y='PC2', z='PC3', title=None, x_range=None, y_range=None, z_range=None):
+@traced('figure')
+def plot_3d(labeled_df, color, symbol=None, x='PC1', y='PC2', z='PC3', title=None, x_range=None, y_range=None, z_range=None, groups=None):
     """
     Create a 3D scatter plot using Plotly.
 
@@ -28,36 +43,51 @@ def plot_3d(labeled_df, color, symbol=None, x='PC1', y='PC2', z='PC3', title=Non
         x_range (list of float, optional): Range for x-axis [min, max].
         y_range (list of float, optional): Range for y-axis [min, max].
         z_range (list of float, optional): Range for z-axis [min, max].
+        groups (tuple, optional): figure_utils.category_groups of the color (and symbol) column,
+                                  when already computed.
     """
-    fig = px.scatter_3d(
+    return figure_utils.scatter_3d(
         labeled_df,
         x=x,
         y=y,
         z=z,
         color=color,
-        opacity=0.6,
+        color_map=config.ANCESTRY_COLOR_MAP,
+        color_sequence=px.colors.qualitative.Bold,
+        groups=groups,
         symbol=symbol,
-        title=title,
-        color_discrete_map=config.ANCESTRY_COLOR_MAP,
-        color_discrete_sequence=px.colors.qualitative.Bold,
-        range_x=x_range,
-        range_y=y_range,
-        range_z=z_range,
         hover_name="IID",
+        opacity=0.6,
+        marker_size=4,
+        title=title,
+        x_range=x_range,
+        y_range=y_range,
+        z_range=z_range,
         height=700
     )
-    fig.update_traces(marker={'size': 4})
-    return fig
 
-def plot_pca_with_legend_toggle(ref_df, keep_df, x='PC1', y='PC2', z='PC3', label_col='label'):
-    categories = sorted(ref_df[label_col].unique())
+@traced('figure')
+def build_reference_pca_figure(ref_df, x='PC1', y='PC2', z='PC3', label_col='label'):
+    """
+    Build the reference panel PCA figure: one trace per ancestry from a single groupby pass,
+    followed by an empty "Samples of Interest" trace filled in by set_samples_of_interest.
 
-    fig = go.Figure()
+    Parameters:
+        ref_df (pd.DataFrame): Reference panel PCA with IID, PC and label columns.
+        x, y, z (str, optional): Column names of the plotted dimensions.
+        label_col (str, optional): Column name containing ancestry labels.
+    """
+    hovertemplate = (
+        "IID: %{text}<br>"
+        "Label: %{customdata[0]}<br>"
+        f"{x}: %{{x}}<br>"
+        f"{y}: %{{y}}<br>"
+        f"{z}: %{{z}}<extra></extra>"
+    )
 
     # 1) One trace per ancestry
-    for cat in categories:
-        subset = ref_df[ref_df[label_col] == cat]
-        fig.add_trace(go.Scatter3d(
+    traces = [
+        go.Scatter3d(
             x=subset[x],
             y=subset[y],
             z=subset[z],
@@ -74,26 +104,20 @@ def plot_pca_with_legend_toggle(ref_df, keep_df, x='PC1', y='PC2', z='PC3', labe
             # Add IID and label to hover
             text=subset['IID'],
             customdata=subset[[label_col]],     # for label
-            hovertemplate=(
-                "IID: %{text}<br>"
-                "Label: %{customdata[0]}<br>"
-                f"{x}: %{{x}}<br>"
-                f"{y}: %{{y}}<br>"
-                f"{z}: %{{z}}<extra></extra>"
-            )
-        ))
-
-    # 2) samples_of_interest 
-    fig.add_trace(go.Scatter3d(
-        x=keep_df[x],
-        y=keep_df[y],
-        z=keep_df[z],
+            hovertemplate=hovertemplate
+        )
+        for cat, subset in ref_df.groupby(label_col, sort=True)
+    ]
+
+    # 2) samples_of_interest, empty until a selection is made
+    traces.append(go.Scatter3d(
+        x=[],
+        y=[],
+        z=[],
         mode='markers',
         marker=dict(size=8, color='red', symbol='diamond', opacity=1.0),
         name='Samples of Interest',
         legendgroup='Samples of Interest',
-        text=keep_df['IID'],
-        customdata=keep_df[['Predicted Ancestry']],
         hovertemplate=(
             "GP2ID: %{text}<br>"
             "Predicted label: %{customdata[0]}<br>"
@@ -103,6 +127,8 @@ def plot_pca_with_legend_toggle(ref_df, keep_df, x='PC1', y='PC2', z='PC3', labe
         )
     ))
 
+    fig = go.Figure(data=traces)
+
     # Layout
     fig.update_layout(
         scene=dict(
@@ -115,7 +141,44 @@ def plot_pca_with_legend_toggle(ref_df, keep_df, x='PC1', y='PC2', z='PC3', labe
 
     return fig
 
+@traced('figure')
+def set_samples_of_interest(fig, keep_df, x='PC1', y='PC2', z='PC3'):
+    """
+    Copy of a reference PCA figure with the data of its "Samples of Interest" trace replaced. The
+    figure itself is kept in the session and may be shared by figures built on the figure pool,
+    so it is not changed.
+    """
+    fig = go.Figure(fig)
+    fig.data[-1].update(
+        x=keep_df[x],
+        y=keep_df[y],
+        z=keep_df[z],
+        text=keep_df['IID'],
+        customdata=keep_df[['Predicted Ancestry']]
+    )
+    return fig
 
+@traced('load')
+def load_reference_pca_figure(ref_df, pca_folder, x='PC1', y='PC2', z='PC3', label_col='label'):
+    """
+    Reference panel PCA figure for a release, built once per session and reused across reruns.
+    """
+    fig_key = f"{pca_folder}_ref_pca_{x}_{y}_{z}_{label_col}"
+    cache = session_cache()
+    if fig_key not in cache:
+        fig = build_reference_pca_figure(ref_df, x=x, y=y, z=z, label_col=label_col)
+        cache[fig_key] = fig
+    else:
+        fig = cache[fig_key]
+    return fig
+
+@traced('figure')
+def plot_pca_with_legend_toggle(ref_df, keep_df, x='PC1', y='PC2', z='PC3', label_col='label'):
+    fig = build_reference_pca_figure(ref_df, x=x, y=y, z=z, label_col=label_col)
+    return set_samples_of_interest(fig, keep_df, x=x, y=y, z=z)
+
+
+@traced('figure')
 def plot_pie(df, proportion_label='Proportion'):
     """
     Create an interactive pie chart using Plotly.
@@ -135,6 +198,50 @@ def plot_pie(df, proportion_label='Proportion'):
     return pie_chart
 
 
+@traced('load')
+def load_projected_pca_figure(ref_pca, proj_pca, pca_folder, color='label'):
+    """
+    Reference panel vs. projected samples PCA figure for a release, built once per session.
+
+    Returns None when a projected sample label is shared with the reference panel, since the
+    projected samples' traces could then not be replaced on their own.
+    """
+    fig_key = f"{pca_folder}_proj_pca_{color}"
+    cache = session_cache()
+    if fig_key not in cache:
+        if set(proj_pca[color].unique()).isdisjoint(ref_pca[color].unique()):
+            fig = plot_3d(pd.concat([ref_pca, proj_pca], axis=0), color)
+        else:
+            fig = None
+        cache[fig_key] = fig
+    else:
+        fig = cache[fig_key]
+    return fig
+
+@traced('figure')
+def set_projected_samples(fig, proj_labels, selected_pca, color='label', x='PC1', y='PC2', z='PC3'):
+    """
+    Copy of a load_projected_pca_figure figure with its projected-sample traces (those named in
+    `proj_labels`) restricted to `selected_pca`. Traces left without samples are hidden, legend
+    entry included, as if the figure had been built from the selection alone. The figure itself
+    is kept in the session and so is not changed.
+    """
+    fig = go.Figure(fig)
+    for trace in fig.data:
+        if trace.name in proj_labels:
+            subset = selected_pca[selected_pca[color] == trace.name]
+            trace.update(x=subset[x], y=subset[y], z=subset[z], hovertext=subset['IID'], visible=not subset.empty)
+    return fig
+
+def projected_pca_figure(fig, proj_labels, ref_pca, selected_pca):
+    """
+    Reference panel vs. selected projected samples PCA, from a load_projected_pca_figure figure
+    when there is one (fig is None otherwise).
+    """
+    if fig is not None:
+        return set_projected_samples(fig, proj_labels, selected_pca)
+    return plot_3d(pd.concat([ref_pca, selected_pca], axis=0), 'label')
+
 def render_tab_pca(pca_folder, gp2_data_bucket):
     """
     Render the PCA tab in the Streamlit interface.
@@ -144,13 +251,14 @@ def render_tab_pca(pca_folder, gp2_data_bucket):
         gp2_data_bucket (google.cloud.storage.bucket.Bucket): GCloud bucket object.
         master_key (pd.DataFrame): Master key dataframe.
     """
-    ref_pca = blob_as_csv(
+    ref_pca = load_shared_table(
         gp2_data_bucket, f'{pca_folder}/ref_pca_plot.csv', sep=',')
-    proj_pca = blob_as_csv(
+    proj_pca = load_shared_table(
         gp2_data_bucket, f'{pca_folder}/proj_pca_plot.csv', sep=',')
+    pca_version = (artifact_version(gp2_data_bucket, f'{pca_folder}/ref_pca_plot.csv'),
+                   artifact_version(gp2_data_bucket, f'{pca_folder}/proj_pca_plot.csv'))
     proj_labels = blob_as_csv(
         gp2_data_bucket, f'{pca_folder}/anc_summary.csv', sep=',')
-    total_pca = pd.concat([ref_pca, proj_pca], axis=0)
 
     pca_col1, pca_col2 = st.columns([1.75, 3], vertical_alignment='center')
 
@@ -168,19 +276,109 @@ def render_tab_pca(pca_folder, gp2_data_bucket):
 
     with pca_col2:
         if not selection_list.empty:
-            selected_pca = proj_pca.copy()
-            selected_pca.drop(
-                selected_pca[~selected_pca['Predicted Ancestry'].isin(
-                    selection_list)].index,
-                inplace=True
-            )
-            total_pca_selected = pd.concat([ref_pca, selected_pca], axis=0)
-            fig = plot_3d(total_pca_selected, 'label')
-            st.plotly_chart(fig)
+            selected_pca = proj_pca[proj_pca['Predicted Ancestry'].isin(selection_list)]
+        else:
+            selected_pca = proj_pca
+
+        def load():
+            fig = load_projected_pca_figure(ref_pca, proj_pca, pca_folder)
+            return fig, set(proj_pca['label'].unique()), ref_pca, selected_pca
+
+        key = ('projected_pca', pca_folder, pca_version, tuple(sorted(selection_list)))
+        pooled_chart(key, projected_pca_figure, load=load)
+
+
+@traced('load')
+def load_sample_picker_index(proj_pca, pca_folder):
+    """
+    Row order of the projected samples sorted by IID, used for prefix search. Built once per release.
+    """
+    index_key = f"{pca_folder}_sample_picker_index"
+    cache = session_cache()
+    if index_key not in cache:
+        sample_ids = proj_pca['IID'].to_numpy(dtype=str)
+        order = np.argsort(sample_ids, kind='stable')
+        picker_index = (order, sample_ids[order])
+        cache[index_key] = picker_index
+    else:
+        picker_index = cache[index_key]
+    return picker_index
+
+@traced('compute')
+def search_samples(proj_pca, picker_index, prefix='', ancestries=None):
+    """
+    Positions of the projected samples whose IID starts with `prefix` and whose predicted
+    ancestry is in `ancestries`, in IID order.
+    """
+    order, sorted_ids = picker_index
+    if prefix:
+        start, stop = np.searchsorted(sorted_ids, [prefix, prefix + '\U0010ffff'])
+        rows = order[start:stop]
+    else:
+        rows = order
+    if ancestries:
+        rows = rows[np.isin(proj_pca['Predicted Ancestry'].to_numpy()[rows], ancestries)]
+    return rows
+
+def reset_sample_picker_page():
+    # the search changed: start over from the first page of results
+    st.session_state.pop("sample_picker_page", None)
+    reset_sample_picker_editor()
+
+def reset_sample_picker_editor():
+    # the editor's edits were made to the rows of another page or search
+    st.session_state.pop("sample_picker_editor", None)
+
+def render_sample_picker(proj_pca, pca_folder, page_size=None):
+    """
+    Searchable, paged sample picker. Only the current page of samples is sent to the browser;
+    the selection is kept server-side as a set of interned sample ids.
+
+    Returns:
+        np.ndarray: Interned ids of the selected samples.
+    """
+    page_size = config.SAMPLE_PICKER_PAGE_SIZE if page_size is None else page_size
+    selected_key = f"{pca_folder}_selected_samples"
+    if selected_key not in st.session_state:
+        st.session_state[selected_key] = set()
+    selected = st.session_state[selected_key]
+
+    search1, search2 = st.columns([1, 1])
+    prefix = search1.text_input("Search GP2ID", key="sample_picker_prefix", on_change=reset_sample_picker_page).strip()
+    ancestries = search2.multiselect("Predicted Ancestry", sorted(proj_pca['Predicted Ancestry'].dropna().unique()),
+                                     key="sample_picker_ancestries", on_change=reset_sample_picker_page)
+
+    rows = search_samples(proj_pca, load_sample_picker_index(proj_pca, pca_folder), prefix, ancestries)
+    n_pages = max(1, -(-len(rows) // page_size))
+    # e.g. after switching releases, the page kept may be past the end of the results
+    if st.session_state.get("sample_picker_page", 1) > n_pages:
+        reset_sample_picker_page()
+    page1, page2 = st.columns([1, 2], vertical_alignment='bottom')
+    page = page1.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages,
+                              key="sample_picker_page", on_change=reset_sample_picker_editor)
+    page_rows = rows[(page - 1) * page_size:page * page_size]
+
+    page_samples = proj_pca.iloc[page_rows]
+    page_info = page_samples[['IID', 'Predicted Ancestry']].copy()
+    page_info['Select'] = [idx in selected for idx in page_samples['sample_idx']]
+    select_samples = st.data_editor(
+        page_info, hide_index=True, use_container_width=True, height=423,
+        disabled=['IID', 'Predicted Ancestry'], key="sample_picker_editor")
+
+    for idx, is_selected in zip(page_samples['sample_idx'], select_samples['Select']):
+        if is_selected:
+            selected.add(idx)
         else:
-            fig = plot_3d(total_pca, 'label')
-            st.plotly_chart(fig)
+            selected.discard(idx)
+
+    page2.caption(f"{len(rows):,} matching samples, {len(selected):,} selected")
+    page2.button("Clear selection", key="sample_picker_clear", on_click=clear_sample_selection, args=(selected,))
 
+    return np.fromiter(selected, dtype=np.int32, count=len(selected))
+
+def clear_sample_selection(selected):
+    selected.clear()
+    reset_sample_picker_editor()
 
 def render_pca_select(pca_folder, gp2_data_bucket):
     """
@@ -191,10 +389,14 @@ def render_pca_select(pca_folder, gp2_data_bucket):
         gp2_data_bucket (google.cloud.storage.bucket.Bucket): GCloud bucket object.
         master_key (pd.DataFrame): Master key dataframe.
     """
-    ref_pca = blob_as_csv(
+    ref_pca = load_shared_table(
         gp2_data_bucket, f'{pca_folder}/ref_pca_plot.csv', sep=',')
-    proj_pca = blob_as_csv(
+    proj_pca = load_shared_table(
         gp2_data_bucket, f'{pca_folder}/proj_pca_plot.csv', sep=',')
+    pca_version = (artifact_version(gp2_data_bucket, f'{pca_folder}/ref_pca_plot.csv'),
+                   artifact_version(gp2_data_bucket, f'{pca_folder}/proj_pca_plot.csv'))
+    sample_dict = get_sample_dictionary(gp2_data_bucket)
+    proj_pca['sample_idx'] = intern_sample_ids(proj_pca.IID, sample_dict)
 
     pca_col1, pca_col2 = st.columns([1.75, 3], vertical_alignment='center')
 
@@ -204,21 +406,24 @@ def render_pca_select(pca_folder, gp2_data_bucket):
         with st.expander("Description"):
             st.write(config.DESCRIPTIONS['pca1'])
 
-        sample_info = proj_pca[['IID', 'Predicted Ancestry']].copy()
-        sample_info['Select'] = False
-        select_samples = st.data_editor(
-            sample_info, hide_index=True, use_container_width=True, height=423)
-        selected_list = select_samples.loc[select_samples['Select']
-                                             == True]['IID']
-        
+        selected_idx = render_sample_picker(proj_pca, pca_folder)
+
     with pca_col2:
-        selected_pca = proj_pca[proj_pca.IID.isin(selected_list)]
-        fig = plot_pca_with_legend_toggle(ref_pca, selected_pca, 
-                            x='PC1', y='PC2', z='PC3', 
-                            label_col='label')
-        st.plotly_chart(fig)
+        selected_pca = proj_pca[isin_samples(proj_pca.sample_idx, selected_idx, len(sample_dict))]
 
+        def load():
+            fig = load_reference_pca_figure(ref_pca, pca_folder,
+                                x='PC1', y='PC2', z='PC3',
+                                label_col='label')
+            return fig, selected_pca
 
+        # selected samples by their rows in proj_pca, which are fixed by its version
+        selection = hashlib.sha1(selected_pca.index.to_numpy().tobytes()).hexdigest()
+        key = ('reference_pca', pca_folder, pca_version, selection)
+        pooled_chart(key, set_samples_of_interest, load=load)
+
+
+@traced('figure')
 def plot_confusion_matrix(confusion_matrix):
     """
     Plot the given confusion matrix as percentages rather than raw counts,
@@ -262,19 +467,19 @@ def render_tab_pred_stats(pca_folder, gp2_data_bucket):
         gp2_data_bucket (google.cloud.storage.bucket.Bucket): GCloud bucket object.
     """
     st.markdown('## **Model Accuracy**')
-    confusion_matrix = blob_as_csv(
-        gp2_data_bucket, f'{pca_folder}/confusion_matrix.csv', sep=',')
+    confusion_matrix_path = f'{pca_folder}/confusion_matrix.csv'
     model_metrics = blob_as_csv(
         gp2_data_bucket, f'{pca_folder}/model_metrics.csv', sep=',')
+    metrics = model_metrics.columns.to_list()
 
+    confusion_matrix_version, confusion_matrix = versioned_csv(gp2_data_bucket, confusion_matrix_path, sep=',')
     confusion_matrix.set_index(confusion_matrix.columns, inplace=True)
-    metrics = model_metrics.columns.to_list()
 
     heatmap1, heatmap2 = st.columns([2, 1])
     with heatmap1:
         st.markdown('### Confusion Matrix')
-        fig = plot_confusion_matrix(confusion_matrix)
-        st.plotly_chart(fig)
+        key = ('confusion_matrix', confusion_matrix_path, confusion_matrix_version)
+        pooled_chart(key, plot_confusion_matrix, confusion_matrix)
 
     with heatmap2:
         st.markdown('### Test Set Performance')
@@ -293,19 +498,18 @@ def render_tab_pie(pca_folder, gp2_data_bucket):
         gp2_data_bucket (google.cloud.storage.bucket.Bucket): GCloud bucket object.
     """
     pie1, _, pie3 = st.columns([2, 1, 2])
-    pie_table = blob_as_csv(
-        gp2_data_bucket, f'{pca_folder}/pie_table.csv', sep=',')
+    pie_table_path = f'{pca_folder}/pie_table.csv'
+    pie_generation, pie_table = versioned_csv(gp2_data_bucket, pie_table_path, sep=',')
+    pie_version = (pie_table_path, pie_generation)
 
     with pie1:
         st.markdown('### **Reference Panel Ancestry**')
-        ref_pie = plot_pie(pie_table, proportion_label='Ref Panel Proportion')
-        st.plotly_chart(ref_pie)
+        pooled_chart(('pie', pie_version, 'Ref Panel Proportion'), plot_pie, pie_table, 'Ref Panel Proportion')
 
     with pie3:
         st.markdown(
             f'### Release {st.session_state["release_choice"]} Predicted Ancestry')
-        pred_pie = plot_pie(pie_table, proportion_label='Predicted Proportion')
-        st.plotly_chart(pred_pie)
+        pooled_chart(('pie', pie_version, 'Predicted Proportion'), plot_pie, pie_table, 'Predicted Proportion')
 
     st.dataframe(
         pie_table[['Ancestry Category', 'Ref Panel Counts', 'Predicted Counts']],
@@ -329,9 +533,16 @@ def render_tab_admix(pca_folder, gp2_data_bucket):
         st.write(config.DESCRIPTIONS['admixture'])
 
     ref_admix = blob_as_csv(frontend_bucket, 'cohort_browser/frontend/ref_panel_admixture.txt')
-    admix_plot_blob = frontend_bucket.get_blob('cohort_browser/frontend/refpanel_admix.png')
-    admix_plot = admix_plot_blob.download_as_bytes()
-    st.image(admix_plot)
+    admix_json_blob_name = f'cohort_browser/frontend/refpanel_admix_{config.ADMIXTURE_K}.json'
+    admix_json = download_optional_blob(frontend_bucket, admix_json_blob_name) if has_artifact(frontend_bucket, admix_json_blob_name) else None
+    admix_png_blob_name = f'cohort_browser/frontend/refpanel_admix_{config.ADMIXTURE_K}.png'
+    admix_png = download_optional_blob(frontend_bucket, admix_png_blob_name) if admix_json is None else None
+    if admix_json is not None:
+        st.plotly_chart(pio.from_json(admix_json.decode('utf-8')), use_container_width=True)
+    elif admix_png is not None:
+        st.image(admix_png)
+    else:
+        st.info('The admixture plot is currently unavailable.')
 
     proj_labels = blob_as_csv(
         gp2_data_bucket, f'{pca_folder}/anc_summary.csv', sep=',')
@@ -9,6 +9,8 @@ class AppConfig(BaseSettings):
     GCP_PROJECT: str = "gp2-release-terra"
     FRONTEND_BUCKET_NAME: str = "genotools-server"
 
+    RELEASE_OPTIONS: List[int] = [10]
+
     SEX_MAP: Dict[int, str] = {
         1: "Male",
         2: "Female",
@@ -39,6 +41,100 @@ class AppConfig(BaseSettings):
         "AAC","AFR","AJ","AMR","CAH","CAS","EAS","EUR","FIN","MDE","SAS"
     ]
 
+    SNP_GENOTYPES: List[str] = ["AA", "AB", "BB", "NC"]
+
+    SNP_PHENOTYPES: List[str] = ["Control", "PD"]
+
+    SNP_SORT_OPTIONS: Dict[str, List[str]] = {
+        "Position": [],
+        "Lowest GenTrain Score first": ["GenTrain_Score", "call_rate"],
+        "Lowest call rate first": ["call_rate", "GenTrain_Score"],
+    }
+
+    SAMPLE_PICKER_PAGE_SIZE: int = 50
+
+    ADMIXTURE_K: int = 10
+
+    # storage reads: per-attempt timeout and total deadline in seconds (GCS_DEADLINES overrides the
+    # deadline by blob path suffix), jittered exponential backoff between retries, and hedged
+    # duplicate requests for blobs under GCS_HEDGE_MAX_BYTES after their GCS_HEDGE_PERCENTILE latency
+    GCS_TIMEOUT: float = 10.0
+    GCS_DEADLINE: float = 30.0
+    GCS_DEADLINES: Dict[str, float] = {
+        "manifest.json": 5.0,
+        ".png": 5.0,
+        ".jpg": 5.0,
+        "_metrics.npz": 60.0,
+        "_metrics.csv": 60.0,
+    }
+    GCS_RETRIES: int = 3
+    GCS_BACKOFF_BASE: float = 0.2
+    GCS_BACKOFF_MAX: float = 5.0
+    GCS_HEDGE_MAX_BYTES: int = 2**20
+    GCS_HEDGE_PERCENTILE: float = 95.0
+    GCS_HEDGE_MIN_SAMPLES: int = 20
+    GCS_MAX_WORKERS: int = 32
+
+    # stale-while-revalidate: blob contents and generations are revalidated in the background once
+    # older than SWR_REVALIDATE_AFTER seconds, and only block on storage past SWR_MAX_STALENESS;
+    # revalidations run on their own SWR_REVALIDATE_WORKERS threads, not on the request pool
+    SERVE_STALE: bool = True
+    SWR_REVALIDATE_AFTER: float = 60.0
+    SWR_MAX_STALENESS: float = 6 * 3600.0
+    SWR_MAX_BLOB_BYTES: int = 16 * 2**20
+    SWR_REVALIDATE_WORKERS: int = 4
+
+    # concurrent loads of the same artifact wait on one in-flight load instead of each fetching it
+    SINGLE_FLIGHT: bool = True
+
+    # record timed spans of each page run (logged to the gp2_browser.trace logger); the debug panel
+    # showing them is always on with DEBUG_PANEL, otherwise opened with ?debug=1
+    TRACING: bool = True
+    DEBUG_PANEL: bool = False
+
+    # sampling profiler around page runs: every run with PROFILE_PAGES, or a single run opened with
+    # ?profile=<PROFILE_TOKEN> (disabled while the token is empty)
+    PROFILE_PAGES: bool = False
+    PROFILE_TOKEN: str = ""
+    PROFILE_INTERVAL: float = 0.005
+
+    # byte limit of each session's cache of data, tables and figures (least recently used entries
+    # are evicted past it); ?admin=<ADMIN_TOKEN> shows memory per session (disabled while empty)
+    SESSION_CACHE_MAX_BYTES: int = 256 * 2**20
+    ADMIN_TOKEN: str = ""
+
+    # serialized figures shared by every session, keyed by artifact versions and parameters
+    FIGURE_CACHE: bool = True
+    FIGURE_CACHE_MAX_BYTES: int = 128 * 2**20
+
+    # figures of a page run built concurrently (see figure_pool_utils): FIGURE_WORKERS threads,
+    # or processes when FIGURE_POOL is "process"; 0 builds them one by one on the script thread
+    FIGURE_WORKERS: int = 2
+    FIGURE_POOL: str = "thread"
+
+    # memory-pressure watchdog: samples the process RSS every MEMORY_WATCHDOG_INTERVAL seconds and,
+    # past MEMORY_HIGH_WATERMARK of the container limit (MEMORY_LIMIT_BYTES, or the cgroup limit
+    # when 0), evicts cached blobs, figures and data until back under MEMORY_LOW_WATERMARK
+    MEMORY_WATCHDOG: bool = True
+    MEMORY_LIMIT_BYTES: int = 0
+    MEMORY_HIGH_WATERMARK: float = 0.8
+    MEMORY_LOW_WATERMARK: float = 0.65
+    MEMORY_WATCHDOG_INTERVAL: float = 1.0
+
+    # serve the bucket from a local directory laid out like gs://genotools-server instead of GCS,
+    # optionally injecting faults (see utils/local_bucket_utils.py)
+    LOCAL_BUCKET_DIR: str = ""
+    LOCAL_BUCKET_FAULTS: Dict[str, float] = {}
+
+    # local directory of memory-mapped release data shared by app worker processes; empty disables it.
+    # On disk by default: /tmp is memory-backed on App Engine, where the store would count against
+    # instance memory (the watchdog then deletes entries no process reads)
+    SHARED_STORE_DIR: str = "/var/tmp/gp2_browser_store"
+
+    ASSOC_GENOME_WIDE_P: float = 5e-8
+    ASSOC_DECIMATE_P: float = 1e-3
+    ASSOC_DECIMATE_BINS: List[int] = [1000, 200]
+
     ANCESTRY_COLOR_MAP: Dict[str, str] = {
     'AFR': "#88CCEE",
     'SAS': "#CC6677",
@@ -133,7 +229,10 @@ class AppConfig(BaseSettings):
                 and HWE at a thresthold of 5e-6. LD pruning was performed to find and prune any pairs of variants with r\u00b2 > 0.02 \
                 in a sliding window of 1000 variants with a step size of 10 variants (--indep-pairwise 1000 10 0.02). The SNPs are on build hg38, \
                 and this is reflected in the chromosome\:position labels that are available next to the SNP name in the selection box. \
-                Please note that SNP Metrics are only available for the most recent GP2 release (GP2 Release 8).'
+                Please note that SNP Metrics are only available for the most recent GP2 release (GP2 Release 8).',
+        'sample_lookup':'Enter a GP2ID to see where that sample sits in the release: its cohort, phenotype and pruning status from the \
+                master key, its position in the ancestry PCA relative to the reference panel, and its genotype calls for the SNP metrics \
+                of its predicted ancestry on a chosen chromosome.'
     }
 
     HOME_CONTENT: Dict[str, str] = {
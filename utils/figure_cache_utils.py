@@ -0,0 +1,192 @@
+import json
+import logging
+import threading
+from collections import OrderedDict
+import plotly.io as pio
+import plotly.graph_objects as go
+import streamlit as st
+from utils.memory_utils import register_cache
+from utils.single_flight_utils import single_flight
+from utils.tracing_utils import span
+from utils.config import AppConfig
+
+# internals of st.plotly_chart in streamlit 1.41 (pinned in requirements.txt); without them
+# figures are shown through st.plotly_chart itself
+try:
+    from streamlit.elements.lib.form_utils import current_form_id
+    from streamlit.elements.lib.utils import compute_and_register_element_id
+    from streamlit.proto.PlotlyChart_pb2 import PlotlyChart as PlotlyChartProto
+except ImportError:
+    current_form_id = compute_and_register_element_id = PlotlyChartProto = None
+
+config = AppConfig()
+logger = logging.getLogger('gp2_browser.figures')
+
+# serialized figures shared by every session, by key; least recently used first
+_specs = OrderedDict()
+_specs_lock = threading.Lock()
+_stats = {'bytes': 0, 'hits': 0, 'misses': 0}
+# whether showing figures through st.plotly_chart has been logged
+_fallback_logged = False
+
+
+def _store(key, spec):
+    with _specs_lock:
+        if key in _specs:
+            _stats['bytes'] -= len(_specs.pop(key))
+        _specs[key] = spec
+        _stats['bytes'] += len(spec)
+        while _stats['bytes'] > config.FIGURE_CACHE_MAX_BYTES and len(_specs) > 1:
+            _, evicted = _specs.popitem(last=False)
+            _stats['bytes'] -= len(evicted)
+
+
+def serialize_figure(build, *args):
+    """
+    Plotly JSON of the figure returned by build(*args).
+    """
+    fig = build(*args)
+    with span('serialize_figure', 'figure') as record:
+        spec = pio.to_json(fig, validate=False)
+        if record is not None:
+            record['bytes'] = len(spec)
+    return spec
+
+
+def cached_spec(key):
+    """
+    The cached JSON of a figure, or None (also for a None key).
+    """
+    if key is None or not config.FIGURE_CACHE:
+        return None
+    with _specs_lock:
+        spec = _specs.get(key)
+        if spec is not None:
+            _specs.move_to_end(key)
+            _stats['hits'] += 1
+        else:
+            _stats['misses'] += 1
+    return spec
+
+
+def store_spec(key, spec):
+    if key is not None and config.FIGURE_CACHE:
+        _store(key, spec)
+
+
+def build_spec(key, build, *args):
+    """
+    Build and serialize a figure and cache its JSON under `key`. Concurrent builds of one key
+    share a single build.
+    """
+    if key is None or not config.FIGURE_CACHE:
+        return serialize_figure(build, *args)
+    spec = single_flight(('figure', key), lambda: serialize_figure(build, *args))
+    _store(key, spec)
+    return spec
+
+
+def figure_spec(key, build, *args):
+    """
+    Plotly JSON of a figure, built and serialized once per key and shared by every session.
+
+    The key names the figure and everything it is built from: the versions of the artifacts it
+    reads (see hold_data.artifact_version) and its parameters, e.g. the selected cohort. Any
+    change to those must change the key, as cached specs are never invalidated otherwise.
+
+    Parameters:
+        key (hashable): Figure key, or None to build and serialize without caching.
+        build (callable): Returns the plotly Figure when called with `args`.
+
+    Returns:
+        str: The figure's JSON, as sent to the browser by st.plotly_chart.
+    """
+    spec = cached_spec(key)
+    return spec if spec is not None else build_spec(key, build, *args)
+
+
+def plotly_chart_spec(spec, container=None, use_container_width=False, theme='streamlit'):
+    """
+    Show a figure from its JSON, as st.plotly_chart does for a Figure but without converting
+    and serializing it again. An unchanged spec makes an identical message, which the Streamlit
+    server then sends as a reference to the copy the browser already has.
+
+    This relies on internals of st.plotly_chart. On a Streamlit release without them, the
+    figure is rebuilt from the JSON and shown with st.plotly_chart instead.
+
+    Parameters:
+        spec (str): Figure JSON, e.g. from figure_spec.
+        container (DeltaGenerator, optional): Column, tab or other container; defaults to the
+                                              current one, as st.plotly_chart.
+        use_container_width (bool), theme (str): As for st.plotly_chart.
+    """
+    proto = None
+    if PlotlyChartProto is not None:
+        try:
+            # mirrors st.plotly_chart in streamlit 1.41 without selections; everything that may
+            # be missing is looked up before the element id is registered
+            dg = container if container is not None else st._main
+            enqueue = dg._enqueue
+            proto = PlotlyChartProto()
+            proto.use_container_width = use_container_width
+            proto.theme = theme or ""
+            proto.form_id = current_form_id(dg)
+            proto.spec = spec
+            proto.config = json.dumps({"showLink": False, "linkText": False})
+        except AttributeError:
+            proto = None
+    if proto is None:
+        _log_fallback()
+        target = container if container is not None else st
+        return target.plotly_chart(go.Figure(json.loads(spec)), use_container_width=use_container_width, theme=theme)
+
+    proto.id = compute_and_register_element_id(
+        "plotly_chart",
+        user_key=None,
+        form_id=proto.form_id,
+        plotly_spec=proto.spec,
+        plotly_config=proto.config,
+        selection_mode=("points", "box", "lasso"),
+        is_selection_activated=False,
+        theme=theme,
+        use_container_width=use_container_width,
+    )
+    return enqueue("plotly_chart", proto)
+
+
+
+def _log_fallback():
+    global _fallback_logged
+    if not _fallback_logged:
+        _fallback_logged = True
+        logger.warning('st.plotly_chart internals of streamlit 1.41 are missing in streamlit %s; '
+                       'showing cached figures through st.plotly_chart', st.__version__)
+
+
+def figure_cache_bytes():
+    with _specs_lock:
+        return _stats['bytes']
+
+
+def shrink_figure_cache(n_bytes):
+    """
+    Evict least recently used figures until `n_bytes` are evicted.
+
+    Returns:
+        int: Bytes evicted.
+    """
+    freed = 0
+    with _specs_lock:
+        while _specs and freed < n_bytes:
+            _, evicted = _specs.popitem(last=False)
+            _stats['bytes'] -= len(evicted)
+            freed += len(evicted)
+    return freed
+
+
+def figure_cache_stats():
+    with _specs_lock:
+        return {'figures': len(_specs), **_stats}
+
+
+register_cache('shared figures', figure_cache_bytes, shrink_figure_cache, cost=1)
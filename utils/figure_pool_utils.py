@@ -0,0 +1,140 @@
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import streamlit as st
+from utils.figure_cache_utils import cached_spec, store_spec, build_spec, serialize_figure, plotly_chart_spec
+from utils.tracing_utils import span, run_traced, adopt_spans
+from utils.config import AppConfig
+
+config = AppConfig()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# figures being built, by key, so sessions missing the same figure share one build
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+_local = threading.local()
+
+
+def figure_pool():
+    """
+    The process-wide pool figures are built on, started on first use: FIGURE_WORKERS threads,
+    or processes when FIGURE_POOL is 'process'. None when FIGURE_WORKERS is 0.
+    """
+    global _pool
+    if config.FIGURE_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            if config.FIGURE_POOL == 'process':
+                # spawned, not forked: the server process runs threads of its own
+                _pool = ProcessPoolExecutor(config.FIGURE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+            else:
+                _pool = ThreadPoolExecutor(config.FIGURE_WORKERS, thread_name_prefix='gp2-figure')
+        return _pool
+
+
+def _reset_broken_pool():
+    global _pool
+    with _pool_lock:
+        pool = _pool
+        if not getattr(pool, '_broken', False):
+            return
+        _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _finished(key, future):
+    if not future.cancelled() and future.exception() is None:
+        store_spec(key, future.result()[0])
+    with _inflight_lock:
+        if _inflight.get(key) is future:
+            del _inflight[key]
+
+
+def _submit(pool, key, build, args):
+    with _inflight_lock:
+        future = _inflight.get(key) if key is not None else None
+        if future is not None:
+            return future
+        # spans of the build are recorded on the worker and added to the page's trace when it is shown
+        future = pool.submit(run_traced, serialize_figure, build, *args)
+        if key is not None:
+            _inflight[key] = future
+    if key is not None:
+        # outside the lock: the callback runs at once if the build has already finished
+        future.add_done_callback(lambda done: _finished(key, done))
+    return future
+
+
+def pooled_chart(key, build, *args, load=None, container=None, use_container_width=False):
+    """
+    Show the figure build(*args), as plotly_chart_spec(figure_spec(key, build, *args)) does.
+
+    Within page_figures, a figure that is not cached is instead built and serialized on the
+    figure pool while the page script goes on: an empty placeholder holds its place and
+    page_figures fills it in when the script ends. For process pools, `build` must be a
+    module-level function and `args` picklable.
+
+    Parameters:
+        key (hashable): Figure key as for figure_spec, or None to always build the figure.
+        build (callable): Returns the plotly Figure when called with `args`.
+        load (callable, optional): Returns the args, in place of `args`. Called on the script
+                                   thread, and only when the figure is not cached, so data the
+                                   figure is built from is not loaded for cached figures.
+        container (DeltaGenerator, optional): Container to show the figure in.
+        use_container_width (bool): As for st.plotly_chart.
+    """
+    spec = cached_spec(key)
+    if spec is None:
+        if load is not None:
+            args = load()
+        pending = getattr(_local, 'pending', None)
+        pool = figure_pool() if pending is not None else None
+        if pool is not None:
+            placeholder = (container if container is not None else st._main).empty()
+            future = _submit(pool, key, build, args)
+            pending.append((placeholder, future, key, build, args, use_container_width))
+            return placeholder
+        spec = build_spec(key, build, *args)
+    return plotly_chart_spec(spec, container, use_container_width)
+
+
+def _render_pending(pending):
+    with span('render_figures', 'figure') as record:
+        if record is not None:
+            record['rows'] = len(pending)
+        for placeholder, future, key, build, args, use_container_width in pending:
+            try:
+                spec, spans = future.result()
+                adopt_spans(spans)
+            except BrokenProcessPool:
+                # a worker died (e.g. killed for memory); build this figure here and start a new pool
+                _reset_broken_pool()
+                spec = build_spec(key, build, *args)
+            plotly_chart_spec(spec, placeholder, use_container_width)
+
+
+@contextmanager
+def page_figures():
+    """
+    Build the figures a page run shows with pooled_chart concurrently on the figure pool, and
+    show each in its place, in layout order, when the run ends.
+
+    Runs ended early by a rerun or st.stop() show none of their pending figures, but still wait
+    for them, so that quick reruns do not pile builds up on the pool.
+    """
+    pending = []
+    _local.pending = pending
+    try:
+        yield
+    except BaseException:
+        wait([future for _, future, *_ in pending])
+        raise
+    finally:
+        _local.pending = None
+    _render_pending(pending)
@@ -0,0 +1,228 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+
+'''Figure builders emitting graph_objects traces directly, for figures built on every rerun from
+the app's own tables. They draw what the equivalent plotly.express call draws (same traces,
+order, colors, symbols, hover text and layout) without plotly.express's per-call DataFrame
+regrouping and copying, and without validating properties, since the input is trusted.
+Grouping is done once with category_groups, whose result callers can keep and reuse.'''
+
+# plotly.express defaults when no sequence is given
+SYMBOL_SEQUENCE = ['circle', 'diamond', 'square', 'x', 'cross']
+
+# plotly.express draws scatter plots of more rows with WebGL
+WEBGL_THRESHOLD = 1000
+
+
+def default_colorway():
+    return list(pio.templates[pio.templates.default].layout.colorway)
+
+
+def category_groups(*columns):
+    """
+    Rows of every combination of values of `columns` present in the data, in the order
+    plotly.express draws them: by each column's values in order of first appearance, the first
+    column first. As in plotly.express, rows missing a value are left out, unless every column
+    holds a single value.
+
+    Parameters:
+        columns (array-like): Columns of equal length.
+
+    Returns:
+        tuple: (orders, groups) where orders lists each column's distinct values in order of
+               first appearance, and groups is a list of (values tuple, row positions).
+    """
+    orders = [pd.unique(np.asarray(column)) for column in columns]
+    n_rows = len(columns[0])
+    if all(len(order) == 1 for order in orders):
+        return orders, [(tuple(order[0] for order in orders), np.arange(n_rows))]
+
+    codes, uniques = zip(*(pd.factorize(np.asarray(column)) for column in columns))
+    sizes = [len(values) for values in uniques]
+    valid = np.flatnonzero(np.logical_and.reduce([code >= 0 for code in codes]))
+    combined = np.ravel_multi_index([code[valid] for code in codes], sizes) if sizes else np.zeros(0, dtype=int)
+    order = np.argsort(combined, kind='stable')
+    keys, starts = np.unique(combined[order], return_index=True)
+    rows = np.split(valid[order], starts[1:])
+    values = [tuple(u[i] for u, i in zip(uniques, np.unravel_index(key, sizes))) for key in keys]
+    return orders, list(zip(values, rows))
+
+
+def discrete_map(values, mapping, sequence):
+    """
+    Style of each value as plotly.express assigns it: from `mapping`, otherwise the next entry of
+    `sequence`, counting the mapped values.
+    """
+    val_map = dict(mapping or {})
+    for value in values:
+        if value not in val_map:
+            val_map[value] = sequence[len(val_map) % len(sequence)]
+    return val_map
+
+
+def _grouped_traces(groups, names, marker, trace, hover_labels):
+    """
+    One trace per group, named as plotly.express names them.
+
+    Parameters:
+        groups (list): (values tuple, rows) from category_groups.
+        names (list of str): Label of each grouping column.
+        marker (callable): Returns the marker properties of a group's values.
+        trace (callable): Returns the data properties of a group's rows.
+        hover_labels (list of str): Lines after the grouping values in the hover template.
+    """
+    traces = []
+    for values, rows in groups:
+        name = ', '.join(str(value) for value in values) if names else ''
+        hover = [f'{label}={value}' for label, value in zip(names, values)] + hover_labels
+        traces.append({
+            'name': name,
+            'legendgroup': name,
+            'showlegend': name != '',
+            'marker': marker(values),
+            'hovertemplate': '<br>'.join(hover) + '<extra></extra>',
+            **trace(rows),
+        })
+    return traces
+
+
+def _legend(names):
+    return {'tracegroupgap': 0, **({'title': {'text': ', '.join(names)}} if names else {})}
+
+
+def _axes_layout(x_title, y_title):
+    return {
+        'xaxis': {'anchor': 'y', 'domain': [0.0, 1.0], 'title': {'text': x_title}},
+        'yaxis': {'anchor': 'x', 'domain': [0.0, 1.0], 'title': {'text': y_title}},
+    }
+
+
+def _figure(traces, layout, title):
+    if title:
+        layout['title'] = {'text': title}
+    else:
+        layout['margin'] = {'t': 60}
+    return go.Figure(data=traces, layout=layout, _validate=False)
+
+
+def scatter_3d(df, x, y, z, color, color_map, color_sequence, groups=None, symbol=None, hover_name=None,
+               opacity=None, marker_size=None, title=None, x_range=None, y_range=None, z_range=None, height=None):
+    """
+    px.scatter_3d(df, x, y, z, color=color, symbol=symbol, hover_name=hover_name, opacity=opacity,
+    color_discrete_map=color_map, color_discrete_sequence=color_sequence, title=title,
+    range_x=x_range, range_y=y_range, range_z=z_range, height=height), with the marker size set
+    as by fig.update_traces(marker={'size': marker_size}).
+
+    Parameters:
+        groups (tuple, optional): category_groups(df[color]) (or of df[color], df[symbol]),
+                                  when already computed.
+    """
+    grouping = [color] + ([symbol] if symbol is not None else [])
+    orders, groups = groups if groups is not None else category_groups(*(df[col] for col in grouping))
+    colors = discrete_map(orders[0], color_map, color_sequence)
+    symbols = discrete_map(orders[1], None, SYMBOL_SEQUENCE) if symbol is not None else {}
+
+    def marker(values):
+        style = {'color': colors[values[0]], 'symbol': symbols[values[1]] if symbol is not None else SYMBOL_SEQUENCE[0]}
+        if opacity is not None:
+            style['opacity'] = opacity
+        if marker_size is not None:
+            style['size'] = marker_size
+        return style
+
+    xs, ys, zs = df[x].to_numpy(), df[y].to_numpy(), df[z].to_numpy()
+    hover_names = df[hover_name].to_numpy() if hover_name is not None else None
+
+    def trace(rows):
+        data = {'type': 'scatter3d', 'mode': 'markers', 'scene': 'scene', 'x': xs[rows], 'y': ys[rows], 'z': zs[rows]}
+        if hover_names is not None:
+            data['hovertext'] = hover_names[rows]
+        return data
+
+    traces = _grouped_traces(groups, grouping, marker, trace, [f'{x}=%{{x}}', f'{y}=%{{y}}', f'{z}=%{{z}}'])
+    if hover_names is not None:
+        for data in traces:
+            data['hovertemplate'] = '<b>%{hovertext}</b><br><br>' + data['hovertemplate']
+
+    scene = {
+        'domain': {'x': [0.0, 1.0], 'y': [0.0, 1.0]},
+        'xaxis': {'title': {'text': x}},
+        'yaxis': {'title': {'text': y}},
+        'zaxis': {'title': {'text': z}},
+    }
+    for axis, axis_range in [('xaxis', x_range), ('yaxis', y_range), ('zaxis', z_range)]:
+        if axis_range is not None:
+            scene[axis]['range'] = axis_range
+    layout = {'scene': scene, 'legend': _legend(grouping)}
+    if height is not None:
+        layout['height'] = height
+    return _figure(traces, layout, title)
+
+
+def scatter(df, x, y, color, color_map, symbol, symbol_map, groups=None, labels=None,
+            title=None, width=None, height=None):
+    """
+    px.scatter(df, x, y, color=color, color_discrete_map=color_map, symbol=symbol,
+    symbol_map=symbol_map, labels=labels, title=title, width=width, height=height).
+
+    Parameters:
+        groups (tuple, optional): category_groups(df[color], df[symbol]), when already computed.
+    """
+    labels = labels or {}
+    label = lambda col: labels.get(col, col)
+    orders, groups = groups if groups is not None else category_groups(df[color], df[symbol])
+    colors = discrete_map(orders[0], color_map, default_colorway())
+    symbols = discrete_map(orders[1], symbol_map, SYMBOL_SEQUENCE)
+
+    trace_type = 'scattergl' if len(df) > WEBGL_THRESHOLD else 'scatter'
+    xs, ys = df[x].to_numpy(), df[y].to_numpy()
+
+    def trace(rows):
+        data = {'type': trace_type, 'mode': 'markers', 'xaxis': 'x', 'yaxis': 'y', 'x': xs[rows], 'y': ys[rows]}
+        if trace_type == 'scatter':
+            data['orientation'] = 'v'
+        return data
+
+    traces = _grouped_traces(
+        groups, [label(color), label(symbol)],
+        lambda values: {'color': colors[values[0]], 'symbol': symbols[values[1]]},
+        trace, [f'{label(x)}=%{{x}}', f'{label(y)}=%{{y}}']
+    )
+    layout = {**_axes_layout(label(x), label(y)), 'legend': _legend([label(color), label(symbol)])}
+    for key, value in [('height', height), ('width', width)]:
+        if value is not None:
+            layout[key] = value
+    return _figure(traces, layout, title)
+
+
+def histogram(df, x, nbins, color=None, color_map=None, color_sequence=None, groups=None):
+    """
+    px.histogram(df, x, color=color, nbins=nbins, color_discrete_map=color_map,
+    color_discrete_sequence=color_sequence).
+
+    Parameters:
+        groups (tuple, optional): category_groups(df[color]), when already computed.
+    """
+    color_sequence = color_sequence or default_colorway()
+    xs = df[x].to_numpy()
+
+    def trace(rows):
+        return {'type': 'histogram', 'x': xs[rows], 'nbinsx': nbins, 'orientation': 'v', 'bingroup': 'x',
+                'alignmentgroup': 'True', 'xaxis': 'x', 'yaxis': 'y'}
+
+    if color is None:
+        grouping, colors = [], {'': color_sequence[0]}
+        groups = [(('',), np.arange(len(df)))]
+    else:
+        grouping = [color]
+        orders, groups = groups if groups is not None else category_groups(df[color])
+        colors = discrete_map(orders[0], color_map, color_sequence)
+
+    traces = _grouped_traces(groups, grouping, lambda values: {'color': colors[values[0]], 'pattern': {'shape': ''}},
+                             trace, [f'{x}=%{{x}}', 'count=%{y}'])
+    for data in traces:
+        data['offsetgroup'] = data['name']
+    layout = {**_axes_layout(x, 'count'), 'legend': _legend(grouping), 'barmode': 'relative'}
+    return _figure(traces, layout, None)
@@ -0,0 +1,391 @@
+import time
+import random
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from google.api_core import exceptions as gcs_exceptions
+from utils.config import AppConfig
+from utils.single_flight_utils import single_flight
+from utils.memory_utils import register_cache
+from utils.tracing_utils import traced
+
+config = AppConfig()
+logger = logging.getLogger('gp2_browser.storage')
+
+TRANSIENT_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    gcs_exceptions.TooManyRequests,
+    gcs_exceptions.InternalServerError,
+    gcs_exceptions.BadGateway,
+    gcs_exceptions.ServiceUnavailable,
+    gcs_exceptions.GatewayTimeout,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+MISSING_ERRORS = (FileNotFoundError, gcs_exceptions.NotFound)
+
+# upper bounds (seconds) of the latency histogram buckets, 1 ms to 2 min
+LATENCY_BUCKETS = np.geomspace(0.001, 120, 50)
+
+# requests only; revalidations wait on requests, so they run on their own pool and can never
+# hold every request worker
+_pool = ThreadPoolExecutor(max_workers=config.GCS_MAX_WORKERS, thread_name_prefix='gcs')
+_revalidate_pool = ThreadPoolExecutor(max_workers=config.SWR_REVALIDATE_WORKERS, thread_name_prefix='gcs-revalidate')
+_histograms = {}
+_histograms_lock = threading.Lock()
+_swr_cache = {}
+_swr_refreshing = set()
+_swr_lock = threading.Lock()
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket histogram of request latencies for one blob.
+    """
+    def __init__(self):
+        self.counts = np.zeros(len(LATENCY_BUCKETS) + 1, dtype=np.int64)
+        self.max = 0.0
+        self.bytes = 0
+        self.errors = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, n_bytes=None):
+        with self.lock:
+            self.counts[np.searchsorted(LATENCY_BUCKETS, seconds)] += 1
+            self.max = max(self.max, seconds)
+            if n_bytes is not None:
+                self.bytes = n_bytes
+
+    def count_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def count_hedge(self):
+        with self.lock:
+            self.hedges += 1
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket holding the q-th percentile latency, or None without samples.
+        """
+        if self.count == 0:
+            return None
+        bucket = np.searchsorted(np.cumsum(self.counts), q / 100 * self.count)
+        return float(LATENCY_BUCKETS[bucket]) if bucket < len(LATENCY_BUCKETS) else self.max
+
+
+def _histogram(key):
+    with _histograms_lock:
+        if key not in _histograms:
+            _histograms[key] = LatencyHistogram()
+        return _histograms[key]
+
+
+def latency_summary():
+    """
+    Per-blob latency percentiles, error and hedge counts of every request made by this process.
+
+    Returns:
+        pd.DataFrame: One row per blob, slowest p99 first.
+    """
+    with _histograms_lock:
+        items = list(_histograms.items())
+    summary = pd.DataFrame([
+        {
+            'blob': key,
+            'requests': hist.count,
+            'p50_ms': None if hist.count == 0 else 1000 * hist.percentile(50),
+            'p95_ms': None if hist.count == 0 else 1000 * hist.percentile(95),
+            'p99_ms': None if hist.count == 0 else 1000 * hist.percentile(99),
+            'max_ms': 1000 * hist.max,
+            'bytes': hist.bytes,
+            'errors': hist.errors,
+            'hedges': hist.hedges,
+        }
+        for key, hist in items
+    ], columns=['blob', 'requests', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'bytes', 'errors', 'hedges'])
+    return summary.sort_values('p99_ms', ascending=False, ignore_index=True)
+
+
+def artifact_deadline(path):
+    """
+    Total time budget for fetching `path`: the GCS_DEADLINES entry of its longest matching
+    suffix, otherwise GCS_DEADLINE.
+    """
+    matches = [suffix for suffix in config.GCS_DEADLINES if path.endswith(suffix)]
+    return config.GCS_DEADLINES[max(matches, key=len)] if matches else config.GCS_DEADLINE
+
+
+def hedge_delay(key, n_bytes):
+    """
+    How long to wait before sending a duplicate request, or None to not hedge. Only blobs known
+    to be small are hedged, after the GCS_HEDGE_PERCENTILE latency of earlier requests for them.
+    """
+    hist = _histogram(key)
+    if n_bytes is None:
+        n_bytes = hist.bytes if hist.count else None
+    if n_bytes is None or n_bytes > config.GCS_HEDGE_MAX_BYTES or hist.count < config.GCS_HEDGE_MIN_SAMPLES:
+        return None
+    return hist.percentile(config.GCS_HEDGE_PERCENTILE)
+
+
+def _timed(func, key, ends_at):
+    start = time.perf_counter()
+    # time spent queued for a worker counts against the attempt: a request whose attempt already
+    # ended (timed out, or won by another request) is not sent at all
+    if start >= ends_at:
+        raise TimeoutError(f'{key} attempt ended before its request started')
+    result = func(ends_at - start)
+    n_bytes = len(result) if isinstance(result, bytes) else None
+    _histogram(key).record(time.perf_counter() - start, n_bytes)
+    return result
+
+
+def _attempt(func, key, timeout, delay):
+    """
+    One attempt, with a duplicate request sent if the first is still running after `delay` seconds.
+    Returns the first successful result; raises TimeoutError after `timeout` seconds.
+
+    Requests left behind (the losing request of a hedge, or every request of a timed-out attempt)
+    are cancelled if still queued; running ones were given only the attempt's remaining time as
+    their timeout, so they end by the attempt's end.
+    """
+    start = time.perf_counter()
+    ends_at = start + timeout
+    pending = {_pool.submit(_timed, func, key, ends_at)}
+    hedged = delay is None
+    error = None
+    try:
+        while pending:
+            elapsed = time.perf_counter() - start
+            wait_for = timeout - elapsed if hedged else min(delay, timeout) - elapsed
+            done, pending = wait(pending, timeout=max(wait_for, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            if time.perf_counter() - start >= timeout:
+                raise TimeoutError(f'{key} timed out after {timeout:.1f}s')
+            if not hedged and pending:
+                pending.add(_pool.submit(_timed, func, key, ends_at))
+                _histogram(key).count_hedge()
+                hedged = True
+        raise error
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def call_with_retries(func, key, deadline=None, n_bytes=None):
+    """
+    Run a storage request with a per-attempt timeout, retrying transient failures with
+    jittered exponential backoff until the artifact's deadline, and hedging small requests.
+
+    Parameters:
+        func (callable): Makes the request; called with the attempt's timeout in seconds.
+        key (str): Name the request's latency is recorded under, e.g. its blob path.
+        deadline (float, optional): Total time budget in seconds. Defaults to artifact_deadline(key).
+        n_bytes (int, optional): Expected response size, if known, for the hedging decision.
+
+    Returns:
+        The result of `func`.
+    """
+    if deadline is None:
+        deadline = artifact_deadline(key)
+    start = time.perf_counter()
+
+    for attempt in range(config.GCS_RETRIES + 1):
+        remaining = deadline - (time.perf_counter() - start)
+        try:
+            return _attempt(func, key, min(config.GCS_TIMEOUT, remaining), hedge_delay(key, n_bytes))
+        except TRANSIENT_ERRORS:
+            _histogram(key).count_error()
+            # full jitter: sleep uniformly up to the exponential backoff cap
+            backoff = random.uniform(0, min(config.GCS_BACKOFF_MAX, config.GCS_BACKOFF_BASE * 2 ** attempt))
+            if attempt == config.GCS_RETRIES or time.perf_counter() - start + backoff >= deadline:
+                raise
+            time.sleep(backoff)
+
+
+@traced('storage', label_arg='path')
+def get_blob_info(bucket, path, deadline=None):
+    """
+    Look up a blob's metadata (generation, size) with retries. Returns None if it does not exist.
+    """
+    return single_flight(
+        (bucket.name, path, 'metadata'),
+        lambda: call_with_retries(lambda timeout: bucket.get_blob(path, timeout=timeout, retry=None),
+                                  f'{path} (metadata)', deadline=deadline)
+    )
+
+
+@traced('storage', label_arg='path')
+def download_blob(bucket, path, start=None, end=None, deadline=None, generation=None):
+    """
+    Download a blob, or the inclusive byte range [start, end] of it, with retries and hedging.
+    With `generation`, that generation of the blob is downloaded.
+
+    Raises:
+        FileNotFoundError: If the blob (or the given generation of it) does not exist.
+        TimeoutError: If the download did not finish within the deadline.
+    """
+    n_bytes = end - start + 1 if start is not None and end is not None else None
+    try:
+        return single_flight((bucket.name, path, start, end, generation), lambda: call_with_retries(
+            lambda timeout: bucket.blob(path, generation=generation).download_as_bytes(start=start, end=end, timeout=timeout, retry=None),
+            path, deadline=deadline, n_bytes=n_bytes
+        ))
+    except MISSING_ERRORS:
+        raise FileNotFoundError(f'gs://{bucket.name}/{path} does not exist')
+
+
+def serve_stale(key, load):
+    """
+    Stale-while-revalidate cache shared by every session of the process.
+
+    A value validated less than SWR_REVALIDATE_AFTER seconds ago is returned as is. An older one
+    is still returned immediately while `load` refreshes it on a background thread, until it is
+    SWR_MAX_STALENESS seconds old; past that, or when SERVE_STALE is off, `load` runs inline.
+
+    Parameters:
+        key (hashable): Cache key.
+        load (callable): Called with the previously cached value (or None) and returns the
+                         current one; it may return the previous value when nothing changed.
+
+    Returns:
+        tuple: (value, age), where age is the seconds since a stale value was last validated,
+               or None when the value is fresh.
+    """
+    if not config.SERVE_STALE:
+        return load(None), None
+
+    with _swr_lock:
+        entry = _swr_cache.get(key)
+    now = time.monotonic()
+    if entry is not None and now - entry[1] <= config.SWR_REVALIDATE_AFTER:
+        return entry[0], None
+    if entry is None or now - entry[1] > config.SWR_MAX_STALENESS:
+        def load_and_cache():
+            value = load(entry[0] if entry is not None else None)
+            with _swr_lock:
+                _swr_cache[key] = (value, time.monotonic())
+            return value
+        return single_flight(('serve_stale', key), load_and_cache), None
+
+    with _swr_lock:
+        refresh = key not in _swr_refreshing
+        _swr_refreshing.add(key)
+    if refresh:
+        _revalidate_pool.submit(_revalidate, key, load, entry[0])
+    return entry[0], now - entry[1]
+
+
+def _revalidate(key, load, previous):
+    try:
+        value = load(previous)
+        with _swr_lock:
+            _swr_cache[key] = (value, time.monotonic())
+    except Exception:
+        # storage is still failing: keep serving the cached value until it exceeds SWR_MAX_STALENESS
+        logger.warning('revalidating %s failed; serving the cached value', key, exc_info=True)
+    finally:
+        with _swr_lock:
+            _swr_refreshing.discard(key)
+
+
+def cached_generation(bucket, path):
+    """
+    Generation of a blob (None if it does not exist), served stale-while-revalidate.
+
+    Returns:
+        tuple: (generation, age) as returned by serve_stale.
+    """
+    def load(previous):
+        blob = get_blob_info(bucket, path)
+        return blob.generation if blob is not None else None
+    return serve_stale((bucket.name, 'generation', path), load)
+
+
+def cached_download(bucket, path):
+    """
+    Contents of a whole blob (None if it does not exist), served stale-while-revalidate.
+    Revalidation only downloads the blob again when its generation changed. Blobs larger than
+    SWR_MAX_BLOB_BYTES are not kept.
+
+    Returns:
+        tuple: ((generation, bytes) or None, age) as returned by serve_stale. The bytes are
+               always those of the generation they are returned with.
+    """
+    def load(previous):
+        for attempt in range(2):
+            blob = get_blob_info(bucket, path)
+            if blob is None:
+                return None
+            if previous is not None and previous[0] == blob.generation:
+                return previous
+            try:
+                return blob.generation, download_blob(bucket, path, generation=blob.generation)
+            except FileNotFoundError:
+                # replaced between the lookup and the download: look the new generation up
+                if attempt == 1:
+                    raise
+
+    key = (bucket.name, 'blob', path)
+    value, age = serve_stale(key, load)
+    if value is not None and len(value[1]) > config.SWR_MAX_BLOB_BYTES:
+        with _swr_lock:
+            _swr_cache.pop(key, None)
+    return value, age
+
+
+def download_optional_blob(bucket, path):
+    """
+    Download a blob the page can do without (images, optional figures): returns None instead of
+    raising when it is missing, failing or slower than its deadline.
+    """
+    try:
+        value, _ = cached_download(bucket, path)
+    except (FileNotFoundError,) + TRANSIENT_ERRORS:
+        return None
+    return value[1] if value is not None else None
+
+
+def _blob_bytes(entry):
+    value = entry[0]
+    return len(value[1]) if isinstance(value, tuple) and isinstance(value[1], bytes) else 0
+
+
+def blob_cache_bytes():
+    with _swr_lock:
+        return sum(_blob_bytes(entry) for entry in _swr_cache.values())
+
+
+def shrink_blob_cache(n_bytes):
+    """
+    Evict cached blob contents, least recently validated first, until `n_bytes` are evicted.
+    Generations are kept; an evicted blob is downloaded again on its next read.
+
+    Returns:
+        int: Bytes evicted.
+    """
+    freed = 0
+    with _swr_lock:
+        blobs = sorted((entry[1], key) for key, entry in _swr_cache.items() if _blob_bytes(entry))
+        for _, key in blobs:
+            if freed >= n_bytes:
+                break
+            freed += _blob_bytes(_swr_cache.pop(key))
+    return freed
+
+
+register_cache('blobs', blob_cache_bytes, shrink_blob_cache, cost=2)
@@ -1,40 +1,327 @@
+import json
+import threading
+import numpy as np
 import pandas as pd
 import streamlit as st
 from io import StringIO
 from google.cloud import storage
 from utils.config import AppConfig
+from utils.shared_store_utils import get_shared_store
+from utils.gcs_utils import cached_generation, cached_download, download_optional_blob
+from utils.local_bucket_utils import LocalBucket
+from utils.single_flight_utils import single_flight
+from utils.session_cache_utils import session_cache
+from utils.tracing_utils import traced, span
 
 config = AppConfig()
 
+# the stale data notice of the page run on this script thread (see stale_data_notice)
+_run = threading.local()
+
+def read_blob(bucket, path):
+    """
+    Generation and contents of a blob, served stale-while-revalidate (see gcs_utils.serve_stale).
+
+    Returns:
+        tuple: (generation, bytes, age), where age is as returned by serve_stale; the caller
+               passes it to note_stale on the session's script thread.
+
+    Raises:
+        FileNotFoundError: If the blob does not exist.
+    """
+    value, age = cached_download(bucket, path)
+    if value is None:
+        raise FileNotFoundError(f"gs://{bucket.name}/{path} does not exist")
+    return value[0], value[1], age
+
+def note_stale(path, age):
+    """
+    Record that `path` was served from a cache last validated `age` seconds ago (nothing if
+    age is None) and update the stale data notice in the sidebar. Only called on the session's
+    script thread, never from loads shared with other sessions.
+    """
+    if age is None:
+        return
+    stale_artifacts = st.session_state.setdefault("stale_artifacts", {})
+    stale_artifacts[path] = max(age, stale_artifacts.get(path, 0))
+    notice = getattr(_run, "notice", None)
+    if notice is not None:
+        oldest = max(stale_artifacts.values())
+        oldest = f"{oldest:.0f} s" if oldest < 120 else f"{oldest / 60:.0f} min"
+        notice.warning(
+            f"Storage is responding slowly, so some data shown was last checked {oldest} ago "
+            "and may be out of date. It is being refreshed in the background.",
+            icon="⏳"
+        )
+
+def note_version(bucket, path, generation):
+    """
+    Record the generation of an artifact as the session last loaded it, for artifact_version.
+    """
+    st.session_state.setdefault("loaded_versions", {})[(bucket.name, path)] = generation
+
+def read_csv(bucket, path, sep=r"\s+", header="infer"):
+    """
+    Read a CSV blob without touching the page, so it can run inside loads shared by sessions.
+    Sessions reading the same table at once share one parse, each getting its own copy.
+
+    Returns:
+        tuple: (generation, pd.DataFrame, age) with the generation of the bytes parsed and age
+               as for read_blob.
+    """
+    def parse():
+        generation, blob_bytes, age = read_blob(bucket, path)
+        blob_str = str(blob_bytes, "utf-8")
+        blob_io = StringIO(blob_str)
+        with span("parse_csv", "parse") as record:
+            df = pd.read_csv(blob_io, sep=sep, header=header)
+            if record is not None:
+                record["bytes"], record["rows"] = len(blob_bytes), len(df)
+        return generation, df, age
+    return single_flight((bucket.name, path, sep, header), parse,
+                         share=lambda result: (result[0], result[1].copy(), result[2]))
+
+@traced('load', name='blob_as_csv', label_arg='path')
+def versioned_csv(bucket, path, sep=r"\s+", header="infer"):
+    """
+    Read a CSV blob.
+
+    Returns:
+        tuple: (generation, pd.DataFrame), the generation being that of the bytes parsed.
+    """
+    generation, df, age = read_csv(bucket, path, sep=sep, header=header)
+    note_stale(path, age)
+    note_version(bucket, path, generation)
+    return generation, df
+
 def blob_as_csv(bucket, path, sep=r"\s+", header="infer"):
-    blob = bucket.get_blob(path)
-    blob_bytes = blob.download_as_bytes()
-    blob_str = str(blob_bytes, "utf-8")
-    blob_io = StringIO(blob_str)
-    df = pd.read_csv(blob_io, sep=sep, header=header)
-    return df
+    return versioned_csv(bucket, path, sep=sep, header=header)[1]
 
+def artifact_version(bucket, path):
+    """
+    Version of an artifact: the generation the session last loaded it at (see note_version),
+    otherwise its content hash in the selected release's manifest when one has been loaded,
+    otherwise the blob's generation. Keys of data derived from an artifact are taken after
+    loading it, so they name the version actually loaded.
+    """
+    loaded = st.session_state.get("loaded_versions", {}).get((bucket.name, path))
+    if loaded is not None:
+        return loaded
+    release_choice = st.session_state.get("release_choice", config.RELEASE_OPTIONS[0])
+    cached = st.session_state.get(f"manifest_release{release_choice}")
+    artifact = cached["manifest"]["artifacts"].get(path) if cached is not None else None
+    if artifact is not None:
+        return artifact["sha256"]
+    generation, age = cached_generation(bucket, path)
+    note_stale(path, age)
+    if generation is None:
+        raise FileNotFoundError(f"gs://{bucket.name}/{path} does not exist")
+    return generation
+
+def load_shared(bucket, path, namespace, read):
+    """
+    Data read from an artifact, through the local shared store when it is enabled. Entries are
+    keyed by the generation of the bytes actually read, so stored data always matches its
+    version, even while the blob's generation and contents are revalidated separately.
+
+    Parameters:
+        bucket (google.cloud.storage.bucket.Bucket): GCloud bucket object.
+        path (str): Blob path of the artifact.
+        namespace (str): Store namespace of the data, e.g. the bucket and blob path.
+        read (callable): Reads the blob without touching the page; returns (generation, data,
+                         age) with data a pd.DataFrame or dict of np.ndarray and age as for read_blob.
+
+    Returns:
+        tuple: (generation, data)
+    """
+    store = get_shared_store()
+    if store is None:
+        generation, data, age = read()
+    else:
+        generation, age = cached_generation(bucket, path)
+        data = store.open(namespace, generation) if generation is not None else None
+        if data is None:
+            generation, built, age = read()
+            data = store.get_or_create(namespace, generation, lambda: built)
+    note_stale(path, age)
+    note_version(bucket, path, generation)
+    return generation, data
+
+@traced('load', label_arg='path')
+def load_shared_table(bucket, path, sep=r"\s+"):
+    """
+    Read a CSV blob through the local shared store, so every app worker process on the instance
+    maps one copy of it instead of parsing its own. The stored copy is keyed by the generation
+    it was read at and replaced when that changes.
+
+    Parameters:
+        bucket (google.cloud.storage.bucket.Bucket): GCloud bucket object.
+        path (str): Blob path of the CSV.
+        sep (str): Field separator.
+
+    Returns:
+        pd.DataFrame: The table, with numeric columns backed by memory-mapped files.
+    """
+    _, table = load_shared(bucket, path, f"{bucket.name}/{path}", lambda: read_csv(bucket, path, sep=sep))
+    return table
+
+@traced('load', label_arg='path')
 def blob_as_html(bucket, path):
-    blob = bucket.get_blob(path)
-    blob_bytes = blob.download_as_bytes()
+    _, blob_bytes, age = read_blob(bucket, path)
+    note_stale(path, age)
     blob_str = str(blob_bytes, "utf-8")  # Convert bytes to string
     return blob_str 
 
+@traced('load')
+def sync_release_manifest(bucket, release_choice=None):
+    """
+    Load the release's manifest.json written by build_release.py, re-reading it only when the
+    blob's generation changes. When a previously seen manifest's release_hash changes, the
+    session's cached data for that release is dropped so it is reloaded.
+
+    Returns:
+        dict or None: The manifest, or None if the release has no manifest.
+    """
+    if release_choice is None:
+        release_choice = st.session_state.get("release_choice", config.RELEASE_OPTIONS[0])
+
+    manifest_path = f"cohort_browser/nba/release{release_choice}/manifest.json"
+    manifest_blob, age = cached_download(bucket, manifest_path)
+    note_stale(manifest_path, age)
+    if manifest_blob is None:
+        return None
+
+    generation, manifest_bytes = manifest_blob
+    cached = st.session_state.get(f"manifest_release{release_choice}")
+    if cached is not None and cached["generation"] == generation:
+        return cached["manifest"]
+
+    manifest = json.loads(manifest_bytes)
+    if cached is not None and cached["manifest"].get("release_hash") != manifest.get("release_hash"):
+        clear_release_data(release_choice)
+    st.session_state[f"manifest_release{release_choice}"] = {"generation": generation, "manifest": manifest}
+    return manifest
+
+def clear_release_data(release_choice):
+    """
+    Drop data, tables and figures cached in the session for a release.
+    """
+    prefixes = (
+        f"release{release_choice}_",
+        f"cohort_browser/nba/release{release_choice}_",
+        "all_ancestries_",
+        "full_maf",
+    ) + tuple(f"{ancestry}_" for ancestry in config.ANCESTRY_OPTIONS)
+    cache = session_cache()
+    for key in list(cache):
+        if key.startswith(prefixes):
+            del cache[key]
+
+def has_artifact(bucket, path):
+    """
+    Whether an artifact exists. Paths under the selected release's directory are answered from its
+    manifest when one has been loaded (no storage request); other paths, and releases without a
+    manifest, are looked up in the bucket.
+    """
+    release_choice = st.session_state.get("release_choice", config.RELEASE_OPTIONS[0])
+    cached = st.session_state.get(f"manifest_release{release_choice}")
+    if cached is not None and path.startswith(f"cohort_browser/nba/release{release_choice}/"):
+        return path in cached["manifest"]["artifacts"]
+    generation, age = cached_generation(bucket, path)
+    note_stale(path, age)
+    return generation is not None
+
 def get_gcloud_bucket(bucket_name):
+    if config.LOCAL_BUCKET_DIR:
+        return LocalBucket(config.LOCAL_BUCKET_DIR, bucket_name, faults=config.LOCAL_BUCKET_FAULTS)
     storage_client = storage.Client(project=config.GCP_PROJECT)
     bucket = storage_client.bucket(bucket_name, user_project=config.GCP_PROJECT)
     return bucket
 
+@traced('load')
+def get_sample_dictionary(bucket, release_choice=None, master_key=None):
+    """
+    Per-release dictionary mapping every sample ID to a dense int32 id.
+
+    Read from release{N}/sample_dictionary.csv when it exists, otherwise built from the
+    IID column of the release's master key (in master key order).
+
+    Parameters:
+        bucket (google.cloud.storage.bucket.Bucket): GCloud bucket object.
+        release_choice (int, optional): Release number. Defaults to the selected release.
+        master_key (pd.DataFrame, optional): Already loaded master key to build from.
+
+    Returns:
+        pd.Index: Sample IDs; the position of an ID is its integer id.
+    """
+    if release_choice is None:
+        release_choice = st.session_state.get("release_choice", config.RELEASE_OPTIONS[0])
+
+    cache = session_cache()
+    if f"release{release_choice}_sample_dictionary" not in cache:
+        dictionary_path = f"cohort_browser/nba/release{release_choice}/sample_dictionary.csv"
+        if has_artifact(bucket, dictionary_path):
+            sample_ids = blob_as_csv(bucket, dictionary_path, sep=",")["IID"]
+        else:
+            if master_key is None:
+                master_key = blob_as_csv(bucket, master_key_path(release_choice), sep=",")
+            sample_ids = master_key["IID"]
+        sample_dict = pd.Index(sample_ids.drop_duplicates().astype(str))
+        cache[f"release{release_choice}_sample_dictionary"] = sample_dict
+    else:
+        sample_dict = cache[f"release{release_choice}_sample_dictionary"]
+
+    return sample_dict
+
+def intern_sample_ids(sample_ids, sample_dict):
+    """
+    Map sample ID strings to their int32 ids in `sample_dict` (-1 for unknown IDs).
+    """
+    return sample_dict.get_indexer(np.asarray(sample_ids, dtype=str)).astype(np.int32)
+
+def isin_samples(sample_idx, subset_idx, n_samples):
+    """
+    Integer equivalent of Series.isin for interned sample ids, using a dense membership mask.
+
+    Parameters:
+        sample_idx (array-like of int): Interned ids to test.
+        subset_idx (array-like of int): Interned ids to test membership against.
+        n_samples (int): Size of the sample dictionary.
+
+    Returns:
+        np.ndarray: Boolean mask aligned with `sample_idx`. Unknown ids (-1) are never members.
+    """
+    subset_idx = np.asarray(subset_idx)
+    mask = np.zeros(n_samples + 1, dtype=bool)  # last slot stays False for -1
+    mask[subset_idx[subset_idx >= 0]] = True
+    return mask[np.asarray(sample_idx)]
+
+def master_key_path(release_choice):
+    return f"cohort_browser/nba/release{release_choice}/nba_app_key.csv"
+
+@traced('load')
 def get_master_key(bucket):
     release_choice = st.session_state["release_choice"]
-    master_key_path = f"cohort_browser/nba/release{release_choice}/nba_app_key.csv"
-    master_key = blob_as_csv(bucket, master_key_path, sep=",")
+    master_key = load_shared_table(bucket, master_key_path(release_choice), sep=",")
+    sample_dict = get_sample_dictionary(bucket, release_choice, master_key=master_key)
+    master_key["sample_idx"] = intern_sample_ids(master_key["IID"], sample_dict)
     latest_rel = max(master_key.release)
     if release_choice == latest_rel:
         return master_key
     else:
         return master_key[master_key.release == release_choice]
 
+def master_key_version(bucket):
+    """
+    Version of the master key as filtered by the page: the release's key artifact version and
+    the selected cohort and ancestry. Used in the keys of figures built from it.
+    """
+    return (
+        artifact_version(bucket, master_key_path(st.session_state["release_choice"])),
+        st.session_state["cohort_choice"],
+        st.session_state.get("meta_ancestry_choice")
+    )
+
 def filter_by_cohort(master_key):
     master_key = cohort_select(master_key)
     master_key = master_key[master_key["prune_reason"].isnull()]
@@ -49,46 +336,60 @@ def filter_by_ancestry(master_key):
     return master_key
 
 def update_sex_labels(master_key):
-    master_key["sex"].replace(config.SEX_MAP, inplace=True)
+    # on a shallow copy: master_key is usually a filtered slice of the cached master key
+    master_key = master_key.copy(deep=False)
+    master_key["sex"] = master_key["sex"].replace(config.SEX_MAP)
     return master_key
 
 def config_page(title):
-    if "gp2_bg" in st.session_state:
+    cache = session_cache()
+    if "gp2_bg" in cache:
         st.set_page_config(
             page_title=title,
-            page_icon=st.session_state.gp2_bg,
+            page_icon=cache["gp2_bg"],
             layout="wide",
         )
+        stale_data_notice()
     else:
         frontend_bucket = get_gcloud_bucket(config.FRONTEND_BUCKET_NAME)
-        gp2_bg_blob = frontend_bucket.get_blob("cohort_browser/frontend/gp2_2.jpg")
-        gp2_bg = gp2_bg_blob.download_as_bytes()
-        st.session_state["gp2_bg"] = gp2_bg
+        gp2_bg = download_optional_blob(frontend_bucket, "cohort_browser/frontend/gp2_2.jpg")
+        if gp2_bg is not None:
+            cache["gp2_bg"] = gp2_bg
         st.set_page_config(
             page_title=title,
             page_icon=gp2_bg,
             layout="wide"
         )
+        stale_data_notice()
+
+def stale_data_notice():
+    """
+    Reserve the sidebar slot where note_stale warns that stale data is being served on this run.
+    The slot is kept for the run's script thread only, never in session state.
+    """
+    st.session_state["stale_artifacts"] = {}
+    _run.notice = st.sidebar.empty()
 
 def place_logos():
     sidebar1, sidebar2 = st.sidebar.columns(2)
-    if ("card_removebg" in st.session_state) and ("redlat" in st.session_state):
-        sidebar1.image(st.session_state.card_removebg, use_container_width=True)
-        sidebar2.image(st.session_state.gp2_removebg, use_container_width=True)
-        st.sidebar.image(st.session_state.redlat, use_container_width=True)
+    cache = session_cache()
+    if ("card_removebg" in cache) and ("gp2_removebg" in cache):
+        sidebar1.image(cache["card_removebg"], use_container_width=True)
+        sidebar2.image(cache["gp2_removebg"], use_container_width=True)
+        # st.sidebar.image(st.session_state.redlat, use_container_width=True)
     else:
+        # logos are optional: a missing or slow image is skipped and retried on the next run
         frontend_bucket = get_gcloud_bucket(config.FRONTEND_BUCKET_NAME)
-        card_removebg_blob = frontend_bucket.get_blob("cohort_browser/frontend/card-removebg.png")
-        card_removebg = card_removebg_blob.download_as_bytes()
-        gp2_removebg_blob = frontend_bucket.get_blob("cohort_browser/frontend/gp2_2-removebg.png")
-        gp2_removebg = gp2_removebg_blob.download_as_bytes()
-        # redlat_blob = frontend_bucket.get_blob("Redlat.png")
-        # redlat = redlat_blob.download_as_bytes()
-        st.session_state["card_removebg"] = card_removebg
-        st.session_state["gp2_removebg"] = gp2_removebg
+        card_removebg = download_optional_blob(frontend_bucket, "cohort_browser/frontend/card-removebg.png")
+        gp2_removebg = download_optional_blob(frontend_bucket, "cohort_browser/frontend/gp2_2-removebg.png")
+        # redlat = download_optional_blob(frontend_bucket, "Redlat.png")
+        if card_removebg is not None:
+            cache["card_removebg"] = card_removebg
+            sidebar1.image(card_removebg, use_container_width=True)
+        if gp2_removebg is not None:
+            cache["gp2_removebg"] = gp2_removebg
+            sidebar2.image(gp2_removebg, use_container_width=True)
         # st.session_state["redlat"] = redlat
-        sidebar1.image(card_removebg, use_container_width=True)
-        sidebar2.image(gp2_removebg, use_container_width=True)
         # st.sidebar.image(redlat, use_container_width=True)
 
 def release_callback():
@@ -97,7 +398,7 @@ def release_callback():
 
 def release_select():
     st.sidebar.markdown("### **Choose a release!**")
-    release_options = [10] # can replace with master key reference
+    release_options = config.RELEASE_OPTIONS # can replace with master key reference
 
     if "release_choice" not in st.session_state:
         st.session_state["release_choice"] = release_options[0]
@@ -0,0 +1,78 @@
+import os
+import time
+import base64
+import hashlib
+import random
+from google.api_core import exceptions as gcs_exceptions
+
+
+class LocalBlob:
+    """
+    Blob of a LocalBucket, with the subset of the google.cloud.storage.Blob interface the app uses.
+    """
+    def __init__(self, bucket, name, generation=None):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.root, name)
+        # a file's mtime stands in for the generation; a requested generation pins downloads to it
+        self.pinned = generation
+        stat = os.stat(self.path) if os.path.exists(self.path) else None
+        self.generation = stat.st_mtime_ns if stat is not None else None
+        self.size = stat.st_size if stat is not None else None
+
+    @property
+    def md5_hash(self):
+        if self.generation is None:
+            return None
+        with open(self.path, 'rb') as f:
+            return base64.b64encode(hashlib.file_digest(f, 'md5').digest()).decode('ascii')
+
+    def download_as_bytes(self, start=None, end=None, timeout=None, retry=None, **kwargs):
+        self.bucket.inject_faults(timeout)
+        if not os.path.exists(self.path):
+            raise gcs_exceptions.NotFound(f'No such object: {self.bucket.name}/{self.name}')
+        with open(self.path, 'rb') as f:
+            if self.pinned is not None and os.fstat(f.fileno()).st_mtime_ns != self.pinned:
+                raise gcs_exceptions.NotFound(f'No such object: {self.bucket.name}/{self.name}#{self.pinned}')
+            f.seek(start or 0)
+            # end is inclusive, as in Blob.download_as_bytes
+            return f.read() if end is None else f.read(end - (start or 0) + 1)
+
+
+class LocalBucket:
+    """
+    Stand-in for a google.cloud.storage.Bucket backed by a local directory laid out like the
+    bucket, for running the app and benchmarks without GCS.
+
+    Parameters:
+        root (str): Directory holding the bucket's objects.
+        name (str): Bucket name reported to callers.
+        faults (dict, optional): Faults injected into every request:
+            latency (seconds added to each request), slow_rate and slow_latency (probability and
+            extra seconds of a slow request), error_rate (probability of a 503 response).
+        seed (int, optional): Seed of the fault injection random generator.
+    """
+    def __init__(self, root, name='genotools-server', faults=None, seed=None):
+        self.root = root
+        self.name = name
+        self.faults = faults or {}
+        self.random = random.Random(seed)
+
+    def inject_faults(self, timeout=None):
+        delay = self.faults.get('latency', 0.0)
+        if self.random.random() < self.faults.get('slow_rate', 0.0):
+            delay += self.faults.get('slow_latency', 0.0)
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f'Request to {self.name} timed out after {timeout:.1f}s')
+        time.sleep(delay)
+        if self.random.random() < self.faults.get('error_rate', 0.0):
+            raise gcs_exceptions.ServiceUnavailable('Injected fault')
+
+    def blob(self, name, generation=None):
+        return LocalBlob(self, name, generation)
+
+    def get_blob(self, name, timeout=None, retry=None, **kwargs):
+        self.inject_faults(timeout)
+        blob = LocalBlob(self, name)
+        return blob if blob.generation is not None else None
@@ -0,0 +1,225 @@
+import gc
+import json
+import time
+import ctypes
+import logging
+import resource
+import threading
+from collections import deque
+import pandas as pd
+import streamlit as st
+from utils.config import AppConfig
+
+config = AppConfig()
+logger = logging.getLogger('gp2_browser.memory')
+
+CGROUP_LIMIT_FILES = [
+    '/sys/fs/cgroup/memory.max',                     # cgroup v2
+    '/sys/fs/cgroup/memory/memory.limit_in_bytes',  # cgroup v1
+]
+
+# registered caches as (cost, name, size, shrink), shrunk in ascending cost
+_caches = []
+_caches_lock = threading.Lock()
+
+_events = deque(maxlen=100)
+_stats = {'samples': 0, 'pressure_events': 0, 'unrelieved': 0, 'bytes_freed': 0, 'peak_rss': 0}
+_watchdog = None
+_watchdog_lock = threading.Lock()
+
+
+def process_rss(pid='self'):
+    """
+    Resident set size of a process in bytes, by default this one.
+    """
+    with open(f'/proc/{pid}/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def memory_limit():
+    """
+    Memory limit of the container in bytes: MEMORY_LIMIT_BYTES when set, otherwise the cgroup
+    limit, or None when there is none.
+    """
+    if config.MEMORY_LIMIT_BYTES:
+        return config.MEMORY_LIMIT_BYTES
+    for path in CGROUP_LIMIT_FILES:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # an unlimited cgroup reports 'max' (v2) or a page-rounded huge number (v1)
+        if value.isdigit() and int(value) < 2**60:
+            return int(value)
+    return None
+
+
+def register_cache(name, size, shrink, cost):
+    """
+    Register a cache for the memory-pressure watchdog.
+
+    Parameters:
+        name (str): Name shown in pressure events.
+        size (callable): Returns the bytes the cache holds.
+        shrink (callable): Called with a number of bytes; evicts about that many bytes and
+                           returns the bytes evicted.
+        cost (int): Relative cost of rebuilding what the cache holds; cheaper caches are shrunk first.
+    """
+    with _caches_lock:
+        _caches.append((cost, name, size, shrink))
+        _caches.sort(key=lambda cache: cache[0])
+
+
+def release_memory():
+    """
+    Collect garbage and hand freed heap pages back to the OS (glibc only), so evictions show in RSS.
+    """
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def relieve_pressure(rss, limit):
+    """
+    Shrink registered caches, cheapest first, until about enough bytes are evicted to bring RSS
+    down to MEMORY_LOW_WATERMARK of the limit. Records and logs a pressure event, unless every
+    cache was already empty (or in use): then the pressure is only counted.
+
+    Returns:
+        dict: The pressure event, or None when nothing was evicted.
+    """
+    target = config.MEMORY_LOW_WATERMARK * limit
+    to_free = rss - target
+    freed = {}
+    with _caches_lock:
+        caches = list(_caches)
+    for _, name, _, shrink in caches:
+        if to_free <= 0:
+            break
+        n_bytes = shrink(to_free)
+        freed[name] = n_bytes
+        to_free -= n_bytes
+    if not sum(freed.values()):
+        _stats['unrelieved'] += 1
+        return None
+    release_memory()
+
+    event = {
+        'time': time.time(),
+        'rss_before_mb': rss / 2**20,
+        'rss_after_mb': process_rss() / 2**20,
+        'limit_mb': limit / 2**20,
+        'freed_mb': {name: round(n_bytes / 2**20, 1) for name, n_bytes in freed.items()},
+    }
+    _events.append(event)
+    _stats['pressure_events'] += 1
+    _stats['bytes_freed'] += sum(freed.values())
+    logger.warning(json.dumps({'event': 'memory_pressure', **{
+        key: (round(value, 1) if isinstance(value, float) else value) for key, value in event.items()
+    }}))
+    return event
+
+
+class MemoryWatchdog:
+    """
+    Background thread sampling the process RSS every `interval` seconds and relieving memory
+    pressure once it passes MEMORY_HIGH_WATERMARK of the container limit.
+
+    Parameters:
+        limit (int): Container memory limit in bytes.
+        interval (float): Seconds between samples.
+    """
+    def __init__(self, limit, interval=None):
+        self.limit = limit
+        self.interval = interval if interval is not None else config.MEMORY_WATCHDOG_INTERVAL
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='gp2-memory-watchdog', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception('memory watchdog check failed')
+
+    def check(self):
+        rss = process_rss()
+        _stats['samples'] += 1
+        _stats['peak_rss'] = max(_stats['peak_rss'], rss)
+        if rss > config.MEMORY_HIGH_WATERMARK * self.limit:
+            return relieve_pressure(rss, self.limit)
+        return None
+
+
+def start_memory_watchdog():
+    """
+    Start the process-wide watchdog once, when MEMORY_WATCHDOG is on and a memory limit is known.
+
+    Returns:
+        MemoryWatchdog or None
+    """
+    global _watchdog
+    if not config.MEMORY_WATCHDOG:
+        return None
+    with _watchdog_lock:
+        if _watchdog is None:
+            limit = memory_limit()
+            if limit is None:
+                logger.info('no container memory limit found; the memory watchdog is not started')
+                _watchdog = False
+            else:
+                _watchdog = MemoryWatchdog(limit).start()
+    return _watchdog or None
+
+
+def memory_pressure_summary():
+    """
+    Pressure metrics and the current size of every registered cache.
+
+    Returns:
+        tuple: (metrics dict, DataFrame of caches)
+    """
+    limit = memory_limit()
+    metrics = {
+        'rss_mb': process_rss() / 2**20,
+        'limit_mb': limit / 2**20 if limit else None,
+        'peak_rss_mb': _stats['peak_rss'] / 2**20,
+        'pressure_events': _stats['pressure_events'],
+        'unrelieved': _stats['unrelieved'],
+        'freed_mb': _stats['bytes_freed'] / 2**20,
+        'last_event': _events[-1] if _events else None,
+    }
+    with _caches_lock:
+        caches = list(_caches)
+    sizes = pd.DataFrame([{'cache': name, 'cost': cost, 'mb': size() / 2**20} for cost, name, size, _ in caches],
+                         columns=['cache', 'cost', 'mb'])
+    return metrics, sizes
+
+
+def render_memory_pressure():
+    metrics, sizes = memory_pressure_summary()
+    with st.expander('Memory pressure', expanded=True):
+        col1, col2, col3, col4 = st.columns(4)
+        limit = f" of {metrics['limit_mb']:,.0f}" if metrics['limit_mb'] else ''
+        col1.metric('RSS', f"{metrics['rss_mb']:,.0f}{limit} MB")
+        col2.metric('Peak RSS', f"{metrics['peak_rss_mb']:,.0f} MB")
+        col3.metric('Pressure events', f"{metrics['pressure_events']:,}",
+                    help=f"Plus {metrics['unrelieved']:,} samples over the high watermark with nothing left to evict.")
+        col4.metric('Evicted', f"{metrics['freed_mb']:,.1f} MB")
+        st.dataframe(sizes, hide_index=True, use_container_width=True,
+                     column_config={'mb': st.column_config.NumberColumn(format='%.1f')})
+        if metrics['last_event'] is not None:
+            event = metrics['last_event']
+            st.caption(f"Last event {time.time() - event['time']:,.0f} s ago: RSS {event['rss_before_mb']:,.0f} → "
+                       f"{event['rss_after_mb']:,.0f} MB")
@@ -1,39 +1,41 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from dataclasses import dataclass
 
-from utils.hold_data import blob_as_csv
+from utils.hold_data import (
+    artifact_version,
+    get_sample_dictionary,
+    intern_sample_ids,
+    isin_samples,
+    load_shared_table
+)
 from utils.ancestry_utils import plot_pie, plot_3d
 from utils.quality_control_utils import relatedness_plot
+from utils.figure_pool_utils import pooled_chart
+from utils import figure_utils
+from utils.tracing_utils import traced
 
 
-def plot_age_distribution(master_key, stratify, plot2):
-    master_key_age = master_key[master_key['age'].notnull()]
-    if master_key_age.empty:
-        plot2.info('No age values available for the selected cohort.')
-        return
-
+@traced('figure')
+def age_distribution_figure(master_key_age, stratify):
     if stratify == 'None':
-        fig = px.histogram(master_key_age, x='age', nbins=25,
-                           color_discrete_sequence=["#332288"])
+        fig = figure_utils.histogram(master_key_age, x='age', nbins=25,
+                                     color_sequence=["#332288"])
         fig.update_layout(title_text=f'<b>Age Distribution<b>')
     elif stratify == 'Sex':
-        fig = px.histogram(
+        fig = figure_utils.histogram(
             master_key_age,
             x='age',
             color='sex',
             nbins=25,
-            color_discrete_map={'Male': "#332288", 'Female': "#CC6677"})
+            color_map={'Male': "#332288", 'Female': "#CC6677"})
         fig.update_layout(title_text=f'<b>Age Distribution by Sex<b>')
     elif stratify == 'Phenotype':
-        fig = px.histogram(
+        fig = figure_utils.histogram(
             master_key_age,
             x='age',
             color='pheno',
             nbins=25,
-            color_discrete_map={
+            color_map={
                 'Control': "#332288",
                 'PD': "#CC6677",
                 'Other': "#117733",
@@ -42,7 +44,26 @@ def plot_age_distribution(master_key, stratify, plot2):
         )
         fig.update_layout(title_text=f'<b>Age Distribution by Phenotype<b>')
 
-    plot2.plotly_chart(fig)
+    return fig
+
+
+@traced('figure')
+def plot_age_distribution(master_key, stratify, plot2, version=None):
+    """
+    Parameters:
+        master_key (pd.DataFrame): Master key filtered by cohort and ancestry.
+        stratify (str): 'None', 'Sex' or 'Phenotype'.
+        plot2 (DeltaGenerator): Container of the plot.
+        version (tuple, optional): master_key_version of the master key; the figure is only
+                                   memoized across reruns and sessions when given.
+    """
+    master_key_age = master_key[master_key['age'].notnull()]
+    if master_key_age.empty:
+        plot2.info('No age values available for the selected cohort.')
+        return
+
+    key = None if version is None else ('age_distribution', version, stratify)
+    pooled_chart(key, age_distribution_figure, master_key_age, stratify, container=plot2)
 
 
 def display_phenotype_counts(master_key, plot1):
@@ -63,7 +84,7 @@ def display_phenotype_counts(master_key, plot1):
     plot1.dataframe(combined_counts, use_container_width=True)
 
 
-def display_ancestry(full_cohort):
+def display_ancestry(full_cohort, version=None):
     anc1, anc2 = st.columns(2, vertical_alignment='center')
     anc_choice = st.session_state["meta_ancestry_choice"]
 
@@ -80,21 +101,34 @@ def display_ancestry(full_cohort):
     else:
         anc_df.rename(
             columns={'label': 'Ancestry Category', 'count': 'Count'}, inplace=True)
-        release_pie = plot_pie(anc_df)
-        anc2.plotly_chart(release_pie)
+        # the pie covers the whole cohort, whatever the selected ancestry
+        key = None if version is None else ('release_pie', version[:2])
+        # a copy, as the table is indexed in place below while the pie may still be building
+        pooled_chart(key, plot_pie, anc_df.copy(), container=anc2)
         anc_df.set_index('Ancestry Category', inplace=True)
         anc1.markdown(
             f'#### {st.session_state["cohort_choice"]} Ancestry Breakdown')
         anc1.dataframe(anc_df['Count'], use_container_width=True)
 
 
-def ancestry_pca(master_key, plot_title, gp2_data_bucket):
-    proj_samples = blob_as_csv(
-        gp2_data_bucket, f"cohort_browser/nba/release{st.session_state['release_choice']}/proj_pca_plot.csv", sep=',')
-    display_samples = proj_samples[proj_samples.IID.isin(
-        master_key.IID)]  # eventually update with new dataframe
-    st.session_state[plot_title] = plot_3d(
-        display_samples, 'Predicted Ancestry')
+@traced('load')
+def ancestry_pca(master_key, gp2_data_bucket, version=None):
+    """
+    Show the PCA of the projected samples in the master key, shared by sessions with the same version.
+    """
+    proj_path = f"cohort_browser/nba/release{st.session_state['release_choice']}/proj_pca_plot.csv"
+    # loaded before the key is taken, so the key names the version loaded
+    proj_samples = load_shared_table(gp2_data_bucket, proj_path, sep=',')
+
+    def load():
+        sample_dict = get_sample_dictionary(gp2_data_bucket)
+        proj_samples['sample_idx'] = intern_sample_ids(proj_samples.IID, sample_dict)
+        display_samples = proj_samples[isin_samples(
+            proj_samples.sample_idx, master_key.sample_idx, len(sample_dict))]  # eventually update with new dataframe
+        return display_samples, 'Predicted Ancestry'
+
+    key = None if version is None else ('ancestry_pca', artifact_version(gp2_data_bucket, proj_path), version)
+    pooled_chart(key, plot_3d, load=load)
 
 
 def display_pruned_samples(pruned_key, pruned1):
@@ -111,7 +145,7 @@ def display_pruned_samples(pruned_key, pruned1):
     pruned1.dataframe(pruned_steps, use_container_width=True)
 
 
-def display_related_samples(pruned_key, pruned2):
+def display_related_samples(pruned_key, pruned2, version=None):
     related_samples = pruned_key[pruned_key.related == 1][['label', 'related']]
     related_samples['related_count'] = related_samples.groupby(['label'])[
         'related'].transform('sum')
@@ -132,8 +166,9 @@ def display_related_samples(pruned_key, pruned2):
         pruned2.metric(f'Total Related Samples', 0)
     elif len(relatedness_df.label) > 3:
         pruned2.markdown("##### Relatedness per Ancestry")
-        related_plot = relatedness_plot(relatedness_df)
-        pruned2.plotly_chart(related_plot, use_container_width=True)
+        # pruned_key covers the whole cohort, whatever the selected ancestry
+        key = None if version is None else ('relatedness', version[:2])
+        pooled_chart(key, relatedness_plot, relatedness_df, container=pruned2, use_container_width=True)
     else:
         pruned2.markdown("#####")
         pruned2.markdown("##### Related Samples per Ancestry")
@@ -0,0 +1,110 @@
+import os
+import sys
+import threading
+from collections import Counter
+import plotly.graph_objects as go
+import streamlit as st
+from utils.config import AppConfig
+
+config = AppConfig()
+
+
+class SamplingProfiler:
+    """
+    Samples the call stack of one thread at a fixed interval from a background thread.
+
+    Stacks are recorded from the frame of `root_file` (the page script) inwards, as
+    'function (file:line)' entries, and counted per distinct stack.
+
+    Parameters:
+        root_file (str): Path of the script whose frames start every recorded stack.
+        interval (float): Seconds between samples.
+    """
+    def __init__(self, root_file, interval=None):
+        self.root_file = root_file
+        self.interval = interval if interval is not None else config.PROFILE_INTERVAL
+        self.stacks = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name='gp2-profiler', daemon=True)
+
+    def start(self):
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        if not self._stop.is_set():
+            self._stop.set()
+            self._sampler.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                if code.co_filename == self.root_file and code.co_name == '<module>':
+                    self.stacks[tuple(reversed(stack))] += 1
+                    break
+                frame = frame.f_back
+
+    @property
+    def n_samples(self):
+        return sum(self.stacks.values())
+
+    def collapsed(self):
+        """
+        Samples in collapsed-stack format ('frame;frame;frame count' per line), as read by
+        flamegraph.pl and speedscope.
+        """
+        return '\n'.join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common())
+
+    def flame_graph(self, min_fraction=0.005):
+        """
+        Icicle chart of the sampled call tree, root at the top, dropping frames seen in less
+        than `min_fraction` of the samples.
+        """
+        totals = Counter()
+        for stack, count in self.stacks.items():
+            for depth in range(1, len(stack) + 1):
+                totals[stack[:depth]] += count
+        min_count = min_fraction * self.n_samples
+        nodes = [path for path, count in totals.items() if count >= min_count]
+
+        fig = go.Figure(go.Icicle(
+            ids=[';'.join(path) for path in nodes],
+            labels=[path[-1] for path in nodes],
+            parents=[';'.join(path[:-1]) for path in nodes],
+            values=[totals[path] for path in nodes],
+            branchvalues='total',
+            tiling=dict(orientation='v'),
+            hovertemplate='%{label}<br>%{value} samples (%{percentRoot:.1%})<extra></extra>',
+            maxdepth=-1
+        ))
+        fig.update_layout(height=600, margin=dict(t=10, l=10, r=10, b=10))
+        return fig
+
+
+def profiling_enabled():
+    """
+    Profile every run with PROFILE_PAGES, or one run when the admin passes ?profile=<PROFILE_TOKEN>.
+    """
+    if config.PROFILE_PAGES:
+        return True
+    return bool(config.PROFILE_TOKEN) and st.query_params.get('profile') == config.PROFILE_TOKEN
+
+
+def render_profile(profiler, page):
+    with st.expander(f'Profile: {profiler.n_samples:,} samples every {1000 * profiler.interval:.0f} ms', expanded=True):
+        if profiler.n_samples == 0:
+            st.write('The run was too short to sample.')
+            return
+        st.download_button(
+            'Download collapsed stacks',
+            data=profiler.collapsed(),
+            file_name=f"{page.replace(' ', '_')}_profile.collapsed.txt",
+            mime='text/plain',
+            help='Open with speedscope (https://www.speedscope.app) or flamegraph.pl.'
+        )
+        st.plotly_chart(profiler.flame_graph(), use_container_width=True)
@@ -5,11 +5,15 @@ import plotly.graph_objects as go
 from utils.hold_data import (
     blob_as_csv, 
     blob_as_html, 
-    get_gcloud_bucket
+    get_gcloud_bucket,
+    sync_release_manifest
 )
+from utils.tracing_utils import traced
 
+@traced('load')
 def load_qc_data():
     gp2_data_bucket = get_gcloud_bucket('genotools-server')
+    sync_release_manifest(gp2_data_bucket)
 
     qc_metrics_path = f"cohort_browser/nba/release{st.session_state['release_choice']}"
     related_df = blob_as_csv(gp2_data_bucket, f'{qc_metrics_path}/related_plot.csv', sep=',')
@@ -18,6 +22,7 @@ def load_qc_data():
  
     return funnel_plot, related_df, variant_plot
 
+@traced('figure')
 def relatedness_plot(relatedness_df):
     relatedness_plot = go.Figure(
         data=[
@@ -3,7 +3,9 @@ from utils.hold_data import (
     blob_as_csv, 
     get_gcloud_bucket
 )
+from utils.tracing_utils import traced
 
+@traced('load')
 def load_rare_variant_data(bucket_name, file_path):
     """Load rare variant data from the specified bucket and file."""
     bucket = get_gcloud_bucket(bucket_name)
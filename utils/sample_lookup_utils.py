@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+from utils.hold_data import (
+    get_master_key,
+    get_sample_dictionary,
+    intern_sample_ids,
+    load_shared_table
+)
+from utils.ancestry_utils import (
+    load_reference_pca_figure,
+    set_samples_of_interest
+)
+from utils.snp_metrics_utils import (
+    load_metrics_data,
+    metrics_version,
+    plot_clusters
+)
+from utils.session_cache_utils import session_cache
+from utils.tracing_utils import traced
+from utils.config import AppConfig
+
+config = AppConfig()
+
+
+def row_locations(sample_idx, n_samples):
+    """
+    Invert a column of interned sample ids into row positions indexed by sample id (-1 if absent).
+    """
+    rows = np.full(n_samples, -1, dtype=np.int32)
+    sample_idx = np.asarray(sample_idx)
+    present = sample_idx >= 0
+    rows[sample_idx[present]] = np.flatnonzero(present)
+    return rows
+
+
+@traced('load')
+def load_sample_index(bucket):
+    """
+    Load the release artifacts used by the sample lookup and index them by sample id.
+
+    Returns:
+        dict: master_key, proj_pca and ref_pca DataFrames, the sample dictionary and an index
+              DataFrame (one row per sample id) with each sample's master_key_row and proj_pca_row.
+    """
+    release_choice = st.session_state["release_choice"]
+    pca_folder = f"cohort_browser/nba/release{release_choice}"
+
+    cache = session_cache()
+    if f"release{release_choice}_sample_index" not in cache:
+        master_key = get_master_key(bucket)
+        sample_dict = get_sample_dictionary(bucket, release_choice)
+        proj_pca = load_shared_table(bucket, f"{pca_folder}/proj_pca_plot.csv", sep=',')
+        proj_pca['sample_idx'] = intern_sample_ids(proj_pca.IID, sample_dict)
+        ref_pca = load_shared_table(bucket, f"{pca_folder}/ref_pca_plot.csv", sep=',')
+
+        index = pd.DataFrame({
+            'master_key_row': row_locations(master_key['sample_idx'], len(sample_dict)),
+            'proj_pca_row': row_locations(proj_pca['sample_idx'], len(sample_dict)),
+        })
+        sample_index = {
+            'master_key': master_key,
+            'proj_pca': proj_pca,
+            'ref_pca': ref_pca,
+            'sample_dict': sample_dict,
+            'index': index
+        }
+        cache[f"release{release_choice}_sample_index"] = sample_index
+    else:
+        sample_index = cache[f"release{release_choice}_sample_index"]
+
+    return sample_index
+
+
+def lookup_sample(sample_index, sample_id):
+    """
+    Return the master key and PCA rows of one sample, or None if the ID is not in the release.
+    """
+    sample_dict = sample_index['sample_dict']
+    if sample_id not in sample_dict:
+        return None
+
+    rows = sample_index['index'].iloc[sample_dict.get_loc(sample_id)]
+    profile = {'sample_idx': sample_dict.get_loc(sample_id)}
+    for artifact in ['master_key', 'proj_pca']:
+        row = rows[f'{artifact}_row']
+        profile[artifact] = sample_index[artifact].iloc[row] if row >= 0 else None
+    return profile
+
+
+@traced('compute')
+def sample_metric_rows(metrics, version, ancestry_choice, chr_choice, sample_idx):
+    """
+    Rows of one sample in a chromosome's metrics, found through a sample-sorted row index
+    that is built once per ancestry, chromosome and version of the metrics (see metrics_version).
+    """
+    cache = session_cache()
+    cached = cache.get(f"{ancestry_choice}_{chr_choice}_sample_rows")
+    if cached is None or cached[0] != version:
+        order = np.argsort(metrics['sample_idx'].to_numpy(), kind='stable')
+        cached = (version, order, metrics['sample_idx'].to_numpy()[order])
+        cache[f"{ancestry_choice}_{chr_choice}_sample_rows"] = cached
+    _, order, sorted_idx = cached
+
+    start, stop = np.searchsorted(sorted_idx, [sample_idx, sample_idx + 1])
+    return metrics.iloc[np.sort(order[start:stop])]
+
+
+def display_sample_profile(profile, sample_id):
+    master_row = profile['master_key']
+    if master_row is None:
+        st.info(f"{sample_id} is not in the master key for this release.")
+        return
+
+    prune_reason = master_row['prune_reason']
+    info = pd.DataFrame({
+        'Cohort': [master_row['study']],
+        'Predicted Ancestry': [master_row['label']],
+        'Sex': [config.SEX_MAP.get(master_row['sex'], master_row['sex'])],
+        'Age': [master_row['age']],
+        'Phenotype': [master_row['pheno']],
+        'Pruned': ['No' if pd.isnull(prune_reason) else config.PRUNE_MAP.get(prune_reason, prune_reason)],
+    })
+    st.dataframe(info, hide_index=True, use_container_width=True)
+
+
+def display_sample_pca(sample_index, profile, sample_id):
+    if profile['proj_pca'] is None:
+        st.info(f"{sample_id} was not projected onto the reference panel PCA.")
+        return
+
+    sample_pca = profile['proj_pca'].to_frame().T
+    pca_folder = f"cohort_browser/nba/release{st.session_state['release_choice']}"
+    fig = load_reference_pca_figure(sample_index['ref_pca'], pca_folder,
+                                    x='PC1', y='PC2', z='PC3', label_col='label')
+    st.plotly_chart(set_samples_of_interest(fig, sample_pca, x='PC1', y='PC2', z='PC3'))
+
+
+def display_sample_genotypes(bucket, profile, sample_id, chr_choice):
+    ancestry = profile['master_key']['label'] if profile['master_key'] is not None else None
+    if ancestry not in config.ANCESTRY_OPTIONS:
+        st.info(f"No SNP metrics are available for {sample_id}'s ancestry.")
+        return
+
+    metrics, _, _ = load_metrics_data(bucket, ancestry, chr_choice)
+    sample_rows = sample_metric_rows(metrics, metrics_version(ancestry, chr_choice), ancestry, chr_choice,
+                                     profile['sample_idx'])
+    if sample_rows.empty:
+        st.info(f"{sample_id} has no SNP metrics on chromosome {chr_choice}.")
+        return
+
+    calls = sample_rows[['snpID', 'position', 'GT', 'Theta', 'R']].reset_index(drop=True)
+    st.dataframe(calls, hide_index=True, use_container_width=True)
+
+    snp_choice = st.selectbox("Show cluster plot for SNP", ['Select SNP!'] + calls['snpID'].astype(str).tolist(),
+                              key="lookup_snp_choice")
+    if snp_choice != 'Select SNP!':
+        snp_df = metrics[metrics['snpID'] == snp_choice]
+        highlight = sample_rows[sample_rows['snpID'] == snp_choice]
+        st.plotly_chart(plot_clusters(snp_df, x_col='Theta', y_col='R', gtype_col='GT',
+                                      title=f'{snp_choice} ({ancestry})', highlight=highlight))
@@ -0,0 +1,294 @@
+import sys
+import mmap
+import time
+import weakref
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from utils.memory_utils import register_cache
+from utils.config import AppConfig
+
+config = AppConfig()
+
+# the SessionCache of every live session, by session id; entries go when their session is dropped
+_sessions = weakref.WeakValueDictionary()
+_sessions_lock = threading.Lock()
+
+
+def array_nbytes(array):
+    """
+    Heap bytes held by a NumPy array: 0 for views of memory-mapped files (the shared store),
+    whose pages are shared by every session and process.
+    """
+    base = array
+    while getattr(base, 'base', None) is not None:
+        base = base.base
+    return 0 if isinstance(base, mmap.mmap) else array.nbytes
+
+
+def object_nbytes(values, sample_size=1000):
+    """
+    Bytes of an object array and the objects it points to, extrapolated from an evenly spaced
+    sample for long arrays so accounting stays cheap.
+    """
+    values = np.asarray(values, dtype=object).ravel()
+    if len(values) > sample_size:
+        sample = values[np.linspace(0, len(values) - 1, sample_size).astype(int)]
+    else:
+        sample = values
+    object_bytes = sum(sys.getsizeof(item) for item in sample) * len(values) / max(len(sample), 1)
+    return values.nbytes + int(object_bytes)
+
+
+# trace properties that hold per-point data, which is nearly all of a figure's memory
+FIGURE_DATA_PROPS = ('x', 'y', 'z', 'lat', 'lon', 'r', 'theta', 'values', 'labels', 'locations', 'ids',
+                     'text', 'hovertext', 'customdata', 'marker.color', 'marker.size', 'marker.symbol')
+
+
+def figure_nbytes(fig):
+    """
+    Estimated heap bytes of a figure from its traces' per-point data arrays, read in place
+    rather than through a copy of the whole figure (as to_dict or to_json make).
+    """
+    total = 0
+    for trace in fig.data:
+        for prop in FIGURE_DATA_PROPS:
+            if prop in trace:
+                value = trace[prop]
+                if isinstance(value, (list, tuple)):
+                    total += object_nbytes(value)
+                elif value is not None:
+                    total += nbytes(value)
+    return total
+
+
+def nbytes(value):
+    """
+    Estimated heap bytes kept alive by a cached value: arrays, pandas objects, figures, bytes
+    and containers of them.
+    """
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, np.ndarray):
+        return object_nbytes(value) if value.dtype == object else array_nbytes(value)
+    if isinstance(value, pd.DataFrame):
+        return sum(nbytes(value[col]) for col in value.columns) + nbytes(value.index)
+    if isinstance(value, pd.Series):
+        if isinstance(value.dtype, pd.CategoricalDtype):
+            return array_nbytes(value.cat.codes.to_numpy()) + nbytes(value.cat.categories)
+        if value.dtype == object:
+            return object_nbytes(value.to_numpy())
+        return array_nbytes(value.to_numpy())
+    if isinstance(value, pd.Index):
+        return object_nbytes(value.to_numpy()) if value.dtype == object else int(value.memory_usage())
+    if isinstance(value, go.Figure):
+        return figure_nbytes(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class SessionCache(MutableMapping):
+    """
+    Per-session cache of loaded data, tables and figures with a byte limit. Entries are sized
+    once, when stored, and keep that size for accounting and eviction. Storing an entry past
+    the limit evicts the least recently used entries; callers recompute an evicted entry on
+    their next miss. An entry larger than the whole limit is kept until the next store.
+
+    The memory watchdog shrinks caches from its own thread, but only between runs of their
+    session (see session_run), so a page never loses an entry it has just checked for.
+
+    Parameters:
+        session_id (str): Id of the owning session.
+        max_bytes (int): Byte limit of the cache.
+    """
+    def __init__(self, session_id, max_bytes):
+        self.session_id = session_id
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, bytes), least recently used first
+        self.bytes = 0
+        self.state_bytes = 0
+        self.evictions = 0
+        self.last_active = time.time()
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        value, _ = self.entries[key]
+        self.entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.entries:
+            del self[key]
+        size = nbytes(value)
+        self.entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            del self[next(iter(self.entries))]
+            self.evictions += 1
+
+    def __delitem__(self, key):
+        _, size = self.entries.pop(key)
+        self.bytes -= size
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def largest(self):
+        """
+        Key and size of the largest entry, or (None, 0) when empty.
+        """
+        return max(((key, size) for key, (_, size) in list(self.entries.items())), key=lambda item: item[1], default=(None, 0))
+
+    def kind_bytes(self, figures):
+        return sum(size for value, size in list(self.entries.values()) if isinstance(value, go.Figure) == figures)
+
+    def shrink(self, n_bytes, figures):
+        """
+        Evict figures (or everything else) least recently used first until `n_bytes` are evicted.
+        Nothing is evicted while the session is running.
+
+        Returns:
+            int: Bytes evicted.
+        """
+        freed = 0
+        with self.lock:
+            if self.running:
+                return 0
+            for key, (value, size) in list(self.entries.items()):
+                if freed >= n_bytes:
+                    break
+                if isinstance(value, go.Figure) == figures:
+                    del self[key]
+                    self.evictions += 1
+                    freed += size
+        return freed
+
+
+def session_cache():
+    """
+    The current session's SessionCache, created on first use and registered for accounting.
+    """
+    if "session_cache" not in st.session_state:
+        ctx = get_script_run_ctx()
+        session_id = ctx.session_id if ctx is not None else "bare"
+        cache = SessionCache(session_id, config.SESSION_CACHE_MAX_BYTES)
+        st.session_state["session_cache"] = cache
+        with _sessions_lock:
+            _sessions[session_id] = cache
+    else:
+        cache = st.session_state["session_cache"]
+    cache.last_active = time.time()
+    return cache
+
+
+@contextmanager
+def session_run():
+    """
+    Mark the current session as running for the length of the block, so the memory watchdog
+    leaves its cache alone.
+    """
+    cache = session_cache()
+    with cache.lock:
+        cache.running += 1
+    try:
+        yield cache
+    finally:
+        with cache.lock:
+            cache.running -= 1
+
+
+def account_session():
+    """
+    Record the bytes held by the rest of the current session's state (selections, the filtered
+    master key, placeholders) next to its cache.
+    """
+    cache = session_cache()
+    cache.state_bytes = sum(nbytes(value) for key, value in st.session_state.items() if key != "session_cache")
+
+
+def session_memory():
+    """
+    Memory held by every live session, largest first.
+    """
+    caches = live_caches()
+    now = time.time()
+    rows = []
+    for cache in caches:
+        largest_key, largest_bytes = cache.largest()
+        rows.append({
+            'session': cache.session_id[:8],
+            'total_mb': (cache.bytes + cache.state_bytes) / 2**20,
+            'cache_mb': cache.bytes / 2**20,
+            'state_mb': cache.state_bytes / 2**20,
+            'entries': len(cache),
+            'evictions': cache.evictions,
+            'idle_s': now - cache.last_active,
+            'largest_entry': largest_key,
+            'largest_mb': largest_bytes / 2**20,
+        })
+    columns = ['session', 'total_mb', 'cache_mb', 'state_mb', 'entries', 'evictions', 'idle_s', 'largest_entry', 'largest_mb']
+    return pd.DataFrame(rows, columns=columns).sort_values('total_mb', ascending=False, ignore_index=True)
+
+
+def live_caches():
+    with _sessions_lock:
+        return list(_sessions.values())
+
+
+def shrink_session_caches(n_bytes, figures):
+    """
+    Evict cached figures (or data) of every session, longest idle sessions first, until `n_bytes`
+    are evicted.
+
+    Returns:
+        int: Bytes evicted.
+    """
+    freed = 0
+    for cache in sorted(live_caches(), key=lambda cache: cache.last_active):
+        if freed >= n_bytes:
+            break
+        freed += cache.shrink(n_bytes - freed, figures)
+    return freed
+
+
+# figures are rebuilt from cached data without any storage reads, so they go first
+register_cache('session figures', lambda: sum(cache.kind_bytes(True) for cache in live_caches()),
+               lambda n_bytes: shrink_session_caches(n_bytes, figures=True), cost=1)
+register_cache('session data', lambda: sum(cache.kind_bytes(False) for cache in live_caches()),
+               lambda n_bytes: shrink_session_caches(n_bytes, figures=False), cost=3)
+
+
+def admin_view_enabled():
+    return bool(config.ADMIN_TOKEN) and st.query_params.get('admin') == config.ADMIN_TOKEN
+
+
+def render_session_memory(top=20):
+    sessions = session_memory()
+    with st.expander(f'Session memory: {len(sessions)} live sessions', expanded=True):
+        col1, col2, col3 = st.columns(3)
+        col1.metric('Cached', f"{sessions['cache_mb'].sum():,.1f} MB")
+        col2.metric('Other session state', f"{sessions['state_mb'].sum():,.1f} MB")
+        col3.metric('Evictions', f"{sessions['evictions'].sum():,}",
+                    help=f'Entries dropped to keep sessions under {config.SESSION_CACHE_MAX_BYTES / 2**20:,.0f} MB of cache.')
+        st.dataframe(
+            sessions.head(top),
+            hide_index=True,
+            use_container_width=True,
+            column_config={col: st.column_config.NumberColumn(format='%.1f') for col in ['total_mb', 'cache_mb', 'state_mb', 'idle_s', 'largest_mb']}
+        )
@@ -0,0 +1,396 @@
+import os
+import json
+import errno
+import fcntl
+import shutil
+import hashlib
+import weakref
+import threading
+import numpy as np
+import pandas as pd
+from utils.config import AppConfig
+from utils.memory_utils import register_cache
+
+config = AppConfig()
+
+
+class SharedStore:
+    """
+    Local store of release data shared by every app worker process on an instance.
+
+    Each entry is a directory of .npy files under {root}/{namespace}/{version}/, written once
+    (under a file lock, so concurrent workers build it only once) and then memory-mapped by every
+    process. Reads are zero-copy and backed by the OS page cache; mapping in copy-on-write mode
+    means in-place edits by a page stay private to that process.
+
+    Every process that opens an entry registers a pid file next to it, which serves as the
+    entry's reference count, and removes it once it no longer maps or holds anything of the
+    entry. Once a newer version of a namespace is opened, supersede() deletes the older versions
+    without readers.
+
+    String columns are decoded once per process and entry, and shared read-only by every
+    DataFrame read from it in the process.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _entry_dir(self, namespace, version):
+        return os.path.join(self.root, _safe_name(namespace), _safe_name(str(version)))
+
+    def get_or_create(self, namespace, version, build):
+        """
+        Open the entry for (namespace, version), building it with `build()` on first use.
+
+        Parameters:
+            namespace (str): Name of the artifact, e.g. its blob path.
+            version (str): Version of the artifact, e.g. its generation or content hash.
+            build (callable): Returns a pd.DataFrame or a dict of np.ndarray to store.
+
+        Returns:
+            pd.DataFrame or dict: The stored data, backed by memory-mapped arrays.
+        """
+        entry_dir = self._entry_dir(namespace, version)
+        self._register_reader(entry_dir)
+        try:
+            if not os.path.exists(os.path.join(entry_dir, 'meta.json')):
+                with open(f'{entry_dir}.lock', 'w') as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    try:
+                        if not os.path.exists(os.path.join(entry_dir, 'meta.json')):
+                            write_entry(build(), entry_dir)
+                    finally:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+            self.supersede(namespace, version)
+            return read_entry(entry_dir)
+        finally:
+            _release(entry_dir)
+
+    def open(self, namespace, version):
+        """
+        Open the entry for (namespace, version) if it has been built.
+
+        Returns:
+            pd.DataFrame or dict or None: The stored data, or None when there is no such entry.
+        """
+        entry_dir = self._entry_dir(namespace, version)
+        self._register_reader(entry_dir)
+        try:
+            if not os.path.exists(os.path.join(entry_dir, 'meta.json')):
+                return None
+            self.supersede(namespace, version)
+            return read_entry(entry_dir)
+        finally:
+            _release(entry_dir)
+
+    def _register_reader(self, entry_dir):
+        """
+        Register this process as a reader of the entry, held until the matching _release().
+        """
+        _hold(entry_dir)
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        # under a shared lock, as supersede() checks for readers and deletes under an exclusive one
+        with open(f'{entry_dir}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            try:
+                os.makedirs(f'{entry_dir}.readers', exist_ok=True)
+                open(_pid_file(entry_dir), 'w').close()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def supersede(self, namespace, current_version):
+        """
+        Delete every other version of `namespace` that has no live reader process and is not
+        being built. Processes still mapping a deleted version keep reading it until they drop
+        it, since unlinked files stay valid while mapped.
+        """
+        namespace_dir = os.path.join(self.root, _safe_name(namespace))
+        current = _safe_name(str(current_version))
+        # entry names never contain '.', so this also picks up the .lock/.readers files of failed builds
+        for name in {name.split('.')[0] for name in os.listdir(namespace_dir)}:
+            if name == current:
+                continue
+            entry_dir = os.path.join(namespace_dir, name)
+            # this process has moved on to the current version
+            forget_decoded(entry_dir)
+            self.delete_unused(entry_dir)
+
+    def unused_entries(self):
+        """
+        Entries no live process reads: superseded versions (all but the newest of a namespace)
+        first, then the least recently built.
+        """
+        ranked = []
+        for namespace in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            namespace_dir = os.path.join(self.root, namespace)
+            versions = []
+            for name in os.listdir(namespace_dir):
+                entry_dir = os.path.join(namespace_dir, name)
+                try:
+                    versions.append((os.path.getmtime(os.path.join(entry_dir, 'meta.json')), entry_dir))
+                except OSError:
+                    # lock, readers and temporary files, and entries being built or deleted
+                    continue
+            versions.sort()
+            ranked += [(i == len(versions) - 1, built_at, entry_dir) for i, (built_at, entry_dir) in enumerate(versions)]
+        return [entry_dir for _, _, entry_dir in sorted(ranked) if not self._live_readers(entry_dir)]
+
+    def delete_unused(self, entry_dir):
+        """
+        Delete an entry unless a live process reads it or is building it.
+
+        Returns:
+            int: Bytes deleted.
+        """
+        if self._live_readers(entry_dir):
+            return 0
+        with open(f'{entry_dir}.lock', 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            # a reader may have registered since the first check
+            if self._live_readers(entry_dir):
+                return 0
+            n_bytes = _dir_bytes(entry_dir)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            shutil.rmtree(f'{entry_dir}.readers', ignore_errors=True)
+            os.remove(f'{entry_dir}.lock')
+        return n_bytes
+
+    def _live_readers(self, entry_dir):
+        """
+        Pids of live processes reading the entry, this one included; pid files of exited
+        processes are removed.
+        """
+        readers_dir = f'{entry_dir}.readers'
+        live = []
+        for pid in os.listdir(readers_dir) if os.path.isdir(readers_dir) else []:
+            if _pid_alive(int(pid)):
+                live.append(int(pid))
+            else:
+                try:
+                    os.remove(os.path.join(readers_dir, pid))
+                except FileNotFoundError:
+                    pass
+        return live
+
+
+# this process's use of each entry, by directory: registrations being opened plus live memory
+# maps; the entry's pid file is removed once nothing is left (and no decoded columns are kept)
+_in_use = {}
+# string columns decoded once per process, by entry directory and column position
+_decoded = {}
+_in_use_lock = threading.Lock()
+
+
+def _pid_file(entry_dir):
+    return os.path.join(f'{entry_dir}.readers', str(os.getpid()))
+
+
+def _hold(entry_dir):
+    with _in_use_lock:
+        _in_use[entry_dir] = _in_use.get(entry_dir, 0) + 1
+
+
+def _release(entry_dir):
+    with _in_use_lock:
+        _in_use[entry_dir] -= 1
+        if _in_use[entry_dir] > 0:
+            return
+        del _in_use[entry_dir]
+        if entry_dir in _decoded:
+            return
+        try:
+            os.remove(_pid_file(entry_dir))
+        except FileNotFoundError:
+            pass
+
+
+def _track(entry_dir, values):
+    """
+    Count a memory-mapped array as a use of the entry until its map is garbage collected.
+    """
+    base = values
+    while getattr(base, 'base', None) is not None:
+        base = base.base
+    _hold(entry_dir)
+    weakref.finalize(base, _release, entry_dir)
+
+
+def forget_decoded(entry_dir):
+    """
+    Drop the string columns decoded from an entry; DataFrames already holding them keep them.
+
+    Returns:
+        int: Bytes of the object arrays dropped (not counting the strings themselves).
+    """
+    with _in_use_lock:
+        columns = _decoded.pop(entry_dir, None)
+        if columns is None:
+            return 0
+        if entry_dir not in _in_use:
+            try:
+                os.remove(_pid_file(entry_dir))
+            except FileNotFoundError:
+                pass
+    return sum(values.nbytes for values in columns.values())
+
+
+def _decoded_column(entry_dir, i, load):
+    with _in_use_lock:
+        values = _decoded.get(entry_dir, {}).get(i)
+    if values is None:
+        values = np.asarray(load(), dtype=object)
+        # shared by every reader in the process: in-place edits must fail instead of leaking
+        values.flags.writeable = False
+        with _in_use_lock:
+            values = _decoded.setdefault(entry_dir, {}).setdefault(i, values)
+    return values
+
+
+def _dir_bytes(path):
+    n_bytes = 0
+    for dir_path, _, names in os.walk(path):
+        for name in names:
+            try:
+                n_bytes += os.path.getsize(os.path.join(dir_path, name))
+            except OSError:
+                pass
+    return n_bytes
+
+
+def _safe_name(name):
+    safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+    return f"{safe[:80]}-{hashlib.sha1(name.encode('utf-8')).hexdigest()[:10]}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def write_entry(data, entry_dir):
+    """
+    Write a DataFrame or dict of arrays as .npy files plus meta.json, atomically via a temporary directory.
+
+    Object (string) columns of a DataFrame are stored as categorical codes and categories.
+    """
+    tmp_dir = f'{entry_dir}.tmp{os.getpid()}'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    if isinstance(data, pd.DataFrame):
+        meta = {'kind': 'frame', 'columns': []}
+        for i, col in enumerate(data.columns):
+            series = data[col]
+            if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object:
+                categorical = pd.Categorical(series)
+                np.save(os.path.join(tmp_dir, f'{i}.codes.npy'), categorical.codes)
+                np.save(os.path.join(tmp_dir, f'{i}.categories.npy'), _to_storable(np.asarray(categorical.categories)))
+                meta['columns'].append({'name': col, 'type': 'categorical', 'object': bool(series.dtype == object)})
+            else:
+                np.save(os.path.join(tmp_dir, f'{i}.npy'), series.to_numpy())
+                meta['columns'].append({'name': col, 'type': 'array'})
+    else:
+        meta = {'kind': 'arrays', 'columns': []}
+        for i, (name, values) in enumerate(data.items()):
+            np.save(os.path.join(tmp_dir, f'{i}.npy'), _to_storable(np.asarray(values)))
+            meta['columns'].append({'name': name, 'type': 'array'})
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    os.rename(tmp_dir, entry_dir)
+
+
+def read_entry(entry_dir):
+    with open(os.path.join(entry_dir, 'meta.json')) as f:
+        meta = json.load(f)
+
+    def load(name):
+        # plain ndarray views of the copy-on-write maps, so pandas never sees np.memmap
+        values = np.asarray(np.load(os.path.join(entry_dir, name), mmap_mode='c', allow_pickle=False))
+        _track(entry_dir, values)
+        return values
+
+    def categorical(i):
+        return pd.Categorical.from_codes(load(f'{i}.codes.npy'), categories=load(f'{i}.categories.npy'))
+
+    columns = {}
+    for i, col in enumerate(meta['columns']):
+        if col['type'] == 'categorical' and col['object']:
+            columns[col['name']] = _decoded_column(entry_dir, i, lambda: categorical(i))
+        elif col['type'] == 'categorical':
+            columns[col['name']] = categorical(i)
+        else:
+            columns[col['name']] = load(f'{i}.npy')
+
+    if meta['kind'] == 'frame':
+        return pd.DataFrame(columns, copy=False)
+    return columns
+
+
+def _to_storable(values):
+    # .npy files are opened without pickle support, so object arrays are stored as fixed-width strings
+    return values.astype(str) if values.dtype == object else values
+
+
+_store = None
+
+
+def get_shared_store():
+    """
+    Process-wide SharedStore rooted at config.SHARED_STORE_DIR, or None if the store is disabled.
+    """
+    global _store
+    if not config.SHARED_STORE_DIR:
+        return None
+    if _store is None:
+        _store = SharedStore(config.SHARED_STORE_DIR)
+    return _store
+
+
+def shared_store_bytes():
+    """
+    Bytes of every entry in the store, plus the string columns this process has decoded.
+    """
+    store = get_shared_store()
+    with _in_use_lock:
+        decoded = sum(values.nbytes for columns in _decoded.values() for values in columns.values())
+    return decoded + (_dir_bytes(store.root) if store is not None else 0)
+
+
+def shrink_shared_store(n_bytes):
+    """
+    Delete store entries no process reads, superseded versions first, until `n_bytes` are evicted;
+    then drop this process's remaining decoded string columns. The store's files take up memory
+    when it is on tmpfs (e.g. /tmp on App Engine) and are rebuilt from the bucket on their next read.
+
+    Returns:
+        int: Bytes evicted.
+    """
+    freed = 0
+    # columns decoded from entries nothing maps any more are all that keeps this process a reader of them
+    with _in_use_lock:
+        unmapped = [entry_dir for entry_dir in _decoded if entry_dir not in _in_use]
+    for entry_dir in unmapped:
+        freed += forget_decoded(entry_dir)
+    store = get_shared_store()
+    for entry_dir in store.unused_entries() if store is not None else []:
+        if freed >= n_bytes:
+            break
+        freed += store.delete_unused(entry_dir)
+    with _in_use_lock:
+        entries = list(_decoded)
+    for entry_dir in entries:
+        if freed >= n_bytes:
+            break
+        freed += forget_decoded(entry_dir)
+    return freed
+
+
+register_cache('shared store', shared_store_bytes, shrink_shared_store, cost=2)
@@ -0,0 +1,69 @@
+import threading
+from utils.config import AppConfig
+
+config = AppConfig()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+
+
+def single_flight(key, load, share=None):
+    """
+    Run `load()` once for concurrent callers with the same key: the first caller loads, and
+    callers arriving while that load is in flight wait for it and get its result (or exception)
+    instead of starting their own. Loads of different keys never wait on each other.
+
+    Only exceptions (Exception) are shared. When the loading caller is interrupted by anything
+    else, e.g. a Streamlit rerun or st.stop() of its own session, the waiting callers retry the
+    load themselves. Loads are shared by sessions, so they must not draw on the page.
+
+    Parameters:
+        key (hashable): Identifies the artifact and version being loaded.
+        load (callable): Loads the value.
+        share (callable, optional): Applied to the result handed to waiting callers, e.g.
+                                    pd.DataFrame.copy for results callers may modify in place.
+
+    Returns:
+        The loaded value.
+    """
+    if not config.SINGLE_FLIGHT:
+        return load()
+
+    while True:
+        with _calls_lock:
+            call = _calls.get(key)
+            leader = call is None
+            if leader:
+                call = _calls[key] = _Call()
+
+        if leader:
+            break
+        call.done.wait()
+        if call.abandoned:
+            continue
+        if call.error is not None:
+            raise call.error
+        return share(call.result) if share is not None else call.result
+
+    try:
+        call.result = load()
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    except BaseException:
+        call.abandoned = True
+        raise
+    finally:
+        with _calls_lock:
+            del _calls[key]
+        call.done.set()
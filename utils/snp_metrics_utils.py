@@ -1,47 +1,641 @@
 import pandas as pd
 import numpy as np
+from io import BytesIO
 import streamlit as st
 import plotly.express as px
+import plotly.graph_objects as go
+from scipy.stats import chi2
 from utils.hold_data import (
-    blob_as_csv
+    blob_as_csv,
+    get_sample_dictionary,
+    intern_sample_ids,
+    has_artifact,
+    load_shared,
+    read_csv
 )
+from utils.gcs_utils import download_blob, get_blob_info
+from utils.single_flight_utils import single_flight
+from utils.session_cache_utils import session_cache
+from utils.snp_storage_utils import (
+    CODED_COLUMNS,
+    decode_compact_metrics,
+    compact_metrics_frame
+)
+from utils import figure_utils
+from utils.tracing_utils import traced
+from utils.config import AppConfig
+
+config = AppConfig()
 
+@traced('load')
 def load_metrics_data(bucket, ancestry_choice, chr_choice):
+    """
+    Load the sample-level metrics of one ancestry and chromosome.
+
+    The first fetch decodes chr{N}_metrics.npz (or parses chr{N}_metrics.csv when the compact file
+    has not been built) and writes the result to the local shared store. Later loads, from any
+    session or worker process, map those files without copying: the OS page cache keeps recently
+    viewed chromosomes resident and idle ones cost no heap memory. Rows are grouped by SNP, so
+    slicing one SNP only touches that SNP's pages.
+
+    Parameters:
+        bucket (google.cloud.storage.bucket.Bucket): GCloud bucket object.
+        ancestry_choice (str): Ancestry label.
+        chr_choice (int): Chromosome number.
+
+    Returns:
+        tuple: (metrics, maf, full_maf) DataFrames. String columns of metrics are categorical.
+    """
     metrics_blob_name = f"cohort_browser/nba/snp_metrics/{ancestry_choice}/chr{chr_choice}_metrics.csv"
-    maf_blob_name = f"cohort_browser/nba/snp_metrics/{ancestry_choice}/{ancestry_choice}_maf.afreq"
-    full_maf_blob_name = "cohort_browser/nba/snp_metrics/full_maf.afreq"
+    compact_blob_name = f"cohort_browser/nba/snp_metrics/{ancestry_choice}/chr{chr_choice}_metrics.npz"
 
-    if f"{ancestry_choice}_{chr_choice}" not in st.session_state:
-        metrics = blob_as_csv(bucket, metrics_blob_name, sep=',')
-        st.session_state[f"{ancestry_choice}_{chr_choice}"] = metrics
+    cache = session_cache()
+    if f"{ancestry_choice}_{chr_choice}" not in cache:
+        sample_dict = get_sample_dictionary(bucket)
+        blob_name = compact_blob_name if has_artifact(bucket, compact_blob_name) else metrics_blob_name
+
+        def fetch_metrics():
+            if blob_name == compact_blob_name:
+                # downloaded once into the store, so not kept in the blob cache
+                blob = get_blob_info(bucket, compact_blob_name)
+                if blob is None:
+                    raise FileNotFoundError(f"gs://{bucket.name}/{compact_blob_name} does not exist")
+                generation, age = blob.generation, None
+                compact = decode_compact_metrics(download_blob(bucket, compact_blob_name, generation=generation))
+                metrics = compact_metrics_frame(compact)
+                # intern the file's small sample table, then expand through its row codes
+                metrics['sample_idx'] = np.append(intern_sample_ids(compact['samples'], sample_dict), np.int32(-1))[compact['sample_index']]
+            else:
+                generation, metrics, age = read_csv(bucket, metrics_blob_name, sep=',')
+                snp_codes, _ = pd.factorize(metrics['snpID'])
+                metrics = metrics.iloc[np.argsort(snp_codes, kind='stable')].reset_index(drop=True)
+                metrics['sample_idx'] = intern_sample_ids(metrics['Sample_ID'], sample_dict)
+                for col, categories in CODED_COLUMNS.items():
+                    metrics[col] = pd.Categorical(metrics[col], categories=categories)
+            metrics = metrics.astype({col: 'category' for col in metrics.columns if metrics[col].dtype == object})
+            return generation, metrics, age
+
+        # sample_idx depends on the release's sample dictionary, so loads are shared per release;
+        # in the store, the per-entry file lock also lets only one process build an entry
+        release_choice = st.session_state.get("release_choice", config.RELEASE_OPTIONS[0])
+        generation, metrics = load_shared(
+            bucket, blob_name, f"{bucket.name}/release{release_choice}/{blob_name}",
+            lambda: single_flight((bucket.name, release_choice, blob_name), fetch_metrics,
+                                  share=lambda result: (result[0], result[1].copy(), result[2]))
+        )
+        cache[f"{ancestry_choice}_{chr_choice}"] = metrics
+        cache[f"{ancestry_choice}_{chr_choice}_version"] = (release_choice, blob_name, generation)
     else:
-        metrics = st.session_state[f"{ancestry_choice}_{chr_choice}"]
+        metrics = cache[f"{ancestry_choice}_{chr_choice}"]
+
+    maf, full_maf = load_maf_data(bucket, ancestry_choice)
+    return metrics, maf, full_maf
+
+def metrics_version(ancestry_choice, chr_choice):
+    """
+    Version of the metrics load_metrics_data last loaded in the session for an ancestry and
+    chromosome, as (release, blob name, generation): their sample_idx refers to that release's
+    sample dictionary.
+    """
+    return session_cache().get(f"{ancestry_choice}_{chr_choice}_version")
+
+@traced('load')
+def load_maf_data(bucket, ancestry_choice):
+    maf_blob_name = f"cohort_browser/nba/snp_metrics/{ancestry_choice}/{ancestry_choice}_maf.afreq"
+    full_maf_blob_name = "cohort_browser/nba/snp_metrics/full_maf.afreq"
 
-    if f"{ancestry_choice}_maf" not in st.session_state:
+    cache = session_cache()
+    if f"{ancestry_choice}_maf" not in cache:
         maf = blob_as_csv(bucket, maf_blob_name, sep='\t')
-        st.session_state[f"{ancestry_choice}_maf"] = maf
+        cache[f"{ancestry_choice}_maf"] = maf
     else:
-        maf = st.session_state[f"{ancestry_choice}_maf"]
+        maf = cache[f"{ancestry_choice}_maf"]
 
-    if "full_maf" not in st.session_state:
+    if "full_maf" not in cache:
         full_maf = blob_as_csv(bucket, full_maf_blob_name, sep='\t')
-        st.session_state["full_maf"] = full_maf
+        cache["full_maf"] = full_maf
     else:
-        full_maf = st.session_state["full_maf"]
+        full_maf = cache["full_maf"]
 
-    return metrics, maf, full_maf
+    return maf, full_maf
+
+def ranged_generation(bucket, metrics_blob_name, ranges):
+    """
+    Generation of a metrics blob that per-SNP byte ranges were computed from.
+
+    Parameters:
+        bucket (google.cloud.storage.bucket.Bucket): GCloud bucket object.
+        metrics_blob_name (str): Path of the metrics CSV within the bucket.
+        ranges (pd.DataFrame): Per-SNP summary or index with byte_offset, byte_length,
+                               header_length and the metrics file's metrics_md5.
+
+    Returns:
+        int or None: The blob's current generation if its MD5 matches the one the ranges were
+                     computed from, otherwise None (also for ranges without a recorded MD5).
+    """
+    if 'byte_offset' not in ranges or 'metrics_md5' not in ranges or ranges.empty:
+        return None
+    blob = get_blob_info(bucket, metrics_blob_name)
+    if blob is None or blob.md5_hash is None or blob.md5_hash != ranges['metrics_md5'].iloc[0]:
+        return None
+    return blob.generation
+
+def read_byte_ranges(bucket, metrics_blob_name, snp_ranges, generation):
+    """
+    Read the header and one SNP's block of rows of a metrics CSV, pinned to `generation`.
+
+    Returns:
+        pd.DataFrame or None: The SNP's rows, or None if that generation has been replaced.
+    """
+    try:
+        header = download_blob(bucket, metrics_blob_name, start=0, end=int(snp_ranges['header_length']) - 1, generation=generation)
+        start = int(snp_ranges['byte_offset'])
+        rows = download_blob(bucket, metrics_blob_name, start=start, end=start + int(snp_ranges['byte_length']) - 1, generation=generation)
+    except FileNotFoundError:
+        return None
+    return pd.read_csv(BytesIO(header + rows), sep=',')
+
+@traced('load')
+def load_snp_summary(bucket, ancestry_choice, chr_choice):
+    """
+    Load the per-variant summary for one ancestry and chromosome.
+
+    Reads the precomputed chr{N}_summary.csv built by snp_summary_precompute.py. If it has
+    not been built yet, the summary is computed from the full sample-level metrics instead.
+    The summary's byte ranges are only kept in use (see load_snp_rows) when chr{N}_metrics.csv
+    is still the file they were computed from.
+
+    Parameters:
+        bucket (google.cloud.storage.bucket.Bucket): GCloud bucket object.
+        ancestry_choice (str): Ancestry label.
+        chr_choice (int): Chromosome number.
+
+    Returns:
+        pd.DataFrame: One row per SNP (see compute_snp_summary) with an added snp_label column.
+    """
+    summary_blob_name = f"cohort_browser/nba/snp_metrics/{ancestry_choice}/chr{chr_choice}_summary.csv"
+
+    cache = session_cache()
+    if f"{ancestry_choice}_{chr_choice}_summary" not in cache:
+        if has_artifact(bucket, summary_blob_name):
+            summary = blob_as_csv(bucket, summary_blob_name, sep=',')
+            metrics_blob_name = f"cohort_browser/nba/snp_metrics/{ancestry_choice}/chr{chr_choice}_metrics.csv"
+            summary['metrics_generation'] = ranged_generation(bucket, metrics_blob_name, summary)
+        else:
+            metrics, _, _ = load_metrics_data(bucket, ancestry_choice, chr_choice)
+            summary = compute_snp_summary(metrics)
+        summary['snp_label'] = summary['snpID'] + ' (' + summary['chromosome'].astype(str) + ':' + summary['position'].astype(str) + ')'
+        cache[f"{ancestry_choice}_{chr_choice}_summary"] = summary
+    else:
+        summary = cache[f"{ancestry_choice}_{chr_choice}_summary"]
+
+    return summary
+
+@traced('load')
+def load_snp_rows(bucket, ancestry_choice, chr_choice, snp_summary):
+    """
+    Load the sample-level metrics rows of a single SNP.
+
+    When the summary carries byte offsets into the generation of chr{N}_metrics.csv they were
+    computed from, only the header and that SNP's block of rows are downloaded from it with
+    ranged reads. Otherwise, or once that generation has been replaced, the rows are sliced
+    from the full chromosome metrics.
+
+    Parameters:
+        bucket (google.cloud.storage.bucket.Bucket): GCloud bucket object.
+        ancestry_choice (str): Ancestry label.
+        chr_choice (int): Chromosome number.
+        snp_summary (pd.Series): The SNP's row of the per-variant summary.
+    """
+    metrics_blob_name = f"cohort_browser/nba/snp_metrics/{ancestry_choice}/chr{chr_choice}_metrics.csv"
+
+    snp_df = None
+    if not pd.isnull(snp_summary.get('metrics_generation', np.nan)):
+        snp_df = read_byte_ranges(bucket, metrics_blob_name, snp_summary, int(snp_summary['metrics_generation']))
+    if snp_df is None:
+        metrics, _, _ = load_metrics_data(bucket, ancestry_choice, chr_choice)
+        return metrics[metrics['snpID'] == snp_summary['snpID']].reset_index(drop=True)
+
+    snp_df['sample_idx'] = intern_sample_ids(snp_df['Sample_ID'], get_sample_dictionary(bucket))
+    return snp_df
+
+def hwe_exact_pvalues(n_aa, n_ab, n_bb, max_cells=2**22):
+    """
+    Vectorized Hardy-Weinberg exact test (Wigginton et al., 2005) for many SNPs at once.
+
+    Each SNP's null distribution of heterozygote counts is evaluated in closed form from
+    log-factorials, so SNPs are processed as rows of a 2D array rather than one at a time.
+    SNPs are sorted by minor allele count and processed in chunks of at most `max_cells`
+    array cells to bound memory.
+
+    Parameters:
+        n_aa, n_ab, n_bb (array-like of int): Homozygous, heterozygous and homozygous counts per SNP.
+        max_cells (int, optional): Upper bound on the size of each intermediate chunk.
+
+    Returns:
+        np.ndarray: Exact HWE p-values (NaN where no genotypes were called).
+    """
+    n_aa = np.asarray(n_aa, dtype=np.int64)
+    n_ab = np.asarray(n_ab, dtype=np.int64)
+    n_bb = np.asarray(n_bb, dtype=np.int64)
+
+    n = n_aa + n_ab + n_bb
+    n_rare = 2 * np.minimum(n_aa, n_bb) + n_ab
+    n_common = 2 * n - n_rare
+    pvals = np.full(n.shape, np.nan)
+    if n.size == 0 or n.max() == 0:
+        return pvals
+
+    log_fact = np.concatenate([[0.0], np.cumsum(np.log(np.arange(1, 2 * n.max() + 1)))])
+    const = log_fact[n] + log_fact[n_rare] + log_fact[n_common] - log_fact[2 * n]
+
+    order = np.argsort(n_rare, kind='stable')
+    order = order[n[order] > 0]
+    start = 0
+    while start < len(order):
+        stop = start + 1
+        # grow the chunk while it stays under the cell budget for its widest SNP
+        while stop < len(order) and (stop - start + 1) * (n_rare[order[stop]] // 2 + 1) <= max_cells:
+            stop += 1
+        idx = order[start:stop]
+        width = n_rare[idx[-1]] // 2 + 1
+
+        rare = n_rare[idx][:, None]
+        common = n_common[idx][:, None]
+        het = (rare % 2) + 2 * np.arange(width)[None, :]
+        valid = het <= rare
+        het = np.where(valid, het, 0)
+        hom_rare = (rare - het) // 2
+        hom_common = (common - het) // 2
+
+        log_p = (const[idx][:, None] - log_fact[hom_rare] - log_fact[het] - log_fact[hom_common]
+                 + het * np.log(2.0))
+        log_p = np.where(valid, log_p, -np.inf)
+
+        obs_col = (n_ab[idx] - rare[:, 0] % 2) // 2
+        log_obs = log_p[np.arange(len(idx)), obs_col][:, None]
+        probs = np.exp(log_p - log_p.max(axis=1, keepdims=True))
+        as_extreme = log_p <= log_obs + 1e-7
+        pvals[idx] = np.minimum((probs * as_extreme).sum(axis=1) / probs.sum(axis=1), 1.0)
+        start = stop
+
+    return pvals
+
+@traced('load')
+def load_variant_index(bucket, chr_choice):
+    index_blob_name = f"cohort_browser/nba/snp_metrics/all_ancestries/chr{chr_choice}_index.csv"
+
+    cache = session_cache()
+    if f"all_ancestries_{chr_choice}_index" not in cache:
+        if has_artifact(bucket, index_blob_name):
+            variant_index = blob_as_csv(bucket, index_blob_name, sep=',')
+            metrics_blob_name = f"cohort_browser/nba/snp_metrics/all_ancestries/chr{chr_choice}_metrics.csv"
+            generation = ranged_generation(bucket, metrics_blob_name, variant_index)
+            # byte ranges into a metrics file they were not computed from are of no use
+            variant_index = variant_index.set_index('snpID').assign(metrics_generation=generation) if generation is not None else None
+        else:
+            variant_index = None
+        cache[f"all_ancestries_{chr_choice}_index"] = variant_index
+    else:
+        variant_index = cache[f"all_ancestries_{chr_choice}_index"]
+
+    return variant_index
+
+@traced('load')
+def load_snp_all_ancestries(bucket, chr_choice, snp_id):
+    """
+    Load one SNP's sample-level metrics for every ancestry from the variant-major layout.
+
+    The per-chromosome file under snp_metrics/all_ancestries/ stores each SNP's rows for all
+    ancestries contiguously, so a single ranged read returns them.
 
-def plot_clusters(df, x_col='theta', y_col='r', gtype_col='gt', title='SNP Plot'):
+    Returns:
+        pd.DataFrame or None: The SNP's rows with an ancestry column, or None if the
+                              variant-major layout has not been built for this SNP, or was
+                              built from metrics that have since been replaced.
+    """
+    variant_index = load_variant_index(bucket, chr_choice)
+    if variant_index is None or snp_id not in variant_index.index:
+        return None
+
+    snp_index = variant_index.loc[snp_id]
+    metrics_blob_name = f"cohort_browser/nba/snp_metrics/all_ancestries/chr{chr_choice}_metrics.csv"
+    return read_byte_ranges(bucket, metrics_blob_name, snp_index, int(snp_index['metrics_generation']))
+
+def ancestry_allele_frequencies(snp_df):
+    """
+    Per-ancestry sample counts, call rate and B allele / minor allele frequency from one SNP's genotype calls.
+    """
+    gt_counts = pd.crosstab(snp_df['ancestry'], snp_df['GT']).reindex(columns=config.SNP_GENOTYPES, fill_value=0)
+    called = gt_counts[['AA', 'AB', 'BB']].sum(axis=1)
+    freqs = pd.DataFrame({'Samples': gt_counts.sum(axis=1), 'Call Rate': called / gt_counts.sum(axis=1)})
+    freqs['B Allele Frequency'] = (gt_counts['AB'] + 2 * gt_counts['BB']) / (2 * called)
+    freqs['Minor Allele Frequency'] = np.minimum(freqs['B Allele Frequency'], 1 - freqs['B Allele Frequency'])
+    ancestry_order = [anc for anc in config.ANCESTRY_OPTIONS if anc in freqs.index]
+    return freqs.loc[ancestry_order].rename_axis('Ancestry')
+
+def display_cross_ancestry(snp_all_df, snp_label, n_cols=3):
+    """
+    Small-multiples view of one SNP's cluster plots and allele frequencies across ancestries.
+    """
+    st.markdown(f'#### {snp_label} Across Ancestries')
+    freqs = ancestry_allele_frequencies(snp_all_df)
+    st.dataframe(freqs.style.format({'Call Rate': '{:.3f}', 'B Allele Frequency': '{:.3f}', 'Minor Allele Frequency': '{:.3f}'}),
+                 use_container_width=True)
+
+    theta_range = [snp_all_df['Theta'].min() - 0.05, snp_all_df['Theta'].max() + 0.05]
+    r_range = [0, snp_all_df['R'].max() * 1.05]
+    ancestries = list(freqs.index)
+    for row_start in range(0, len(ancestries), n_cols):
+        cols = st.columns(n_cols)
+        for col, ancestry in zip(cols, ancestries[row_start:row_start + n_cols]):
+            anc_df = snp_all_df[snp_all_df['ancestry'] == ancestry]
+            fig = plot_clusters(anc_df, x_col='Theta', y_col='R', gtype_col='GT',
+                                title=f"{ancestry} (MAF {freqs.loc[ancestry, 'Minor Allele Frequency']:.3f})")
+            fig.update_layout(height=350, showlegend=False, margin=dict(l=10, r=10, t=40, b=10))
+            fig.update_xaxes(range=theta_range)
+            fig.update_yaxes(range=r_range)
+            col.plotly_chart(fig, use_container_width=True)
+
+def _genotype_counts(metrics):
+    """
+    Count genotypes per SNP and phenotype with a single bincount over integer codes.
+
+    Returns:
+        tuple: (codes of each row's SNP, unique snpIDs, counts array of shape
+               (n_snps, n_phenotypes, n_genotypes)).
+    """
+    snp_codes, snp_ids = pd.factorize(metrics['snpID'])
+    pheno_codes = pd.Categorical(metrics['phenotype'], categories=config.SNP_PHENOTYPES).codes
+    gt_codes = pd.Categorical(metrics['GT'], categories=config.SNP_GENOTYPES).codes
+
+    n_snps, n_phenos, n_gts = len(snp_ids), len(config.SNP_PHENOTYPES), len(config.SNP_GENOTYPES)
+    keep = (snp_codes >= 0) & (pheno_codes >= 0) & (gt_codes >= 0)
+    flat = (snp_codes[keep].astype(np.int64) * n_phenos + pheno_codes[keep]) * n_gts + gt_codes[keep]
+    counts = np.bincount(flat, minlength=n_snps * n_phenos * n_gts).reshape(n_snps, n_phenos, n_gts)
+    return snp_codes, snp_ids, counts
+
+def _genotype_table(snp_ids, counts):
+    index = pd.MultiIndex.from_product([snp_ids, config.SNP_PHENOTYPES], names=['snpID', 'phenotype'])
+    counts = counts.reshape(-1, len(config.SNP_GENOTYPES))
+    gt_table = pd.DataFrame(counts.astype(np.int32), index=index, columns=config.SNP_GENOTYPES)
+
+    total = counts.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        freqs = counts / total[:, None]
+        call_rate = (total - gt_table['NC'].to_numpy()) / total
+    for i, genotype in enumerate(config.SNP_GENOTYPES):
+        gt_table[f'{genotype}_freq'] = freqs[:, i].astype(np.float32)
+    gt_table['call_rate'] = call_rate.astype(np.float32)
+    gt_table['hwe_p'] = hwe_exact_pvalues(gt_table['AA'], gt_table['AB'], gt_table['BB'])
+
+    return gt_table
+
+@traced('compute')
+def compute_genotype_table(metrics):
+    """
+    Compute per-SNP, per-phenotype genotype statistics for a whole chromosome in one pass.
+
+    Genotype counts come from a single bincount over integer-coded SNP, phenotype and
+    genotype columns rather than per-SNP value_counts().
+
+    Parameters:
+        metrics (pd.DataFrame): Sample-level SNP metrics with snpID, phenotype and GT columns.
+
+    Returns:
+        pd.DataFrame: Table indexed by (snpID, phenotype) with AA/AB/BB/NC counts and
+                      frequencies, call rate and HWE exact-test p-value.
+    """
+    _, snp_ids, counts = _genotype_counts(metrics)
+    return _genotype_table(snp_ids, counts)
+
+def genotype_table_from_summary(summary):
+    """
+    Same as compute_genotype_table, using the genotype counts stored in the per-variant summary.
+    """
+    count_cols = [f'{pheno}_{gt}' for pheno in config.SNP_PHENOTYPES for gt in config.SNP_GENOTYPES]
+    counts = summary[count_cols].to_numpy(dtype=np.int64)
+    return _genotype_table(pd.Index(summary['snpID']), counts)
+
+@traced('compute')
+def compute_snp_summary(metrics):
+    """
+    Build the per-variant summary of a chromosome's sample-level SNP metrics.
+
+    Parameters:
+        metrics (pd.DataFrame): Sample-level SNP metrics.
+
+    Returns:
+        pd.DataFrame: One row per SNP, in order of first appearance, with chromosome, position,
+                      GenTrain_Score, n_samples, call_rate, per-phenotype genotype counts
+                      ({phenotype}_{GT}) and per-genotype Theta/R centroids and spreads
+                      ({GT}_{Theta,R}_{mean,std}).
+    """
+    snp_codes, snp_ids, counts = _genotype_counts(metrics)
+    first_rows = metrics.drop_duplicates('snpID')
+
+    summary = pd.DataFrame({
+        'snpID': np.asarray(snp_ids, dtype=object),
+        'chromosome': first_rows['chromosome'].to_numpy(),
+        'position': first_rows['position'].to_numpy(),
+        'GenTrain_Score': first_rows['GenTrain_Score'].to_numpy(dtype=np.float32),
+        'n_samples': np.bincount(snp_codes[snp_codes >= 0], minlength=len(snp_ids)).astype(np.int32),
+    })
+    total = counts.sum(axis=(1, 2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summary['call_rate'] = ((total - counts[:, :, -1].sum(axis=1)) / total).astype(np.float32)
+
+    for i, pheno in enumerate(config.SNP_PHENOTYPES):
+        for j, gt in enumerate(config.SNP_GENOTYPES):
+            summary[f'{pheno}_{gt}'] = counts[:, i, j].astype(np.int32)
+
+    # centroids and spreads from per-(SNP, genotype) sums and sums of squares
+    n_gts = len(config.SNP_GENOTYPES)
+    gt_codes = pd.Categorical(metrics['GT'], categories=config.SNP_GENOTYPES).codes
+    keep = (snp_codes >= 0) & (gt_codes >= 0)
+    flat = snp_codes[keep].astype(np.int64) * n_gts + gt_codes[keep]
+    size = len(snp_ids) * n_gts
+    n = np.bincount(flat, minlength=size).reshape(-1, n_gts)
+    for col in ['Theta', 'R']:
+        values = metrics[col].to_numpy(dtype=np.float64)[keep]
+        sums = np.bincount(flat, weights=values, minlength=size).reshape(-1, n_gts)
+        sq_sums = np.bincount(flat, weights=values ** 2, minlength=size).reshape(-1, n_gts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = sums / n
+            std = np.sqrt(np.maximum(sq_sums - n * mean ** 2, 0) / (n - 1))
+        for j, gt in enumerate(config.SNP_GENOTYPES):
+            summary[f'{gt}_{col}_mean'] = mean[:, j].astype(np.float32)
+            summary[f'{gt}_{col}_std'] = np.where(n[:, j] > 1, std[:, j], np.nan).astype(np.float32)
+
+    return summary
+
+@traced('compute')
+def filter_snp_summary(summary, gentrain_range, sort_choice):
+    """
+    Restrict the per-variant summary to a GenTrain Score range and order it for the SNP picker.
+
+    Parameters:
+        summary (pd.DataFrame): Output of load_snp_summary.
+        gentrain_range (tuple of float): Inclusive [min, max] GenTrain Score.
+        sort_choice (str): One of config.SNP_SORT_OPTIONS.
+    """
+    in_range = summary['GenTrain_Score'].between(*gentrain_range)
+    snp_view = summary[in_range]
+    sort_cols = config.SNP_SORT_OPTIONS[sort_choice]
+    if sort_cols:
+        snp_view = snp_view.sort_values(sort_cols, kind='stable')
+    return snp_view
+
+@traced('load')
+def load_genotype_table(summary, ancestry_choice, chr_choice):
+    cache = session_cache()
+    if f"{ancestry_choice}_{chr_choice}_gt_table" not in cache:
+        gt_table = genotype_table_from_summary(summary)
+        cache[f"{ancestry_choice}_{chr_choice}_gt_table"] = gt_table
+    else:
+        gt_table = cache[f"{ancestry_choice}_{chr_choice}_gt_table"]
+
+    return gt_table
+
+@traced('compute')
+def association_scan(gt_table, variant_info):
+    """
+    Case-control association scan for every SNP in a chromosome as array operations.
+
+    Computes the allelic chi-square test and the Cochran-Armitage trend test (additive
+    genotype scores 0/1/2) from the per-SNP genotype counts in `gt_table`.
+
+    Parameters:
+        gt_table (pd.DataFrame): Output of compute_genotype_table.
+        variant_info (pd.DataFrame): One row per snpID with chromosome and position columns.
+
+    Returns:
+        pd.DataFrame: One row per SNP with allele counts, allelic odds ratio (B allele),
+                      chi-square statistics and p-values.
+    """
+    called = ['AA', 'AB', 'BB']
+    counts = gt_table[called].to_numpy(dtype=np.float64).reshape(-1, len(config.SNP_PHENOTYPES), 3)
+    controls = counts[:, config.SNP_PHENOTYPES.index('Control')]
+    cases = counts[:, config.SNP_PHENOTYPES.index('PD')]
+    snp_ids = gt_table.index.get_level_values('snpID')[::len(config.SNP_PHENOTYPES)]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # allelic 2x2 table: rows = case/control, columns = A/B allele
+        case_a, case_b = 2 * cases[:, 0] + cases[:, 1], 2 * cases[:, 2] + cases[:, 1]
+        ctrl_a, ctrl_b = 2 * controls[:, 0] + controls[:, 1], 2 * controls[:, 2] + controls[:, 1]
+        n_alleles = case_a + case_b + ctrl_a + ctrl_b
+        allelic_chi2 = (n_alleles * (case_a * ctrl_b - case_b * ctrl_a) ** 2
+                        / ((case_a + case_b) * (ctrl_a + ctrl_b) * (case_a + ctrl_a) * (case_b + ctrl_b)))
+        odds_ratio = (case_b * ctrl_a) / (case_a * ctrl_b)
+
+        scores = np.array([0.0, 1.0, 2.0])
+        totals = cases + controls
+        n_cases, n = cases.sum(axis=1), totals.sum(axis=1)
+        n_controls = n - n_cases
+        score_cases, score_total = cases @ scores, totals @ scores
+        trend_chi2 = (n * (n * score_cases - n_cases * score_total) ** 2
+                      / (n_cases * n_controls * (n * (totals @ scores ** 2) - score_total ** 2)))
+
+    assoc = pd.DataFrame({
+        'snpID': snp_ids,
+        'case_A': case_a.astype(np.int32),
+        'case_B': case_b.astype(np.int32),
+        'control_A': ctrl_a.astype(np.int32),
+        'control_B': ctrl_b.astype(np.int32),
+        'OR': odds_ratio,
+        'allelic_chi2': allelic_chi2,
+        'allelic_p': chi2.sf(allelic_chi2, df=1),
+        'trend_chi2': trend_chi2,
+        'trend_p': chi2.sf(trend_chi2, df=1),
+    })
+    assoc = variant_info[['snpID', 'chromosome', 'position']].merge(assoc, on='snpID', how='right')
+    return assoc
+
+@traced('load')
+def load_association_scan(summary, gt_table, release_choice, ancestry_choice, chr_choice):
+    assoc_key = f"release{release_choice}_{ancestry_choice}_{chr_choice}_assoc"
+    cache = session_cache()
+    if assoc_key not in cache:
+        assoc = association_scan(gt_table, summary)
+        cache[assoc_key] = assoc
+    else:
+        assoc = cache[assoc_key]
+
+    return assoc
+
+@traced('compute')
+def decimate_manhattan(assoc, p_col='trend_p', p_threshold=None, bins=None):
+    """
+    Thin out non-significant points before plotting a Manhattan plot.
+
+    Points with p below `p_threshold` are always kept. The rest are binned on a
+    position x -log10(p) grid and only one point is kept per occupied cell, which
+    leaves the plot visually unchanged at screen resolution.
+
+    Parameters:
+        assoc (pd.DataFrame): Output of association_scan.
+        p_col (str, optional): P-value column to plot. Defaults to 'trend_p'.
+        p_threshold (float, optional): Significance cutoff below which points are never dropped.
+        bins (list of int, optional): Number of [position, -log10(p)] grid cells.
+
+    Returns:
+        pd.DataFrame: Subset of `assoc` with a 'log10_p' column (-log10 of `p_col`).
+    """
+    p_threshold = config.ASSOC_DECIMATE_P if p_threshold is None else p_threshold
+    x_bins, y_bins = config.ASSOC_DECIMATE_BINS if bins is None else bins
+
+    assoc = assoc[assoc[p_col].notnull()]
+    log10_p = -np.log10(np.clip(assoc[p_col].to_numpy(), 1e-300, 1.0))
+    position = assoc['position'].to_numpy(dtype=np.float64)
+    significant = log10_p > -np.log10(p_threshold)
+
+    pos_min = position.min() if len(position) else 0.0
+    span = max(position.max() - pos_min, 1.0) if len(position) else 1.0
+    x_cell = np.minimum(((position - pos_min) / span * x_bins).astype(np.int64), x_bins - 1)
+    y_cell = np.minimum((log10_p / -np.log10(p_threshold) * y_bins).astype(np.int64), y_bins - 1)
+    cell = np.where(significant, -1, x_cell * y_bins + y_cell)
+    _, first = np.unique(cell[~significant], return_index=True)
+    keep = np.flatnonzero(significant)
+    keep = np.sort(np.concatenate([keep, np.flatnonzero(~significant)[first]]))
+
+    decimated = assoc.iloc[keep].copy()
+    decimated['log10_p'] = log10_p[keep]
+    return decimated
+
+@traced('figure')
+def plot_manhattan(decimated, title='Case-Control Association', genome_wide_p=None):
+    genome_wide_p = config.ASSOC_GENOME_WIDE_P if genome_wide_p is None else genome_wide_p
+
+    fig = go.Figure(go.Scattergl(
+        x=decimated['position'],
+        y=decimated['log10_p'],
+        mode='markers',
+        marker=dict(size=5, color="#332288", opacity=0.7),
+        text=decimated['snpID'],
+        hovertemplate="%{text}<br>Position: %{x}<br>-log10(p): %{y:.2f}<extra></extra>"
+    ))
+    fig.add_hline(y=-np.log10(genome_wide_p), line_dash='dash', line_color="#CC6677")
+    fig.update_layout(
+        title=title,
+        xaxis_title='Position',
+        yaxis_title='-log10(p)',
+        height=450,
+        margin=dict(r=20, t=63, b=50)
+    )
+    return fig
+
+@traced('figure')
+def plot_clusters(df, x_col='theta', y_col='r', gtype_col='gt', title='SNP Plot', highlight=None):
     d3 = px.colors.qualitative.D3
     cmap = {'AA': d3[0], 'AB': d3[1], 'BB': d3[2], 'NC': d3[3]}
     smap = {'Control': 'circle', 'PD': 'diamond-open-dot'}
 
-    fig = px.scatter(
+    fig = figure_utils.scatter(
         df,
         x=x_col,
         y=y_col,
         color=gtype_col,
-        color_discrete_map=cmap,
+        color_map=cmap,
         symbol='phenotype',
         symbol_map=smap,
         title=title,
@@ -49,12 +643,20 @@ def plot_clusters(df, x_col='theta', y_col='r', gtype_col='gt', title='SNP Plot'
         height=497,
         labels={'r': 'R', 'theta': 'Theta'}
     )
+    if highlight is not None:
+        fig.add_trace(go.Scatter(
+            x=highlight[x_col],
+            y=highlight[y_col],
+            mode='markers',
+            marker=dict(size=16, color='red', symbol='star', line=dict(width=1, color='black')),
+            name='Selected Sample',
+            text=highlight['Sample_ID'],
+            hovertemplate="%{text}<br>Theta: %{x}<br>R: %{y}<extra></extra>"
+        ))
     fig.update_layout(margin=dict(r=76, t=63, b=75), legend_title_text='Genotype')
     return fig
 
-def display_snp_metrics(metrics, maf, full_maf, ancestry_choice, snp_label):
-    snp_df = metrics[metrics['snp_label'] == snp_label].reset_index(drop=True)
-
+def display_snp_metrics(snp_df, maf, full_maf, gt_table, ancestry_choice, snp_label):
     cluster_plot = plot_clusters(snp_df, x_col='Theta', y_col='R', gtype_col='GT', title=snp_label)
     col1, col2 = st.columns([2.5, 1])
 
@@ -68,9 +670,14 @@ def display_snp_metrics(metrics, maf, full_maf, ancestry_choice, snp_label):
         st.metric(f"Minor Allele Frequency within {ancestry_choice}", f"{within_ancestry_maf['ALT_FREQS'].iloc[0]:.3f}")
         st.metric("Minor Allele Frequency across ancestries", f"{across_ancestry_maf['ALT_FREQS'].iloc[0]:.3f}")
 
-        for phenotype in ['Control', 'PD']:
+        for phenotype in config.SNP_PHENOTYPES:
             with st.expander(f"**{phenotype} Genotype Distribution**"):
-                gt_counts = snp_df[snp_df['phenotype'] == phenotype]['GT'].value_counts().rename_axis('Genotype').reset_index(name='Counts')
-                gt_rel_counts = snp_df[snp_df['phenotype'] == phenotype]['GT'].value_counts(normalize=True).rename_axis('Genotype').reset_index(name='Frequency')
-                gt_counts = pd.concat([gt_counts, gt_rel_counts['Frequency']], axis=1)
-                st.table(gt_counts)
\ No newline at end of file
+                pheno_stats = gt_table.loc[(snp_df['snpID'].iloc[0], phenotype)]
+                gt_counts = pd.DataFrame({
+                    'Genotype': config.SNP_GENOTYPES,
+                    'Counts': pheno_stats[config.SNP_GENOTYPES].to_numpy(dtype=int),
+                    'Frequency': pheno_stats[[f'{gt}_freq' for gt in config.SNP_GENOTYPES]].to_numpy(dtype=float)
+                })
+                gt_counts = gt_counts[gt_counts['Counts'] > 0].sort_values('Counts', ascending=False, kind='stable')
+                st.table(gt_counts.reset_index(drop=True))
+                st.caption(f"Call rate: {pheno_stats['call_rate']:.3f} | HWE exact p-value: {pheno_stats['hwe_p']:.3g}")
\ No newline at end of file
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+from io import BytesIO
+from utils.config import AppConfig
+
+config = AppConfig()
+
+VARIANT_COLUMNS = ['snpID', 'chromosome', 'position', 'GenTrain_Score', 'Ref', 'Alt']
+QUANTIZED_COLUMNS = ['Theta', 'R']
+CODED_COLUMNS = {'GT': config.SNP_GENOTYPES, 'phenotype': config.SNP_PHENOTYPES}
+QUANT_MAX = np.iinfo(np.uint16).max - 1  # top value is reserved for NaN
+
+
+def quantize(values):
+    """
+    Quantize floats to uint16 over their observed [min, max] range.
+
+    Returns:
+        tuple: (uint16 array, offset, scale) such that values ~= offset + codes * scale.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values)
+    lo = values[finite].min() if finite.any() else 0.0
+    hi = values[finite].max() if finite.any() else 0.0
+    scale = (hi - lo) / QUANT_MAX if hi > lo else 1.0
+    codes = np.full(values.shape, QUANT_MAX + 1, dtype=np.uint16)
+    codes[finite] = np.rint((values[finite] - lo) / scale).astype(np.uint16)
+    return codes, lo, scale
+
+
+def dequantize(codes, offset, scale, dtype=np.float32):
+    values = (offset + codes.astype(np.float64) * scale).astype(dtype)
+    values[codes == QUANT_MAX + 1] = np.nan
+    return values
+
+
+def encode_compact_metrics(metrics):
+    """
+    Encode sample-level SNP metrics into compact arrays.
+
+    Rows are grouped by variant and described by a CSR-style `variant_offsets` array into a
+    separate per-variant table, Theta/R are quantized to uint16, GT/phenotype become int8
+    codes and Sample_ID becomes an int32 index into a sample table. Any other column is kept
+    as is under extra/{col} (string columns as codes into their distinct values).
+
+    Parameters:
+        metrics (pd.DataFrame): Sample-level metrics as stored in chr{N}_metrics.csv.
+
+    Returns:
+        dict: Mapping of array name to np.ndarray, ready for np.savez_compressed.
+
+    Raises:
+        ValueError: If a row has no snpID, or a GT or phenotype value is not one of
+                    config.SNP_GENOTYPES or config.SNP_PHENOTYPES (missing values are kept).
+    """
+    if metrics['snpID'].isna().any():
+        raise ValueError(f"{metrics['snpID'].isna().sum()} rows have no snpID")
+    for col, categories in CODED_COLUMNS.items():
+        unknown = set(metrics[col].dropna().unique()) - set(categories)
+        if unknown:
+            raise ValueError(f"unknown {col} values {sorted(map(str, unknown))}; expected one of {categories}")
+
+    snp_codes, snp_ids = pd.factorize(metrics['snpID'])
+    order = np.argsort(snp_codes, kind='stable')
+    metrics = metrics.iloc[order].reset_index(drop=True)
+    snp_codes = snp_codes[order]
+
+    compact = {'variant_offsets': np.concatenate([[0], np.cumsum(np.bincount(snp_codes, minlength=len(snp_ids)))]).astype(np.int64)}
+
+    first_rows = metrics.drop_duplicates('snpID')
+    for col in VARIANT_COLUMNS:
+        if col in first_rows:
+            values = first_rows[col].to_numpy()
+            compact[f'variant/{col}'] = values.astype(str) if values.dtype == object else values
+
+    sample_codes, sample_ids = pd.factorize(metrics['Sample_ID'])
+    compact['sample_index'] = sample_codes.astype(np.int32)
+    compact['samples'] = np.asarray(sample_ids, dtype=str)
+
+    for col in QUANTIZED_COLUMNS:
+        compact[col], offset, scale = quantize(metrics[col])
+        compact[f'{col}_quant'] = np.array([offset, scale])
+
+    for col, categories in CODED_COLUMNS.items():
+        compact[col] = pd.Categorical(metrics[col], categories=categories).codes.astype(np.int8)
+
+    known = set(VARIANT_COLUMNS) | set(QUANTIZED_COLUMNS) | set(CODED_COLUMNS) | {'Sample_ID'}
+    for col in metrics.columns.difference(list(known), sort=False):
+        values = metrics[col].to_numpy()
+        if values.dtype == object:
+            codes, uniques = pd.factorize(metrics[col])
+            compact[f'extra/{col}'] = codes.astype(np.int32)
+            compact[f'extra/{col}/values'] = np.asarray(uniques, dtype=str)
+        else:
+            compact[f'extra/{col}'] = values
+
+    return compact
+
+
+def write_compact_metrics(metrics, path):
+    np.savez_compressed(path, **encode_compact_metrics(metrics))
+
+
+def decode_compact_metrics(compact_bytes):
+    """
+    Decode a compact metrics file straight into NumPy arrays, dequantizing Theta and R to float32.
+    """
+    with np.load(BytesIO(compact_bytes), allow_pickle=False) as npz:
+        compact = {name: npz[name] for name in npz.files}
+    for col in QUANTIZED_COLUMNS:
+        offset, scale = compact.pop(f'{col}_quant')
+        compact[col] = dequantize(compact[col], offset, scale)
+    return compact
+
+
+def compact_metrics_frame(compact, variant_idx=None):
+    """
+    Build the sample-level metrics DataFrame the SNP Metrics page works with from compact arrays.
+
+    Parameters:
+        compact (dict): Output of decode_compact_metrics.
+        variant_idx (int, optional): Only return the rows of this variant.
+
+    Returns:
+        pd.DataFrame: Metrics with categorical snpID, Sample_ID, GT and phenotype columns, plus
+                      the extra columns of the encoded metrics (string ones categorical).
+    """
+    offsets = compact['variant_offsets']
+    if variant_idx is None:
+        rows = slice(0, offsets[-1])
+        variant_codes = np.repeat(np.arange(len(offsets) - 1, dtype=np.int32), np.diff(offsets))
+    else:
+        rows = slice(offsets[variant_idx], offsets[variant_idx + 1])
+        variant_codes = np.full(offsets[variant_idx + 1] - offsets[variant_idx], variant_idx, dtype=np.int32)
+
+    metrics = pd.DataFrame({
+        'snpID': pd.Categorical.from_codes(variant_codes, categories=compact['variant/snpID']),
+        'Sample_ID': pd.Categorical.from_codes(compact['sample_index'][rows], categories=compact['samples']),
+    })
+    for col in VARIANT_COLUMNS[1:]:
+        if f'variant/{col}' in compact:
+            metrics[col] = compact[f'variant/{col}'][variant_codes]
+    for col in QUANTIZED_COLUMNS:
+        metrics[col] = compact[col][rows]
+    for col, categories in CODED_COLUMNS.items():
+        metrics[col] = pd.Categorical.from_codes(compact[col][rows], categories=categories)
+    for name in compact:
+        if name.startswith('extra/') and not name.endswith('/values'):
+            col = name[len('extra/'):]
+            if f'{name}/values' in compact:
+                metrics[col] = pd.Categorical.from_codes(compact[name][rows], categories=compact[f'{name}/values'])
+            else:
+                metrics[col] = compact[name][rows]
+
+    return metrics
@@ -0,0 +1,234 @@
+import sys
+import time
+import json
+import inspect
+import logging
+import functools
+import threading
+import pandas as pd
+import streamlit as st
+from contextlib import contextmanager
+from utils.profiling_utils import SamplingProfiler, profiling_enabled, render_profile
+from utils.session_cache_utils import account_session, admin_view_enabled, render_session_memory, session_run
+from utils.memory_utils import start_memory_watchdog, render_memory_pressure
+from utils.config import AppConfig
+
+config = AppConfig()
+logger = logging.getLogger('gp2_browser.trace')
+
+SPAN_KINDS = ['storage', 'parse', 'load', 'compute', 'figure']
+
+_local = threading.local()
+
+
+class Trace:
+    """
+    Timed spans recorded during one run of a page script.
+    """
+    def __init__(self, page):
+        self.page = page
+        self.spans = []
+        self.stack = []
+        self.start = time.perf_counter()
+        self.total_ms = None
+
+    def finish(self):
+        if self.total_ms is None:
+            self.total_ms = 1000 * (time.perf_counter() - self.start)
+
+    def frame(self):
+        """
+        Spans in call order, with self time (time not spent in child spans).
+        """
+        spans = pd.DataFrame(self.spans, columns=['name', 'kind', 'depth', 'start_ms', 'ms', 'bytes', 'rows', 'parent'])
+        child_ms = spans.groupby('parent')['ms'].sum()
+        # children adopted from the figure pool ran concurrently, and can add up to more than their parent
+        spans['self_ms'] = (spans['ms'] - spans.index.map(child_ms).fillna(0)).clip(lower=0)
+        return spans.drop(columns='parent')
+
+    def log(self):
+        logger.info(json.dumps({
+            'event': 'page_trace',
+            'page': self.page,
+            'total_ms': round(self.total_ms, 1),
+            'spans': [
+                {key: (round(value, 1) if isinstance(value, float) else value) for key, value in span.items() if value is not None}
+                for span in self.spans
+            ],
+        }))
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def span(name, kind='compute'):
+    """
+    Time a block as a span of the current page's trace; a no-op outside a traced page run.
+
+    Yields:
+        dict or None: The span record, to which byte and row counts can be added.
+    """
+    trace = current_trace()
+    if trace is None:
+        yield None
+        return
+
+    record = {
+        'name': name,
+        'kind': kind,
+        'depth': len(trace.stack),
+        'start_ms': 1000 * (time.perf_counter() - trace.start),
+        'ms': None,
+        'bytes': None,
+        'rows': None,
+        'parent': trace.stack[-1] if trace.stack else None,
+    }
+    trace.stack.append(len(trace.spans))
+    trace.spans.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['ms'] = 1000 * (time.perf_counter() - start)
+        trace.stack.pop()
+
+
+def run_traced(func, *args):
+    """
+    Call func(*args), recording its spans in a trace of its own: for work done off the page
+    script's thread (e.g. figures built on the figure pool), where the page's trace is not current.
+    Span start times are perf_counter times in ms, for adopt_spans.
+
+    Returns:
+        tuple: (result, spans)
+    """
+    trace = Trace(None)
+    trace.start = 0.0
+    _local.trace = trace
+    try:
+        return func(*args), trace.spans
+    finally:
+        _local.trace = None
+
+
+def adopt_spans(spans):
+    """
+    Add spans recorded by run_traced to the current page's trace, as children of the current span.
+    """
+    trace = current_trace()
+    if trace is None:
+        return
+    offset = len(trace.spans)
+    parent = trace.stack[-1] if trace.stack else None
+    for record in spans:
+        trace.spans.append({
+            **record,
+            'depth': len(trace.stack) + record['depth'],
+            'start_ms': record['start_ms'] - 1000 * trace.start,
+            'parent': parent if record['parent'] is None else offset + record['parent'],
+        })
+
+
+def traced(kind='compute', name=None, label_arg=None):
+    """
+    Decorator recording every call of a function as a span, with the size of bytes/str results
+    and the row count of DataFrame results.
+
+    Parameters:
+        kind (str): One of SPAN_KINDS.
+        name (str, optional): Span name. Defaults to the function's name.
+        label_arg (str, optional): Parameter whose value is appended to the span name, e.g. a blob path.
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+        label_index = list(inspect.signature(func).parameters).index(label_arg) if label_arg else None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if current_trace() is None:
+                return func(*args, **kwargs)
+            full_name = span_name
+            if label_arg is not None:
+                label = kwargs[label_arg] if label_arg in kwargs else args[label_index] if label_index < len(args) else None
+                full_name = f'{span_name} {label}'
+            with span(full_name, kind) as record:
+                result = func(*args, **kwargs)
+                if isinstance(result, (bytes, str)):
+                    record['bytes'] = len(result)
+                elif isinstance(result, pd.DataFrame):
+                    record['rows'] = len(result)
+                return result
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def trace_page(page):
+    """
+    Trace one run of a page: spans recorded while it runs are logged as one structured
+    'page_trace' record, and shown in the debug panel when it is enabled. When profiling is
+    enabled the run is also sampled (see profiling_utils); otherwise no profiler is started.
+    Complete runs also update the session's memory accounting (see session_cache_utils), and
+    the first run starts the process's memory watchdog (see memory_utils).
+    """
+    start_memory_watchdog()
+    trace = Trace(page) if config.TRACING else None
+    _local.trace = trace
+    profiler = None
+    if profiling_enabled():
+        # stacks are sampled from the page script's module frame inwards
+        frame = sys._getframe()
+        while frame.f_code.co_name != '<module>':
+            frame = frame.f_back
+        profiler = SamplingProfiler(frame.f_code.co_filename).start()
+    try:
+        with session_run():
+            yield trace
+        if profiler is not None:
+            profiler.stop()
+            render_profile(profiler, page)
+        # reruns and st.stop() end the run early through exceptions; the panel is only shown for complete runs
+        if trace is not None and debug_panel_enabled():
+            trace.finish()
+            render_debug_panel(trace)
+        account_session()
+        if admin_view_enabled():
+            render_session_memory()
+            render_memory_pressure()
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        _local.trace = None
+        if trace is not None:
+            trace.finish()
+            trace.log()
+
+
+def debug_panel_enabled():
+    return config.DEBUG_PANEL or st.query_params.get('debug') == '1'
+
+
+def render_debug_panel(trace):
+    """
+    Show where the run's time went: self time per kind of span and every span in call order.
+    Time outside any span is Streamlit building and serializing page elements.
+    """
+    spans = trace.frame()
+    by_kind = spans.groupby('kind')['self_ms'].sum().reindex(SPAN_KINDS, fill_value=0)
+    other_ms = trace.total_ms - spans.loc[spans['depth'] == 0, 'ms'].sum()
+
+    with st.expander(f'Performance trace: {trace.total_ms:,.0f} ms', expanded=True):
+        cols = st.columns(len(SPAN_KINDS) + 1)
+        for col, kind in zip(cols, SPAN_KINDS):
+            col.metric(kind.capitalize(), f'{by_kind[kind]:,.0f} ms')
+        cols[-1].metric('Other', f'{other_ms:,.0f} ms', help='Streamlit elements, widgets and serialization outside any span.')
+
+        spans['name'] = ['  ' * depth + name for depth, name in zip(spans['depth'], spans['name'])]
+        st.dataframe(
+            spans[['name', 'kind', 'start_ms', 'ms', 'self_ms', 'bytes', 'rows']],
+            hide_index=True,
+            use_container_width=True,
+            column_config={col: st.column_config.NumberColumn(format='%.1f') for col in ['start_ms', 'ms', 'self_ms']}
+        )